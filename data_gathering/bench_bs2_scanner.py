@@ -0,0 +1,76 @@
+# benchmark for the BiG-SCAPE 2 log scanner in get_bs2_matrix
+#
+# writes a large synthetic log with make_synthetic_sweep.write_bs2_log,
+# then parses it with the old line by line parser (strptime on every line)
+# and with the block scanner, checks they agree and prints lines/second
+
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from get_bs2_matrix import MARKERS, PHASES, get_execution_time
+from make_synthetic_sweep import SWEEP_START, write_bs2_log
+from phase_table import to_ns
+
+
+def get_execution_time_linewise(log_file: Path):
+    # the parser as it was before the block scanner, kept as a reference
+    timestamps = PHASES.new_row()
+    with open(log_file, "r") as file:
+        for line in file:
+            parts = line.split(maxsplit=3)
+            if len(parts) != 4:
+                continue
+            date, time, _loglevel, log = parts
+
+            parsed_time = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M:%S,%f")
+
+            for name, kind, phrase in MARKERS:
+                if kind == "startswith" and log.startswith(phrase):
+                    timestamps[PHASES.index(name)] = to_ns(parsed_time)
+                if kind == "endswith" and log.endswith(phrase):
+                    timestamps[PHASES.index(name)] = to_ns(parsed_time)
+
+    return timestamps
+
+
+def time_parser(parser, path: Path, repeats: int):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = parser(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--lines", type=int, default=2_000_000)
+    parser.add_argument("-r", "--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = Path(tmp) / "synthetic.log"
+        # make_synthetic_sweep writes 10 lines per record by default
+        line_count = write_bs2_log(log_file, args.lines // 10, SWEEP_START, random.Random(0))
+        size_mb = log_file.stat().st_size / 1024 / 1024
+
+        print(f"synthetic log: {line_count} lines, {size_mb:.1f} MB")
+
+        old_result, old_time = time_parser(get_execution_time_linewise, log_file, args.repeats)
+        new_result, new_time = time_parser(get_execution_time, log_file, args.repeats)
+
+        if old_result != new_result:
+            print("MISMATCH between line by line parser and block scanner")
+            print(old_result)
+            print(new_result)
+            exit(1)
+
+        print("parser,seconds,lines_per_second,mb_per_second")
+        for name, elapsed in [("line by line", old_time), ("block scanner", new_time)]:
+            print(f"{name},{elapsed:.3f},{line_count / elapsed:.0f},{size_mb / elapsed:.1f}")
+        print(f"speedup: {old_time / new_time:.1f}x")
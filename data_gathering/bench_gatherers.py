@@ -0,0 +1,232 @@
+# benchmark harness for the data gathering scripts
+#
+# for every scale (number of records per run) a synthetic sweep is written
+# with make_synthetic_sweep, and every gatherer is run against it in its own
+# process. wall time, throughput and the peak RSS of that process (and its
+# pool workers) are reported as csv:
+# gatherer,scale,runs,input_mb,seconds,runs_per_second,mb_per_second,peak_rss_mb,exit_code
+#
+# with --baseline, the seconds of an earlier results file are put next to the
+# new ones, so changes to the gatherers can be measured against it
+#
+# with --fs_latency, every stat, scandir, open and sqlite connect of the
+# gatherers first sleeps that many milliseconds, like a round trip to the
+# metadata server of a network filesystem. the sleep releases the GIL the
+# same way the real call does, so it shows what --io_threads hides
+
+from argparse import ArgumentParser
+from pathlib import Path
+import csv
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from make_synthetic_sweep import make_sweep
+
+SCRIPT_FOLDER = Path(__file__).resolve().parent
+
+# wraps the file system calls of a gatherer, loaded through PYTHONPATH
+LATENCY_SITECUSTOMIZE = """
+import builtins, os, sqlite3, time
+
+LATENCY = float(os.environ["BENCH_FS_LATENCY_MS"]) / 1000
+
+
+def delayed(func):
+    def call(*args, **kwargs):
+        time.sleep(LATENCY)
+        return func(*args, **kwargs)
+
+    return call
+
+
+os.stat = delayed(os.stat)
+os.lstat = delayed(os.lstat)
+os.scandir = delayed(os.scandir)
+builtins.open = delayed(builtins.open)
+sqlite3.connect = delayed(sqlite3.connect)
+"""
+
+# gatherers that take --io_threads
+IO_GATHERERS = ["bs1_matrix", "bs1_crash_estimation", "bigslice_matrix"]
+
+# gatherer -> (script, input folders relative to the sweep, takes --jobs)
+GATHERERS = {
+    "bs1_matrix": ("get_bs1_matrix.py", ["bs1"], True),
+    "bs1_crash_estimation": ("get_bs1_crash_estimation.py", ["bs1"], False),
+    "bs2_matrix": ("get_bs2_matrix.py", ["bs2"], True),
+    "bigslice_matrix": ("get_bigslice_matrix.py", ["bigslice"], True),
+    "performance_run": ("get_performance_run.py", ["profiles/v1", "profiles/v2"], False),
+}
+
+RESULT_COLUMNS = [
+    "gatherer",
+    "scale",
+    "runs",
+    "input_mb",
+    "seconds",
+    "runs_per_second",
+    "mb_per_second",
+    "peak_rss_mb",
+    "exit_code",
+]
+
+
+def folder_size(path: Path):
+    total = 0
+    for root, _folders, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def run_gatherer(command: list[str], stderr_file, env: dict | None = None):
+    # os.wait4 gives the resource usage of exactly this child, including the
+    # peak RSS of any workers it waited for
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr_file, env=env)
+    _pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    return elapsed, usage.ru_maxrss / 1024, os.waitstatus_to_exitcode(status)
+
+
+def latency_env(latency_ms: float, folder: Path):
+    # environment that loads LATENCY_SITECUSTOMIZE into the gatherers
+    (folder / "sitecustomize.py").write_text(LATENCY_SITECUSTOMIZE)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(folder), *filter(None, [env.get("PYTHONPATH")])])
+    env["BENCH_FS_LATENCY_MS"] = str(latency_ms)
+    return env
+
+
+def bench_scale(
+    sweep: Path,
+    scale: int,
+    runs: int,
+    gatherers: list[str],
+    jobs: int,
+    extra_args: dict[str, list[str]],
+    io_threads: int = 1,
+    env: dict | None = None,
+):
+    results = []
+    for name in gatherers:
+        script, inputs, takes_jobs = GATHERERS[name]
+        input_paths = [sweep / path for path in inputs]
+
+        command = [sys.executable, str(SCRIPT_FOLDER / script), *map(str, input_paths)]
+        if takes_jobs:
+            command += ["--jobs", str(jobs)]
+        if io_threads > 1 and name in IO_GATHERERS:
+            command += ["--io_threads", str(io_threads)]
+        command += extra_args.get(name, [])
+
+        input_mb = sum(folder_size(path) for path in input_paths) / 1024 / 1024
+
+        with tempfile.TemporaryFile("w+") as stderr_file:
+            seconds, peak_rss_mb, exit_code = run_gatherer(command, stderr_file, env)
+            if exit_code != 0:
+                stderr_file.seek(0)
+                print(f"{name} failed at scale {scale}:", file=sys.stderr)
+                print(stderr_file.read(), file=sys.stderr)
+
+        results.append(
+            {
+                "gatherer": name,
+                "scale": scale,
+                "runs": runs,
+                "input_mb": round(input_mb, 3),
+                "seconds": round(seconds, 4),
+                "runs_per_second": round(runs / seconds, 2),
+                "mb_per_second": round(input_mb / seconds, 2),
+                "peak_rss_mb": round(peak_rss_mb, 1),
+                "exit_code": exit_code,
+            }
+        )
+    return results
+
+
+def parse_extra_args(values: list[str]):
+    # GATHERER=ARGS -> {gatherer: [args]}, repeated values for a gatherer add up
+    extra_args = {}
+    for value in values:
+        name, sep, text = value.partition("=")
+        if not sep or name not in GATHERERS:
+            raise ValueError(f"extra args should look like GATHERER=ARGS with one of {', '.join(GATHERERS)}, not {value}")
+        extra_args.setdefault(name, []).extend(shlex.split(text))
+    return extra_args
+
+
+def load_baseline(path: Path):
+    with open(path) as file:
+        return {(row["gatherer"], int(row["scale"])): float(row["seconds"]) for row in csv.DictReader(file)}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--scales", type=int, nargs="+", default=[10, 100, 1000])
+    # run folders per tool at every scale
+    parser.add_argument("-r", "--runs", type=int, default=20)
+    parser.add_argument("-l", "--lines_per_record", type=int, default=10)
+    parser.add_argument("-g", "--gatherers", nargs="+", choices=list(GATHERERS), default=list(GATHERERS))
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    # passed on to the gatherers that read folders in threads
+    parser.add_argument("--io_threads", type=int, default=1)
+    # milliseconds added to every file system call, see LATENCY_SITECUSTOMIZE
+    parser.add_argument("--fs_latency", type=float, default=None)
+    # passed on to one gatherer, e.g. --extra_args bigslice_matrix=--batch.
+    # can be given more than once
+    parser.add_argument("--extra_args", action="append", default=[], metavar="GATHERER=ARGS")
+    # keep the sweeps in this folder instead of a temporary one
+    parser.add_argument("--sweep_folder", type=Path, default=None)
+    parser.add_argument("-o", "--output", type=Path, default=None)
+    parser.add_argument("-b", "--baseline", type=Path, default=None)
+
+    args = parser.parse_args()
+
+    try:
+        extra_args = parse_extra_args(args.extra_args)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+
+    columns = RESULT_COLUMNS + (["baseline_seconds", "speedup"] if baseline else [])
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.DictWriter(output, fieldnames=columns)
+    writer.writeheader()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sweep_root = args.sweep_folder if args.sweep_folder else Path(tmp)
+        env = latency_env(args.fs_latency, Path(tmp)) if args.fs_latency is not None else None
+
+        for scale in args.scales:
+            sweep = sweep_root / f"scale_{scale}"
+            if not sweep.exists():
+                make_sweep(
+                    sweep,
+                    [scale],
+                    args.runs,
+                    args.lines_per_record,
+                    profile_samples=scale,
+                )
+
+            results = bench_scale(
+                sweep, scale, args.runs, args.gatherers, args.jobs, extra_args, args.io_threads, env
+            )
+            for result in results:
+                if baseline:
+                    baseline_seconds = baseline.get((result["gatherer"], scale))
+                    result["baseline_seconds"] = baseline_seconds
+                    result["speedup"] = round(baseline_seconds / result["seconds"], 2) if baseline_seconds else None
+                writer.writerow(result)
+                output.flush()
+
+    if args.output:
+        output.close()
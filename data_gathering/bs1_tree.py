@@ -0,0 +1,130 @@
+# single traversal of a BiG-SCAPE 1 result folder
+#
+# get_bs1_matrix and get_bs1_crash_estimation both need the modify times of a
+# handful of files and folders in a v1 result folder. instead of every getter
+# doing its own exists()/stat()/iterdir() on the same paths, each folder is
+# visited once and every timestamp is collected into a V1RunTree. the paths
+# are known, so each one is a single os.stat that doubles as the exists check.
+# only the two folders named after the run are listed, to find that name
+#
+# timestamps that cannot be found are None. it is up to the caller to decide
+# whether that is an error
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+import os
+
+import instrumentation
+
+
+@dataclass
+class V1RunTree:
+    # mtime of logs/parameters.txt, one of the first things written
+    start: datetime | None = None
+    # mtime of cache/fasta, written at the end of input parsing
+    read_files: datetime | None = None
+    # mtime of cache/domtable, the last file in it is the end of hmmscan
+    hmm_scan: datetime | None = None
+    # mtime of cache/pfd, the last file in it is the end of hmmalign
+    hmm_align: datetime | None = None
+    # mtime of network_files/[cutoff folder]/mix/mix_c0.30.network
+    distance_calc: datetime | None = None
+    # ctime of html_content/networks/[cutoff folder]/mix/bs_networks.js,
+    # v1 crashes while writing this file on large datasets
+    pre_crash: datetime | None = None
+    # mtime of logs/runtimes.txt, the last file touched by a v1 run
+    cc_gen: datetime | None = None
+    # start plus the "Main function took" time from logs/runtimes.txt
+    end: datetime | None = None
+
+    def to_list(self):
+        return [
+            self.start,
+            self.read_files,
+            self.hmm_scan,
+            self.hmm_align,
+            self.distance_calc,
+            self.pre_crash,
+            self.cc_gen,
+            self.end,
+        ]
+
+    @classmethod
+    def from_list(cls, times):
+        return cls(*times)
+
+
+def first_subfolder(path: Path | str):
+    # network_files and html_content/networks should contain only one
+    # subfolder, named after the run. take the first entry like iterdir would
+    instrumentation.count("dir_listings")
+    try:
+        with os.scandir(path) as entries:
+            entry = next(entries, None)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    if entry is None or not entry.is_dir():
+        return None
+    return entry.path
+
+
+def path_stat(path: str):
+    instrumentation.count("stat_calls")
+    try:
+        return os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def path_mtime(path: str):
+    stat = path_stat(path)
+    if stat is None:
+        return None
+    return datetime.fromtimestamp(stat.st_mtime)
+
+
+def read_main_function_seconds(runtimes_file: str):
+    seconds = None
+    lines = 0
+    with open(runtimes_file) as f:
+        for line in f:
+            lines += 1
+            if line.strip().startswith("Main function took"):
+                seconds = float(line.split()[-2])
+    instrumentation.count("lines_scanned", lines)
+    return seconds
+
+
+def scan_v1_run(folder: Path):
+    tree = V1RunTree()
+
+    runtimes_file = os.path.join(folder, "logs", "runtimes.txt")
+    tree.start = path_mtime(os.path.join(folder, "logs", "parameters.txt"))
+    tree.cc_gen = path_mtime(runtimes_file)
+
+    tree.read_files = path_mtime(os.path.join(folder, "cache", "fasta"))
+    tree.hmm_scan = path_mtime(os.path.join(folder, "cache", "domtable"))
+    tree.hmm_align = path_mtime(os.path.join(folder, "cache", "pfd"))
+
+    # after much thought, in mix mode the modify time of the network file is
+    # the better way of measuring distance calculation. the runtime log only
+    # reports the execution of the generate_networks function, but there is
+    # more to only that function that is relevant to the distance calculation step
+    network_folder = first_subfolder(os.path.join(folder, "network_files"))
+    if network_folder is not None:
+        tree.distance_calc = path_mtime(os.path.join(network_folder, "mix", "mix_c0.30.network"))
+
+    html_folder = first_subfolder(os.path.join(folder, "html_content", "networks"))
+    if html_folder is not None:
+        js_stat = path_stat(os.path.join(html_folder, "mix", "bs_networks.js"))
+        if js_stat is not None:
+            tree.pre_crash = datetime.fromtimestamp(js_stat.st_ctime)
+
+    if tree.cc_gen is not None:
+        seconds = read_main_function_seconds(runtimes_file)
+        if seconds is not None and tree.start is not None:
+            tree.end = tree.start + timedelta(seconds=seconds)
+
+    return tree
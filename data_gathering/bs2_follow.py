@@ -0,0 +1,160 @@
+# follows BiG-SCAPE 2 runs while they are still going
+#
+# every interval the sweep folder is listed for new run folders and logs, and
+# every known log is checked for appended bytes. only the new bytes are read
+# and fed to the marker scanner of that log, so a poll costs one stat per log
+# plus whatever was written since the last poll.
+#
+# whenever a phase marker shows up, a line is printed:
+# folder,log,phase,status,seconds
+# where status is done or running, and seconds is the time since the start
+# marker of the run. the log stays open between polls, so when it is rotated
+# (the path gets a new inode, or disappears) the rest of the old file is still
+# read before the new one is opened. a rotated or truncated log is read again
+# from the start, but the phases seen so far are kept, the new file will not
+# repeat the start marker
+
+from pathlib import Path
+import asyncio
+import os
+import sys
+
+from get_bs2_matrix import BLOCK_SIZE, PHASES, MarkerScanner, get_files, get_folders
+from phase_table import NS_PER_SECOND
+
+
+class FollowedLog:
+    def __init__(self, log_file: Path):
+        self.log_file = log_file
+        # open file of the last poll, its inode and how far it has been read
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.scanner = MarkerScanner()
+        self.reported = {}
+
+    def read_to_end(self):
+        # feeds everything after offset in the open file. returns False if
+        # there was nothing
+        self.file.seek(self.offset)
+        read = False
+        while block := self.file.read(BLOCK_SIZE):
+            self.scanner.feed(block)
+            self.offset += len(block)
+            read = True
+        return read
+
+    def read_appended(self):
+        # runs in a worker thread. returns False if nothing changed
+        changed = False
+        try:
+            stat = os.stat(self.log_file)
+        except FileNotFoundError:
+            stat = None
+
+        if self.file is not None and (stat is None or stat.st_ino != self.inode):
+            # rotated or removed. the old file will not grow any more, so
+            # whatever was appended since the last poll is the rest of it,
+            # including a last line without a newline
+            changed = self.read_to_end()
+            self.scanner.finish()
+            self.file.close()
+            self.file = None
+            if stat is not None:
+                print(f"{self.log_file} was rotated, reading the new file from the start", file=sys.stderr)
+
+        if stat is None:
+            return changed
+
+        if self.file is None:
+            try:
+                self.file = open(self.log_file, "rb")
+            except FileNotFoundError:
+                # rotated again between the stat and the open
+                return changed
+            # the inode of what was opened, the path may have changed since
+            self.inode = os.fstat(self.file.fileno()).st_ino
+            self.offset = 0
+        elif os.fstat(self.file.fileno()).st_size < self.offset:
+            # truncated, read again from the start. only the partial line is
+            # dropped, the phases seen so far are kept
+            print(f"{self.log_file} was truncated, reading from the start", file=sys.stderr)
+            self.offset = 0
+            self.scanner.tail = b""
+
+        return self.read_to_end() or changed
+
+    def get_status(self):
+        # phase -> (status, seconds since start) for every phase seen so far,
+        # plus the phase that is expected next
+        timestamps = self.scanner.timestamps
+        start = timestamps[PHASES.index("start")]
+        status = {}
+
+        last_done = -1
+        for index, (phase, timestamp) in enumerate(zip(PHASES.timestamps, timestamps)):
+            if timestamp is None:
+                continue
+            seconds = (timestamp - start) / NS_PER_SECOND if start is not None else None
+            status[phase] = ("done", seconds)
+            last_done = index
+
+        if last_done < len(PHASES.timestamps) - 1:
+            status[PHASES.timestamps[last_done + 1]] = ("running", None)
+
+        return status
+
+    def report_changes(self, run_name: str):
+        for phase, (state, seconds) in self.get_status().items():
+            if self.reported.get(phase) == (state, seconds):
+                continue
+            self.reported[phase] = (state, seconds)
+
+            seconds = "" if seconds is None else seconds
+            print(f"{run_name},{self.log_file.name},{phase},{state},{seconds}", flush=True)
+
+
+def discover_logs(path: Path):
+    logs = []
+    for folder in get_folders(path):
+        try:
+            # compressed logs are archived runs, they will not grow any more
+            logs.extend(file for file in get_files(folder) if file.suffix == ".log")
+        except OSError:
+            # folder disappeared while listing
+            continue
+    return logs
+
+
+async def poll_log(followed: FollowedLog):
+    try:
+        changed = await asyncio.to_thread(followed.read_appended)
+    except OSError as error:
+        print(f"Error reading {followed.log_file}: {error}", file=sys.stderr)
+        return
+
+    if changed:
+        followed.report_changes(followed.log_file.parent.name)
+
+
+async def follow(path: Path, interval: float):
+    followed_logs: dict[Path, FollowedLog] = {}
+
+    print("folder,log,phase,status,seconds", flush=True)
+
+    while True:
+        # pick up run folders and logs that appeared since the last poll
+        for log_file in await asyncio.to_thread(discover_logs, path):
+            if log_file not in followed_logs:
+                followed_logs[log_file] = FollowedLog(log_file)
+
+        await asyncio.gather(*(poll_log(followed) for followed in followed_logs.values()))
+
+        await asyncio.sleep(interval)
+
+
+def run_follow(path: Path, interval: float):
+    try:
+        asyncio.run(follow(path, interval))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,316 @@
+# headless, incremental build of the figure and supplementary table csvs
+#
+# every output (Figure_3_a.csv, Supplementary_table_3_..., ...) is a node in
+# a small graph, with the source files and intermediate dataframes it depends
+# on as inputs. the key of a node is a hash of the contents of its source
+# files, the keys of its input nodes and the code that computes the tables.
+# an output is only rebuilt if its key changed since it was last written, or
+# if the file is missing or was changed by hand
+#
+# intermediate dataframes are pickled in the cache folder under their key, so
+# a rebuild after one source file changed only recomputes what depends on it
+#
+# run from the repository root:
+# python data_gathering/build_figures.py [output ...] [--force] [--dry_run]
+#
+# the svg figures are still drawn by the notebooks, from the same tables
+
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from pathlib import Path
+import hashlib
+import json
+import pickle
+import sys
+
+import pandas as pd
+
+from figure_tables import (
+    average_mode_runs,
+    average_proportions,
+    average_totals,
+    combine_v2_saves,
+    cpu_stats,
+    melt_totals,
+    missing_runtime_fit,
+    missing_runtime_table,
+    mode_totals,
+    step_proportions,
+    version_end,
+)
+from ganglia_align import align_to_span, load_ganglia
+from matrix_io import load_matrix, resolve_matrix_path
+from profile_rollup import read_rollup
+
+SCRIPT_FOLDER = Path(__file__).resolve().parent
+
+# a change to any of these rebuilds everything
+CODE_FILES = ["build_figures.py", "figure_tables.py", "ganglia_align.py", "matrix_io.py", "profile_rollup.py"]
+
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+@dataclass
+class Node:
+    name: str
+    # called with the values of the input nodes, in order
+    build: object
+    inputs: list[str] = field(default_factory=list)
+    # source files, relative to the root, that build reads itself
+    files: list[str] = field(default_factory=list)
+    # csv file the value is written to, relative to the root
+    output: str | None = None
+    csv_options: dict = field(default_factory=dict)
+
+
+def matrix_source(name: str):
+    # a gatherer matrix in source_data, in whichever format load_matrix picks
+    path = f"source_data/{name}"
+    return Node(name, lambda: load_matrix(path), files=[path])
+
+
+def indexed(matrix: pd.DataFrame):
+    return matrix.set_index(["size", "sample"])
+
+
+def figure_3a_table(totals: pd.DataFrame):
+    melted = melt_totals(totals)
+    return melted[melted["Tool"].str.contains("BiG-")]
+
+
+def aligned_memory(ganglia: pd.DataFrame, stats: pd.DataFrame, version: str):
+    memory = align_to_span(ganglia, 0, version_end(stats, version))
+    return memory.rename(columns={"use": "Memory usage (GB)"})[["seconds", "Memory usage (GB)"]]
+
+
+NODES = [
+    # sources
+    matrix_source("bigscape_v1_matrix"),
+    matrix_source("bigscape_v2_matrix"),
+    matrix_source("bigslice_v1_matrix"),
+    matrix_source("bigslice_v2_matrix"),
+    matrix_source("bigscape_v2_mode_10k_matrix"),
+    matrix_source("bigscape_v1_crash_timings"),
+    Node(
+        "perf_rollup",
+        lambda: read_rollup("source_data/bigscape_v2_25000_partition_1_perf.csv", 0),
+        files=["source_data/bigscape_v2_25000_partition_1_perf.csv"],
+    ),
+    Node(
+        "ganglia_memory_v1_25000",
+        lambda: load_ganglia("source_data/ganglia_memory_v1_25000.csv", unit="GB"),
+        files=["source_data/ganglia_memory_v1_25000.csv"],
+    ),
+    Node(
+        "ganglia_memory_v2_25000",
+        lambda: load_ganglia("source_data/ganglia_memory_v2_25000.csv", unit="GB"),
+        files=["source_data/ganglia_memory_v2_25000.csv"],
+    ),
+    # intermediate tables
+    Node("bigscape_v1_indexed", indexed, ["bigscape_v1_matrix"]),
+    Node("bigscape_v2_indexed", lambda matrix: indexed(combine_v2_saves(matrix)), ["bigscape_v2_matrix"]),
+    Node("bigslice_v1_indexed", indexed, ["bigslice_v1_matrix"]),
+    Node("bigslice_v2_indexed", indexed, ["bigslice_v2_matrix"]),
+    Node(
+        "totals",
+        average_totals,
+        ["bigscape_v1_indexed", "bigscape_v2_indexed", "bigslice_v1_indexed", "bigslice_v2_indexed"],
+    ),
+    Node("mode_averages", average_mode_runs, ["bigscape_v2_mode_10k_matrix"]),
+    Node("bigscape_v1_proportions", lambda matrix: average_proportions(matrix, "v1.1"), ["bigscape_v1_indexed"]),
+    Node("bigscape_v2_proportions", lambda matrix: average_proportions(matrix, "v2.0"), ["bigscape_v2_indexed"]),
+    Node("cpu_stats", cpu_stats, ["perf_rollup"]),
+    Node("missing_runtime_fit", missing_runtime_fit, ["bigscape_v1_crash_timings"]),
+    # outputs
+    Node(
+        "Supplementary_table_3_average_total_runtimes.csv",
+        lambda totals: totals.round(3),
+        ["totals"],
+        output="Supplementary_table_3_average_total_runtimes.csv",
+    ),
+    Node(
+        "Figure_3_a.csv",
+        figure_3a_table,
+        ["totals"],
+        output="Figure_3_a.csv",
+        csv_options={"index": None},
+    ),
+    Node(
+        "Supplementary_table_4_average_mode_runtimes.csv",
+        lambda averages: mode_totals(averages).round(3),
+        ["mode_averages"],
+        output="Supplementary_table_4_average_mode_runtimes.csv",
+    ),
+    Node(
+        "Supplementary_File_3.csv",
+        lambda v1, v2: pd.concat([v1, v2], axis=0).round(3),
+        ["bigscape_v1_proportions", "bigscape_v2_proportions"],
+        output="Supplementary_File_3.csv",
+    ),
+    Node(
+        "Figure_3_b.csv",
+        step_proportions,
+        ["bigscape_v1_proportions", "bigscape_v2_proportions"],
+        output="Figure_3_b.csv",
+    ),
+    Node("Figure_3_c_cpu.csv", lambda stats: stats, ["cpu_stats"], output="Figure_3_c_cpu.csv"),
+    Node(
+        "Figure_3_c_mem_v1.csv",
+        lambda ganglia, stats: aligned_memory(ganglia, stats, "v1"),
+        ["ganglia_memory_v1_25000", "cpu_stats"],
+        output="Figure_3_c_mem_v1.csv",
+        csv_options={"index": None},
+    ),
+    Node(
+        "Figure_3_c_mem_v2.csv",
+        lambda ganglia, stats: aligned_memory(ganglia, stats, "v2"),
+        ["ganglia_memory_v2_25000", "cpu_stats"],
+        output="Figure_3_c_mem_v2.csv",
+        csv_options={"index": None},
+    ),
+    Node(
+        "Figure_S10.csv",
+        lambda fit: missing_runtime_table(fit[1]),
+        ["missing_runtime_fit"],
+        output="Figure_S10.csv",
+        csv_options={"index": None},
+    ),
+]
+
+
+def hash_file(path: Path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Build:
+    def __init__(self, nodes: list[Node], cache_folder: Path):
+        self.nodes = {node.name: node for node in nodes}
+        self.cache_folder = cache_folder
+        self.state_path = cache_folder / "state.json"
+
+        # content hashes are remembered by size and mtime, so unchanged
+        # source files are not read again just to hash them
+        self.state = {"files": {}, "outputs": {}}
+        if self.state_path.exists():
+            self.state = json.loads(self.state_path.read_text())
+
+        self.code_hash = hashlib.sha256(
+            "".join(hash_file(SCRIPT_FOLDER / file) for file in CODE_FILES).encode()
+        ).hexdigest()
+        self.keys = {}
+        self.values = {}
+
+    def file_hash(self, path: Path):
+        stat = path.stat()
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+
+        known = self.state["files"].get(str(path))
+        if known is not None and known["fingerprint"] == fingerprint:
+            return known["hash"]
+
+        content_hash = hash_file(path)
+        self.state["files"][str(path)] = {"fingerprint": fingerprint, "hash": content_hash}
+        return content_hash
+
+    def key(self, name: str):
+        if name not in self.keys:
+            node = self.nodes[name]
+            # matrix sources may be a .csv or one of the columnar formats
+            files = [self.file_hash(resolve_matrix_path(file)) for file in node.files]
+            parts = [self.code_hash, name, *files, *[self.key(input) for input in node.inputs]]
+            self.keys[name] = hashlib.sha256("\n".join(parts).encode()).hexdigest()
+        return self.keys[name]
+
+    def value(self, name: str):
+        if name in self.values:
+            return self.values[name]
+
+        node = self.nodes[name]
+        cache_path = self.cache_folder / f"{name}-{self.key(name)[:16]}.pickle"
+
+        if cache_path.exists():
+            with open(cache_path, "rb") as file:
+                value = pickle.load(file)
+        else:
+            value = node.build(*[self.value(input) for input in node.inputs])
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            # earlier versions of this node will not be used again
+            for old_path in self.cache_folder.glob(f"{name}-*.pickle"):
+                old_path.unlink()
+            with open(cache_path, "wb") as file:
+                pickle.dump(value, file)
+
+        self.values[name] = value
+        return value
+
+    def is_stale(self, name: str):
+        node = self.nodes[name]
+        output = Path(node.output)
+        written = self.state["outputs"].get(node.output)
+
+        if written is None or not output.exists():
+            return True
+        if written["key"] != self.key(name):
+            return True
+        # changed by hand since it was built
+        return written["hash"] != self.file_hash(output)
+
+    def build(self, name: str):
+        node = self.nodes[name]
+        self.value(name).to_csv(node.output, **node.csv_options)
+        self.state["outputs"][node.output] = {"key": self.key(name), "hash": self.file_hash(Path(node.output))}
+
+    def save_state(self):
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        self.state_path.write_text(json.dumps(self.state, indent=1))
+
+
+if __name__ == "__main__":
+    outputs = [node.name for node in NODES if node.output is not None]
+
+    parser = ArgumentParser()
+    # outputs to build, all of them by default
+    parser.add_argument("targets", nargs="*", default=[])
+
+    # rebuild even if nothing changed
+    parser.add_argument("-f", "--force", action="store_true")
+
+    # only print which outputs are stale
+    parser.add_argument("-n", "--dry_run", action="store_true")
+
+    parser.add_argument("--cache_folder", type=Path, default=Path(".build_cache"))
+
+    args = parser.parse_args()
+
+    unknown = [target for target in args.targets if target not in outputs]
+    if unknown:
+        parser.error(f"unknown outputs {', '.join(unknown)}, choose from {', '.join(outputs)}")
+
+    build = Build(NODES, args.cache_folder)
+    failed = False
+
+    for name in args.targets or outputs:
+        try:
+            stale = args.force or build.is_stale(name)
+            if stale and not args.dry_run:
+                build.build(name)
+        except (OSError, KeyError, ValueError) as error:
+            print(f"failed   {name}: {error!r}", file=sys.stderr)
+            failed = True
+            continue
+
+        if not stale:
+            print(f"ok       {name}", file=sys.stderr)
+        elif args.dry_run:
+            print(f"stale    {name}", file=sys.stderr)
+        else:
+            print(f"built    {name}", file=sys.stderr)
+
+    if not args.dry_run:
+        build.save_state()
+
+    exit(1 if failed else 0)
@@ -0,0 +1,374 @@
+# capacity planning for new BiG-SCAPE runs from the sweep data
+#
+# fits a scaling model to every phase of a runtime matrix from the gatherers,
+# and to the peak memory of profiles or ganglia exports taken at several
+# sizes, then predicts them for a new record count with a prediction interval
+#
+# two models are tried for every quantity: the order 2 polynomial of the
+# trend lines in runtimes.ipynb, and a power law a * size ^ b fitted on a
+# log-log scale. the model is picked by how well it extrapolates, which is
+# what a plan for a larger run needs: each of the largest few sizes is
+# predicted from a fit on the smaller sizes only, and the model with the
+# smallest mean absolute log error wins
+#
+# the interval resamples the runs like projection.py does, and adds a
+# resampled residual of the full fit to every bootstrap projection, so it
+# covers the spread of a single new run and not only the uncertainty of the fit.
+# a fit through no more than order + 1 distinct sizes passes through all of
+# them, leaving no residuals and no spread to resample, so lower and upper
+# are NaN then: the interval is unavailable, not zero wide
+#
+# modes other than the one the sweep was run with are predicted by scaling
+# with the ratio between the mode runs and the sweep runs at the size of the
+# mode runs, phase by phase. this assumes a mode changes the runtime of a
+# phase by the same factor at every size. peak memory is not scaled
+#
+# python data_gathering/capacity_plan.py source_data/bigscape_v2_matrix 75000 \
+#     --mode_matrix source_data/bigscape_v2_mode_10k_matrix --mode legacy \
+#     --memory 10000:run_10k.profile --memory 25000:source_data/ganglia_memory_v2_25000.csv
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+
+from compressed_files import strip_compression
+from figure_tables import STEPS, average_mode_runs, combine_v2_saves
+from ganglia_align import load_ganglia
+from get_performance_run import iter_profile_matrix
+from matrix_io import load_matrix, write_matrix
+from profile_rollup import iter_rollup
+from projection import bootstrap_projections
+
+MODELS = ["polynomial", "power"]
+
+QUANTITIES = [*STEPS, "total"]
+
+
+@dataclass
+class Plan:
+    quantity: str
+    unit: str
+    model: str
+    # mean absolute log error when extrapolating to the largest sizes
+    extrapolation_error: float
+    estimate: float
+    lower: float
+    upper: float
+
+    def to_list(self):
+        return [
+            self.quantity,
+            self.unit,
+            self.model,
+            self.extrapolation_error,
+            self.estimate,
+            self.lower,
+            self.upper,
+        ]
+
+
+PLAN_COLUMNS = ["quantity", "unit", "model", "extrapolation_error", "estimate", "lower", "upper"]
+
+
+def to_fit_scale(x: np.ndarray, y: np.ndarray, model: str, order: int):
+    # the runs and the polynomial order the model is fitted with. the power
+    # law is a straight line on a log-log scale, so it only uses positive runs
+    if model == "power":
+        keep = (x > 0) & (y > 0)
+        return np.log(x[keep]), np.log(y[keep]), 1
+    return x, y, order
+
+
+def from_fit_scale(values, model: str):
+    return np.exp(values) if model == "power" else values
+
+
+def can_fit(x: np.ndarray, y: np.ndarray, model: str, order: int):
+    fit_x, _fit_y, fit_order = to_fit_scale(x, y, model, order)
+    return len(np.unique(fit_x)) > fit_order
+
+
+def fit_predict(x: np.ndarray, y: np.ndarray, target: float, model: str, order: int):
+    fit_x, fit_y, fit_order = to_fit_scale(x, y, model, order)
+    fit_target = np.log(target) if model == "power" else target
+    return from_fit_scale(np.polyval(np.polyfit(fit_x, fit_y, fit_order), fit_target), model)
+
+
+def extrapolation_error(x: np.ndarray, y: np.ndarray, model: str, order: int, holdout: int):
+    # predicts the mean of each of the holdout largest sizes from the smaller
+    # sizes. NaN if there are too few sizes to do this even once
+    errors = []
+    for size in np.unique(x)[-holdout:]:
+        train = x < size
+        observed = y[x == size].mean()
+        if observed <= 0 or not can_fit(x[train], y[train], model, order):
+            continue
+
+        predicted = fit_predict(x[train], y[train], size, model, order)
+        # a polynomial that predicts no runtime at all is as wrong as it gets
+        errors.append(abs(np.log(predicted / observed)) if predicted > 0 else np.inf)
+
+    return float(np.mean(errors)) if errors else np.nan
+
+
+def choose_model(x: np.ndarray, y: np.ndarray, order: int, holdout: int):
+    errors = {
+        model: extrapolation_error(x, y, model, order, holdout)
+        for model in MODELS
+        if can_fit(x, y, model, order)
+    }
+    if not errors:
+        raise ValueError("too few distinct sizes to fit any model")
+
+    validated = {model: error for model, error in errors.items() if not np.isnan(error)}
+    if not validated:
+        # nothing to compare on, take the model with the fewest parameters
+        model = "power" if "power" in errors else "polynomial"
+        return model, np.nan
+
+    model = min(validated, key=validated.get)
+    return model, validated[model]
+
+
+def prediction_interval(
+    x: np.ndarray,
+    y: np.ndarray,
+    target: float,
+    model: str,
+    order: int = 2,
+    resamples: int = 2000,
+    confidence: float = 0.95,
+    seed: int = 0,
+):
+    # estimate, lower and upper bound for a single new run at target
+    fit_x, fit_y, fit_order = to_fit_scale(x, y, model, order)
+    fit_target = np.log(target) if model == "power" else target
+
+    coefficients = np.polyfit(fit_x, fit_y, fit_order)
+    if len(np.unique(fit_x)) < fit_order + 2:
+        estimate = from_fit_scale(np.polyval(coefficients, fit_target), model)
+        return float(estimate), np.nan, np.nan
+
+    residuals = fit_y - np.polyval(coefficients, fit_x)
+    # residuals of a fit are smaller than the errors of new runs, by the
+    # number of parameters that were fitted
+    if len(fit_x) > fit_order + 1:
+        residuals = residuals * np.sqrt(len(fit_x) / (len(fit_x) - fit_order - 1))
+
+    rng = np.random.default_rng(seed + 1)
+    projections = bootstrap_projections(fit_x, fit_y, fit_target, fit_order, resamples, seed)
+    projections = projections + rng.choice(residuals, len(projections))
+
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(projections, [alpha, 1 - alpha])
+    estimate = np.polyval(coefficients, fit_target)
+
+    return tuple(float(value) for value in from_fit_scale(np.array([estimate, lower, upper]), model))
+
+
+def plan_quantity(
+    quantity: str,
+    unit: str,
+    x: np.ndarray,
+    y: np.ndarray,
+    target: float,
+    order: int = 2,
+    holdout: int = 3,
+    resamples: int = 2000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    factor: float = 1.0,
+):
+    # factor scales the prediction, e.g. for a different mode
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    try:
+        model, error = choose_model(x, y, order, holdout)
+    except ValueError as reason:
+        raise ValueError(f"{quantity}: {reason}") from reason
+    estimate, lower, upper = prediction_interval(x, y, target, model, order, resamples, confidence, seed)
+
+    # a runtime or memory use below zero is just a polynomial going astray.
+    # NaN bounds stay NaN
+    estimate, lower, upper = np.maximum(np.array([estimate, lower, upper]) * factor, 0.0)
+    return Plan(quantity, unit, model, error, float(estimate), float(lower), float(upper))
+
+
+def sweep_runs(matrix: pd.DataFrame):
+    # runtime matrix of the gatherers, with the v2 save steps counted as part
+    # of the step before them. mode runs without a size are left out
+    if "hmm_scan_save" in matrix.columns:
+        matrix = combine_v2_saves(matrix)
+    return matrix[matrix["size"] > 0]
+
+
+def mode_factors(runs: pd.DataFrame, mode_matrix: pd.DataFrame, mode: str, mode_size: int):
+    # quantity -> runtime of the mode relative to the sweep at mode_size
+    if "hmm_scan_save" in mode_matrix.columns:
+        mode_matrix = combine_v2_saves(mode_matrix)
+    modes = average_mode_runs(mode_matrix)
+    if mode not in modes.index:
+        raise ValueError(f"unknown mode {mode}, choose from {', '.join(modes.index)}")
+
+    reference = runs[runs["size"] == mode_size]
+    if reference.empty:
+        raise ValueError(f"the sweep has no runs at {mode_size} records to compare mode {mode} with")
+
+    return (modes.loc[mode, QUANTITIES] / reference[QUANTITIES].mean()).to_dict()
+
+
+def peak_memory_gb(path: Path, version: str):
+    # highest memory use of a run, from a .profile or a ganglia export
+    if strip_compression(path).suffix == ".profile":
+        # a bucket of 0 seconds sums up the processes of every sample
+        rollups = iter_rollup(iter_profile_matrix(path, version), 0)
+        peak_mb = max((rollup["mem_used_mb_mean"] * rollup["samples"]).max() for rollup in rollups)
+        return peak_mb / 1024
+    return load_ganglia(path, ("use",), unit="GB")["use"].max()
+
+
+def parse_memory_argument(value: str):
+    # SIZE:PATH
+    size, _sep, path = value.partition(":")
+    return int(size), Path(path)
+
+
+def plan_capacity(
+    matrix: pd.DataFrame,
+    target: int,
+    memory: list[tuple[int, Path]] | None = None,
+    mode_matrix: pd.DataFrame | None = None,
+    mode: str | None = None,
+    mode_size: int = 10000,
+    order: int = 2,
+    holdout: int = 3,
+    resamples: int = 2000,
+    confidence: float = 0.95,
+    seed: int = 0,
+):
+    runs = sweep_runs(matrix)
+    factors = {}
+    if mode is not None:
+        factors = mode_factors(runs, mode_matrix, mode, mode_size)
+
+    plans = []
+    for quantity in QUANTITIES:
+        measured = runs[runs[quantity].notna()]
+        plans.append(
+            plan_quantity(
+                quantity,
+                "s",
+                measured["size"].to_numpy(),
+                measured[quantity].to_numpy(),
+                target,
+                order,
+                holdout,
+                resamples,
+                confidence,
+                seed,
+                factors.get(quantity, 1.0),
+            )
+        )
+
+    if memory:
+        version = "v2" if "hmm_scan_save" in matrix.columns else "v1"
+        sizes = [size for size, _path in memory]
+        peaks = [peak_memory_gb(path, version) for _size, path in memory]
+        try:
+            plans.append(
+                plan_quantity(
+                    "peak_memory", "GB", sizes, peaks, target, order, holdout, resamples, confidence, seed
+                )
+            )
+        except ValueError as error:
+            # the runtime plan is still useful without it
+            print(f"Error: {error}, measure peak memory at more sizes", file=sys.stderr)
+
+    return plans
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Predict runtime and peak memory of a BiG-SCAPE run")
+    # runtime matrix from get_bs1_matrix or get_bs2_matrix, in any format load_matrix reads
+    parser.add_argument("matrix", type=Path)
+
+    # number of records of the planned run
+    parser.add_argument("records", type=int)
+
+    # mode matrix with runs named 10k_[mode]_[replicate], and the mode to plan for
+    parser.add_argument("--mode_matrix", type=Path, default=None)
+    parser.add_argument("--mode", type=str, default=None)
+    parser.add_argument("--mode_size", type=int, default=10000)
+
+    # peak memory measurements as SIZE:PATH, where PATH is a .profile or a
+    # ganglia export. can be given more than once, at least two sizes are needed
+    parser.add_argument("--memory", type=parse_memory_argument, action="append", default=[])
+
+    # polynomial order and number of largest sizes used to choose a model
+    parser.add_argument("--order", type=int, default=2)
+    parser.add_argument("--holdout", type=int, default=3)
+
+    parser.add_argument("--resamples", type=int, default=2000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+
+    # warn if the upper bound of the plan exceeds the job limits
+    parser.add_argument("--time_limit", type=float, default=None)
+    parser.add_argument("--memory_limit", type=float, default=None)
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    args = parser.parse_args()
+
+    if args.mode is not None and args.mode_matrix is None:
+        parser.error("--mode needs --mode_matrix")
+
+    matrix = load_matrix(args.matrix)
+    mode_matrix = load_matrix(args.mode_matrix) if args.mode_matrix else None
+
+    try:
+        plans = plan_capacity(
+            matrix,
+            args.records,
+            args.memory,
+            mode_matrix,
+            args.mode,
+            args.mode_size,
+            args.order,
+            args.holdout,
+            args.resamples,
+            args.confidence,
+            args.seed,
+        )
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    largest = matrix["size"].max()
+    if args.records > largest:
+        print(f"warning: extrapolating from at most {largest} to {args.records} records", file=sys.stderr)
+
+    for plan in plans:
+        if np.isnan(plan.upper):
+            print(f"warning: no interval for {plan.quantity}, it needs more distinct sizes", file=sys.stderr)
+        limit = args.time_limit if plan.unit == "s" else args.memory_limit
+        if plan.quantity in ("total", "peak_memory") and limit is not None and plan.upper > limit:
+            print(
+                f"warning: {plan.quantity} may reach {plan.upper:.0f} {plan.unit}, over the limit of {limit:g}",
+                file=sys.stderr,
+            )
+
+    rows = [plan.to_list() for plan in plans]
+    if args.output:
+        write_matrix(PLAN_COLUMNS, rows, args.output)
+        exit(0)
+
+    print(",".join(PLAN_COLUMNS))
+    for row in rows:
+        print(",".join(map(str, row)))
@@ -0,0 +1,372 @@
+# regression gate between two gathered matrices of the same sweep
+#
+# compares a baseline matrix, e.g. bigscape_v2_matrix.csv of the release that
+# is in use, with a candidate matrix of the same sweep rerun on an upgrade.
+# runs are matched by size and sample, runs that only one of the two has are
+# left out and reported. then, for every phase and size:
+#
+# - change: how much slower the candidate is, as the median candidate time
+#   over the median baseline time minus 1. 0.25 is 25% slower
+# - change_lower/change_upper: a percentile bootstrap interval of change,
+#   resampling the runs of both matrices with replacement
+# - cliffs_delta: the chance that a candidate run is slower than a baseline
+#   run minus the chance it is faster, from -1 to 1
+# - p_value: one sided mann-whitney u test of the candidate being slower.
+#   exact for the handful of replicates of a sweep, from the normal
+#   approximation for large groups. with 3 replicates each the smallest
+#   possible p is 1/20 = 0.05, when every candidate run is slower than every
+#   baseline run
+#
+# a phase at a size is a regression when change is over --threshold and
+# p_value is at most --alpha. phases with a baseline median under
+# --min_seconds are never a regression, a few hundredths of a second of noise
+# are a large change on a phase that takes almost no time
+#
+# only the phases both matrices have are compared. the phases that only one
+# of them has are reported, e.g. when a v1 matrix is compared with a v2
+# matrix by mistake, and with --strict_columns they make the matrices not
+# comparable
+#
+# the worst regressions are listed first, followed by everything else from
+# slowest to fastest. exits with 1 when there is a regression, and with 2 when
+# the matrices can not be compared, so a pipeline can fail the upgrade
+#
+# python data_gathering/compare_sweeps.py bigscape_v2_matrix.csv candidate/bigscape_v2_matrix.csv
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from itertools import combinations
+from pathlib import Path
+import math
+import sys
+
+import numpy as np
+
+from matrix_io import load_matrix, write_matrix
+
+# columns that identify a run instead of timing a phase
+KEY_COLUMNS = ["size", "sample"]
+
+# durations that are not worth comparing, start is always 0
+SKIP_COLUMNS = ["start"]
+
+# largest number of splits of the pooled runs the exact test enumerates
+EXACT_LIMIT = 100_000
+
+
+@dataclass
+class Comparison:
+    phase: str
+    size: int
+    baseline_runs: int
+    candidate_runs: int
+    baseline_median: float
+    candidate_median: float
+    change: float
+    change_lower: float
+    change_upper: float
+    cliffs_delta: float
+    p_value: float
+    regression: bool
+
+    def to_list(self):
+        return [
+            self.phase,
+            self.size,
+            self.baseline_runs,
+            self.candidate_runs,
+            self.baseline_median,
+            self.candidate_median,
+            self.change,
+            self.change_lower,
+            self.change_upper,
+            self.cliffs_delta,
+            self.p_value,
+            self.regression,
+        ]
+
+
+COMPARISON_COLUMNS = [
+    "phase",
+    "size",
+    "baseline_runs",
+    "candidate_runs",
+    "baseline_median",
+    "candidate_median",
+    "change",
+    "change_lower",
+    "change_upper",
+    "cliffs_delta",
+    "p_value",
+    "regression",
+]
+
+
+def rank(values: np.ndarray):
+    # ranks from 1, ties get the mean of the ranks they span
+    order = np.argsort(values, kind="stable")
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(1, len(values) + 1)
+    _unique, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    sums = np.bincount(inverse, ranks)
+    return sums[inverse] / counts[inverse]
+
+
+def mann_whitney_greater(baseline: np.ndarray, candidate: np.ndarray):
+    # u statistic of the candidate and the one sided p value of the
+    # candidate being larger
+    pooled = np.concatenate([candidate, baseline])
+    ranks = rank(pooled)
+    n = len(candidate)
+    m = len(baseline)
+    offset = n * (n + 1) / 2
+    u = ranks[:n].sum() - offset
+
+    if math.comb(n + m, n) <= EXACT_LIMIT:
+        # every way to pick which n of the pooled runs are the candidate's.
+        # the ranks are the tied ranks, so this is exact with ties as well
+        splits = np.array(list(combinations(range(n + m), n)))
+        null = ranks[splits].sum(axis=1) - offset
+        # ranks are multiples of 0.5, the tolerance only absorbs rounding
+        return u, float(np.mean(null >= u - 1e-9))
+
+    # normal approximation with tie and continuity correction
+    _unique, counts = np.unique(pooled, return_counts=True)
+    ties = (counts**3 - counts).sum() / ((n + m) * (n + m - 1))
+    sigma = math.sqrt(n * m / 12 * ((n + m + 1) - ties))
+    if sigma == 0:
+        return u, 1.0
+    z = (u - n * m / 2 - 0.5) / sigma
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def bootstrap_change(
+    baseline: np.ndarray,
+    candidate: np.ndarray,
+    resamples: int,
+    confidence: float,
+    rng: np.random.Generator,
+):
+    # percentile interval of median(candidate) / median(baseline) - 1
+    baseline_medians = np.median(baseline[rng.integers(0, len(baseline), (resamples, len(baseline)))], axis=1)
+    candidate_medians = np.median(candidate[rng.integers(0, len(candidate), (resamples, len(candidate)))], axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        changes = candidate_medians / baseline_medians - 1
+    alpha = (1 - confidence) / 2
+    lower, upper = np.nanquantile(changes, [alpha, 1 - alpha])
+    return float(lower), float(upper)
+
+
+def compare_phase(
+    phase: str,
+    size: int,
+    baseline: np.ndarray,
+    candidate: np.ndarray,
+    threshold: float,
+    alpha: float,
+    min_seconds: float,
+    resamples: int,
+    confidence: float,
+    rng: np.random.Generator,
+):
+    baseline_median = float(np.median(baseline))
+    candidate_median = float(np.median(candidate))
+    change = candidate_median / baseline_median - 1 if baseline_median > 0 else math.nan
+    change_lower, change_upper = bootstrap_change(baseline, candidate, resamples, confidence, rng)
+
+    u, p_value = mann_whitney_greater(baseline, candidate)
+    cliffs_delta = 2 * u / (len(baseline) * len(candidate)) - 1
+
+    regression = baseline_median >= min_seconds and change > threshold and p_value <= alpha
+
+    return Comparison(
+        phase,
+        size,
+        len(baseline),
+        len(candidate),
+        baseline_median,
+        candidate_median,
+        change,
+        change_lower,
+        change_upper,
+        float(cliffs_delta),
+        p_value,
+        bool(regression),
+    )
+
+
+def unshared_phases(baseline, candidate):
+    # phase columns that are only in the baseline, and only in the candidate
+    def phases(matrix):
+        return [column for column in matrix.columns if column not in KEY_COLUMNS and column not in SKIP_COLUMNS]
+
+    only_baseline = [column for column in phases(baseline) if column not in candidate.columns]
+    only_candidate = [column for column in phases(candidate) if column not in baseline.columns]
+    return only_baseline, only_candidate
+
+
+def match_runs(baseline, candidate):
+    # both matrices cut down to the size,sample keys they have in common. a
+    # bs2 run folder can have more than one log, so a key can have several
+    # rows, they are all kept
+    baseline_keys = set(baseline[KEY_COLUMNS].itertuples(index=False, name=None))
+    candidate_keys = set(candidate[KEY_COLUMNS].itertuples(index=False, name=None))
+    common = baseline_keys & candidate_keys
+
+    def keep(matrix):
+        keys = matrix[KEY_COLUMNS].itertuples(index=False, name=None)
+        return matrix[[key in common for key in keys]]
+
+    unmatched = sorted(baseline_keys ^ candidate_keys)
+    return keep(baseline), keep(candidate), unmatched
+
+
+def compare_matrices(
+    baseline,
+    candidate,
+    threshold: float = 0.1,
+    alpha: float = 0.05,
+    min_seconds: float = 0.0,
+    resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    strict_columns: bool = False,
+):
+    # comparisons of all phases and sizes, worst regressions first, and the
+    # size,sample keys that were only in one of the matrices
+    missing = [column for column in KEY_COLUMNS if column not in baseline or column not in candidate]
+    if missing:
+        raise ValueError(f"both matrices need a {', '.join(missing)} column")
+
+    only_baseline, only_candidate = unshared_phases(baseline, candidate)
+    if strict_columns and (only_baseline or only_candidate):
+        raise ValueError(
+            "the matrices have different phase columns, "
+            f"only in the baseline: {', '.join(only_baseline) or 'none'}, "
+            f"only in the candidate: {', '.join(only_candidate) or 'none'}"
+        )
+
+    phases = [
+        column
+        for column in baseline.columns
+        if column in candidate.columns and column not in KEY_COLUMNS and column not in SKIP_COLUMNS
+    ]
+    if not phases:
+        raise ValueError("the matrices have no phase columns in common")
+
+    baseline, candidate, unmatched = match_runs(baseline, candidate)
+    if len(baseline) == 0:
+        raise ValueError("the matrices have no size,sample in common")
+
+    rng = np.random.default_rng(seed)
+    comparisons = []
+    baseline_sizes = baseline.groupby("size")
+    candidate_sizes = candidate.groupby("size")
+    for phase in phases:
+        for size, baseline_runs in baseline_sizes:
+            baseline_times = baseline_runs[phase].dropna().to_numpy(dtype=np.float64)
+            candidate_times = candidate_sizes.get_group(size)[phase].dropna().to_numpy(dtype=np.float64)
+            if len(baseline_times) == 0 or len(candidate_times) == 0:
+                continue
+            comparisons.append(
+                compare_phase(
+                    phase,
+                    int(size),
+                    baseline_times,
+                    candidate_times,
+                    threshold,
+                    alpha,
+                    min_seconds,
+                    resamples,
+                    confidence,
+                    rng,
+                )
+            )
+
+    def sort_key(comparison: Comparison):
+        change = -math.inf if math.isnan(comparison.change) else comparison.change
+        return not comparison.regression, -change, comparison.phase, comparison.size
+
+    return sorted(comparisons, key=sort_key), unmatched
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare the phase times of a candidate sweep against a baseline sweep")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+
+    # slowdown that counts as a regression, 0.1 is 10% slower
+    parser.add_argument("-t", "--threshold", type=float, default=0.1)
+
+    # largest p value that counts as a regression
+    parser.add_argument("-a", "--alpha", type=float, default=0.05)
+
+    # phases that take less than this in the baseline are never a regression
+    parser.add_argument("--min_seconds", type=float, default=0.0)
+
+    # bootstrap resamples for the interval of the change
+    parser.add_argument("--resamples", type=int, default=10000)
+
+    # confidence of the interval
+    parser.add_argument("--confidence", type=float, default=0.95)
+
+    # seed of the resampling, so reports can be reproduced
+    parser.add_argument("--seed", type=int, default=0)
+
+    # exit with 2 when a phase column is only in one of the matrices, instead
+    # of comparing the phases they share
+    parser.add_argument("--strict_columns", action="store_true")
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    args = parser.parse_args()
+
+    try:
+        baseline = load_matrix(args.baseline)
+        candidate = load_matrix(args.candidate)
+        comparisons, unmatched = compare_matrices(
+            baseline,
+            candidate,
+            args.threshold,
+            args.alpha,
+            args.min_seconds,
+            args.resamples,
+            args.confidence,
+            args.seed,
+            args.strict_columns,
+        )
+    except (FileNotFoundError, ValueError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(2)
+
+    for side, columns in zip(["baseline", "candidate"], unshared_phases(baseline, candidate)):
+        if columns:
+            print(f"not compared, only in the {side}: {', '.join(columns)}", file=sys.stderr)
+
+    if unmatched:
+        print(
+            f"{len(unmatched)} runs are only in one of the matrices: "
+            + ", ".join(f"{size},{sample}" for size, sample in unmatched),
+            file=sys.stderr,
+        )
+
+    rows = [comparison.to_list() for comparison in comparisons]
+
+    if args.output:
+        write_matrix(COMPARISON_COLUMNS, rows, args.output)
+    else:
+        print(",".join(COMPARISON_COLUMNS))
+        for row in rows:
+            print(",".join(str(value) for value in row))
+
+    regressions = [comparison for comparison in comparisons if comparison.regression]
+    for comparison in regressions:
+        print(
+            f"regression: {comparison.phase} at size {comparison.size} is {100 * comparison.change:.1f}% slower "
+            f"({100 * comparison.change_lower:.1f}% to {100 * comparison.change_upper:.1f}%), "
+            f"p = {comparison.p_value:.3g}",
+            file=sys.stderr,
+        )
+
+    exit(1 if regressions else 0)
@@ -0,0 +1,171 @@
+# the tables behind the figures and supplementary files of the paper
+#
+# each function takes the dataframes it needs and returns a new dataframe,
+# without reading or writing files. the notebooks call them before plotting,
+# and build_figures.py calls them to regenerate the csv outputs headlessly
+
+import numpy as np
+import pandas as pd
+
+# the phases that are compared between v1 and v2
+STEPS = ["read_files", "hmm_scan", "hmm_align", "distance_calc", "cc_gen"]
+
+# IMPORTANT: this is a manually calculated total time for BiG-SCAPE v1 at 50000 samples
+# this run did not finish. See the paper methods section for details about how this was
+# calculated
+BIGSCAPE_V1_50K_TOTAL = 153030
+
+
+def combine_v2_saves(bigscape_v2_matrix: pd.DataFrame):
+    # for v2 we want to combine the saving steps with their preceding steps
+    matrix = bigscape_v2_matrix.copy()
+    matrix["hmm_scan"] = matrix["hmm_scan"] + matrix["hmm_scan_save"]
+    matrix["hmm_align"] = matrix["hmm_align"] + matrix["hmm_align_save"]
+    matrix["cc_gen"] = matrix["cc_gen"] + matrix["cc_gen_save"]
+
+    # then drop the saving columns
+    return matrix.drop(columns=["hmm_scan_save", "hmm_align_save", "cc_gen_save"])
+
+
+def average_mode_runs(bigscape_v2_mode_10k_matrix: pd.DataFrame):
+    matrix = bigscape_v2_mode_10k_matrix.copy()
+
+    # these samples are in the format of 10k_[category]_[partition]. category can have underscores. remove the 10k and the parittion
+    matrix["sample"] = matrix["sample"].str.replace("10k_", "")
+    matrix["sample"] = matrix["sample"].str.replace("_[0-9]+", "", regex=True)
+
+    # average out per sample
+    return matrix.groupby(["sample"]).mean()
+
+
+def average_totals(
+    bigscape_v1_matrix: pd.DataFrame,
+    bigscape_v2_matrix: pd.DataFrame,
+    bigslice_v1_matrix: pd.DataFrame,
+    bigslice_v2_matrix: pd.DataFrame,
+):
+    # the matrices are indexed by size and sample. this is
+    # Supplementary_table_3_average_total_runtimes before rounding
+    totals = pd.DataFrame(index=bigscape_v2_matrix.index)
+    totals["BiG-SLICE v1.1"] = bigslice_v1_matrix["total"]
+    totals["BiG-SLICE v2.0"] = bigslice_v2_matrix["total"]
+    totals["BiG-SCAPE v1.1"] = bigscape_v1_matrix["total"]
+    totals["BiG-SCAPE v2.0"] = bigscape_v2_matrix["total"]
+
+    # average
+    totals = totals.groupby(["size"]).mean()
+
+    # calculate relative performance
+    totals["Relative performance (2.0.0 v 1.1)"] = totals["BiG-SCAPE v1.1"] / totals["BiG-SCAPE v2.0"]
+
+    totals.loc[50000, "BiG-SCAPE v1.1"] = BIGSCAPE_V1_50K_TOTAL
+
+    return totals
+
+
+def melt_totals(totals: pd.DataFrame):
+    # one row per size and tool, used for the scatter plots of figure 3a
+    totals = totals.copy()
+    # re-add size as a column
+    totals["size"] = totals.index.get_level_values(0)
+    return totals.melt(value_name="total", var_name="Tool", id_vars="size")
+
+
+def mode_totals(mode_matrix: pd.DataFrame):
+    # Supplementary_table_4_average_mode_runtimes before rounding
+    totals = pd.DataFrame()
+    totals["total"] = mode_matrix["total"]
+    return totals
+
+
+def average_proportions(bigscape_matrix: pd.DataFrame, version: str):
+    # average runtime per step and size, both in seconds and as a proportion
+    # of the total. bigscape_matrix is indexed by size and sample
+
+    # average out the replicates
+    matrix_avg = bigscape_matrix.groupby(["size"]).mean()
+
+    # drop the start column
+    matrix_avg = matrix_avg.drop(columns=["start"])
+
+    # calculate proportional data
+    prop = matrix_avg[STEPS].div(matrix_avg["total"], axis=0)
+
+    # add absolute matrix to proportional data
+    prop_abs = prop.copy()
+    prop_abs.columns = [col + "_prop" for col in prop_abs.columns]
+    prop_abs[STEPS] = matrix_avg[STEPS]
+
+    # add version column at the start
+    prop_abs.insert(0, "version", version)
+
+    # add totals column
+    prop_abs["total_logged"] = matrix_avg["total"]
+
+    return prop_abs
+
+
+def step_proportions(bigscape_v1_prop_abs: pd.DataFrame, bigscape_v2_prop_abs: pd.DataFrame):
+    # figure 3b: percentage of the runtime spent in hmm and distance
+    # calculation. size=10 suffered from a low resolution in runtime
+    # statistics since v1 rounds to the nearest seconds, see methods
+    v1 = bigscape_v1_prop_abs.drop(10)
+    v2 = bigscape_v2_prop_abs.drop(10)
+
+    proportions = pd.concat(
+        [
+            v1["hmm_scan_prop"] + v1["hmm_align_prop"],
+            v2["hmm_scan_prop"] + v2["hmm_align_prop"],
+            v1["distance_calc_prop"],
+            v2["distance_calc_prop"],
+        ],
+        axis=1,
+    )
+
+    proportions *= 100.0
+
+    proportions.columns = ["hmm v1", "hmm v2", "dist_calc v1", "dist_calc v2"]
+    return proportions
+
+
+def cpu_stats(rollup: pd.DataFrame):
+    # figure 3c: mean cpu usage per sample time in percent, from a rollup of
+    # the get_performance_run matrix with a bucket of 0 seconds, like
+    # profile_rollup.read_rollup gives. sorted by sample time, then version
+    stats = rollup.set_index(["seconds", "version"])[["cpu_mean"]].rename(columns={"cpu_mean": "cpu"}).sort_index()
+    # multiply by 100 to get percentage
+    stats["cpu"] *= 100
+    return stats
+
+
+def version_end(stats: pd.DataFrame, version: str):
+    # last sample time of a version in cpu_stats
+    return stats[stats.index.get_level_values("version") == version].index.get_level_values("seconds").max()
+
+
+def missing_runtime_fit(crash_timings: pd.DataFrame, target: int = 50000, order: int = 2):
+    # fits the missing runtime of the v1 runs that did not crash and projects
+    # it to the run at target that did. returns the fit coefficients and the
+    # crash timings as an array, with the projection filled in on the target
+    # row, rounded to the nearest second
+    timings = crash_timings.to_numpy()
+
+    target_row = timings[timings[:, 0] == target]
+    pre_crash = target_row[0, 4]
+
+    timings = timings[timings[:, 0] != target]
+
+    coefficients = np.polyfit(timings[:, 0], timings[:, 6], order)
+
+    estimate_missing_time = np.polyval(coefficients, target).round(0)
+    target_row[0, 6] = estimate_missing_time
+    target_row[0, 5] = pre_crash + estimate_missing_time
+
+    return coefficients, np.vstack((timings, target_row))
+
+
+def missing_runtime_table(timings: np.ndarray):
+    # Figure_S10 from the array returned by missing_runtime_fit
+    table = pd.DataFrame(timings[:, [0, 1, 6]])
+    table.columns = ["# Records", "Sample", "Missing runtime"]
+    return table
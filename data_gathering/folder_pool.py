@@ -0,0 +1,102 @@
+# runs a per-folder parsing function over all run folders of a sweep
+#
+# with jobs == 1 everything runs in this process. with more jobs the folders
+# are handed out to a process pool. in both cases results come back in the
+# same order as the folders that were passed in, and a folder that raises is
+# reported on stderr and skipped instead of taking the whole run down
+#
+# with --profile, the counters and stage times a worker records while parsing
+# a folder are sent back with its result and added to those of this process
+#
+# on a network filesystem (nfs, lustre) the parsers mostly wait on metadata
+# round trips: every scandir, stat and small read blocks until the metadata
+# server answers, while the next folder sits idle. with --io_threads N the
+# folders are handed to a pool of N threads instead, so up to N folders have
+# their calls in flight at once. python releases the GIL around these calls,
+# so the waits overlap even though the parsing itself is not parallel. N is
+# also the limit on outstanding requests, keep it modest on a shared metadata
+# server
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+import os
+import sys
+import traceback
+
+import instrumentation
+
+
+def _safe_call(func, profiling: bool, folder: Path):
+    # exceptions are turned into a value here so that they survive the trip
+    # back from a worker process without cancelling the rest of the pool.
+    # profiling is only set for pool workers, a spawned worker does not
+    # inherit it, and in this process the numbers are recorded directly
+    if not profiling:
+        try:
+            return True, func(folder), None
+        except Exception:
+            return False, traceback.format_exc(limit=-1), None
+
+    instrumentation.ENABLED = True
+    before = instrumentation.snapshot()
+    try:
+        ok, result = True, func(folder)
+    except Exception:
+        ok, result = False, traceback.format_exc(limit=-1)
+    return ok, result, instrumentation.difference(instrumentation.snapshot(), before)
+
+
+def report_error(folder: Path, error: str):
+    print("Error in folder:" + str(folder), file=sys.stderr)
+    print(error.rstrip(), file=sys.stderr)
+
+
+def _collect(folders: list[Path], outcomes):
+    for folder, (ok, result, stats) in zip(folders, outcomes):
+        if stats is not None:
+            instrumentation.merge(stats)
+        if ok:
+            yield folder, result
+        else:
+            report_error(folder, result)
+
+
+def list_folders(path: Path):
+    # the subfolders of path. scandir knows from the listing itself which
+    # entries are folders, so this does not stat every entry like
+    # iterdir + is_dir does
+    instrumentation.count("dir_listings")
+    with os.scandir(path) as entries:
+        return [Path(entry.path) for entry in entries if entry.is_dir()]
+
+
+def add_io_argument(parser):
+    parser.add_argument(
+        "--io_threads",
+        type=int,
+        default=1,
+        metavar="N",
+        help="parse up to N folders at once in threads, to hide the latency of network filesystems",
+    )
+
+
+def map_folders(func, folders: list[Path], jobs: int = 1, threads: int = 1):
+    # func has to be a module level function so it can be pickled for the pool
+    if threads > 1:
+        # the threads record into the instrumentation of this process directly
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            yield from _collect(folders, executor.map(partial(_safe_call, func, False), folders))
+        return
+
+    if jobs <= 1:
+        yield from _collect(folders, map(partial(_safe_call, func, False), folders))
+        return
+
+    call = partial(_safe_call, func, instrumentation.ENABLED)
+
+    # small chunks keep the load balanced when a few folders have huge logs
+    chunksize = max(1, len(folders) // (jobs * 8))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from _collect(folders, executor.map(call, folders, chunksize=chunksize))
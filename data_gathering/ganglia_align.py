@@ -0,0 +1,164 @@
+# alignment of ganglia memory exports with the profile timeline
+#
+# the ganglia exports (source_data/ganglia_memory_*.csv) have a Timestamp
+# column and one column per memory metric, in bytes, named like "Use\g". in
+# the exports we have, every timestamp is 1970-01-01, so the only thing known
+# about a sample is its position: the samples span the run from the first to
+# the last profile sample. exports with real timestamps are placed by time
+#
+# load_ganglia reads an export in chunks, keeps only the requested metrics
+# and converts them to the requested unit chunk by chunk, so even the very
+# large exports are only read once and never held in memory as text or in
+# bytes next to the converted copy
+#
+# the aligned memory series and the cpu series from get_performance_run are
+# then interpolated onto one common time grid. gaps (NaN samples) are not
+# bridged if they are longer than max_gap seconds
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+UNIT_DIVISORS = {
+    "B": 1,
+    "KB": 1024,
+    "MB": 1024**2,
+    "GB": 1024**3,
+    "TB": 1024**4,
+}
+
+# ganglia metric name -> column name after loading
+GANGLIA_METRICS = {
+    "Use\\g": "use",
+    "Share\\g": "share",
+    "Cache\\g": "cache",
+    "Buffer\\g": "buffer",
+    "Swap\\g": "swap",
+    "Total\\g": "total",
+}
+
+# rows per chunk while loading
+CHUNK_SIZE = 1_000_000
+
+
+def load_ganglia(
+    path: Path,
+    metrics: tuple[str, ...] = ("use",),
+    unit: str = "GB",
+    chunksize: int = CHUNK_SIZE,
+):
+    # returns a dataframe with a sample column (the position of the row in
+    # the export), a seconds column with the time since the first sample, or
+    # NaN if the export has no real timestamps, and one column per metric
+    names = {name: ganglia for ganglia, name in GANGLIA_METRICS.items()}
+    divisor = UNIT_DIVISORS[unit]
+
+    chunks = []
+    first_time = None
+    timestamps_vary = False
+    for chunk in pd.read_csv(
+        path,
+        usecols=["Timestamp", *[names[metric] for metric in metrics]],
+        dtype={names[metric]: np.float64 for metric in metrics},
+        chunksize=chunksize,
+    ):
+        times = pd.to_datetime(chunk["Timestamp"], utc=True).dt.tz_localize(None).to_numpy()
+        if first_time is None:
+            first_time = times[0]
+        timestamps_vary = timestamps_vary or bool((times != first_time).any())
+
+        converted = pd.DataFrame({"seconds": (times - first_time) / np.timedelta64(1, "s")})
+        for metric in metrics:
+            converted[metric] = chunk[names[metric]].to_numpy() / divisor
+        chunks.append(converted)
+
+    ganglia = pd.concat(chunks, ignore_index=True)
+    ganglia.insert(0, "sample", np.arange(len(ganglia)))
+    if not timestamps_vary:
+        ganglia["seconds"] = np.nan
+    return ganglia
+
+
+def span_seconds(samples: int, start: float, end: float):
+    # evenly spreads samples over start to end. like the original notebook,
+    # every sample marks the start of its interval, so the last one is one
+    # step before end
+    return start + np.arange(samples) * (end - start) / samples
+
+
+def align_to_span(ganglia: pd.DataFrame, start: float, end: float):
+    # places an export without real timestamps on the profile time axis
+    aligned = ganglia.copy()
+    aligned["seconds"] = span_seconds(len(aligned), start, end)
+    return aligned
+
+
+def align_to_start(ganglia: pd.DataFrame, offset: float):
+    # places an export with real timestamps on the profile time axis. offset
+    # is the time from the first profile sample to the first ganglia sample
+    aligned = ganglia.copy()
+    aligned["seconds"] = aligned["seconds"] + offset
+    return aligned
+
+
+def interpolate(seconds: np.ndarray, values: np.ndarray, grid: np.ndarray, max_gap: float | None = None):
+    # linear interpolation of values onto grid. NaN outside the series, and
+    # inside gaps between valid samples that are longer than max_gap
+    seconds = np.asarray(seconds, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    valid = ~np.isnan(values)
+    seconds = seconds[valid]
+    values = values[valid]
+    if len(seconds) == 0:
+        return np.full(len(grid), np.nan)
+
+    result = np.interp(grid, seconds, values, left=np.nan, right=np.nan)
+
+    if max_gap is not None and len(seconds) > 1:
+        # grid points that fall exactly on a sample are never in a gap
+        right = np.clip(np.searchsorted(seconds, grid, side="left"), 1, len(seconds) - 1)
+        on_sample = seconds[right] == grid
+        gap = seconds[right] - seconds[right - 1]
+        result[(gap > max_gap) & ~on_sample] = np.nan
+
+    return result
+
+
+def common_grid(series: list[np.ndarray], step: float):
+    # grid with a point every step seconds over the span that all series
+    # have in common
+    start = max(np.nanmin(seconds) for seconds in series)
+    end = min(np.nanmax(seconds) for seconds in series)
+    return np.arange(start, end + step / 2, step)
+
+
+def align_performance(
+    rollup: pd.DataFrame,
+    ganglia: dict[str, pd.DataFrame],
+    step: float,
+    cpu_column: str = "cpu_mean",
+    memory_column: str = "use",
+    max_gap: float | None = None,
+):
+    # rollup is the --bucket output of get_performance_run, ganglia maps a
+    # version to its aligned export. returns version,seconds,cpu,memory with
+    # both series interpolated onto a common grid per version
+    aligned = []
+    for version, memory in ganglia.items():
+        cpu = rollup[rollup["version"] == version].sort_values("seconds")
+        memory = memory.sort_values("seconds")
+
+        grid = common_grid([cpu["seconds"].to_numpy(), memory["seconds"].to_numpy()], step)
+        aligned.append(
+            pd.DataFrame(
+                {
+                    "version": version,
+                    "seconds": grid,
+                    "cpu": interpolate(cpu["seconds"], cpu[cpu_column], grid, max_gap),
+                    "memory": interpolate(memory["seconds"], memory[memory_column], grid, max_gap),
+                }
+            )
+        )
+    return pd.concat(aligned, ignore_index=True)
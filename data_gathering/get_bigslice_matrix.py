@@ -6,111 +6,279 @@
 
 from pathlib import Path
 from argparse import ArgumentParser
-from datetime import datetime, timedelta
-from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
 import sqlite3
 
+from folder_pool import add_io_argument, list_folders, map_folders, report_error
+import instrumentation
+from matrix_io import write_matrix
+from online_aggregate import Aggregate, add_aggregate_arguments
+from parse_cache import ParseCache, file_fingerprint, map_folders_cached
+from phase_table import PhaseSchema, PhaseTable, to_ns
+from shards import add_shard_argument, select_shard, write_partial
 
-@dataclass
-class ExecutionTime:
-    start: datetime | float
-    end: datetime | float
-
-    def __init__(self):
-        self.start = None
-        self.end = None
-
-    @classmethod
-    def print_header(cls):
-        return ",".join(
-            [
-                "start",
-                "total",
-            ]
-        )
-
-    def to_list(self):
-        return [
-            self.start,
-            self.end,
-        ]
-
-    def to_seconds(self):
-        return [
-            (self.start - self.start).total_seconds(),
-            (self.end - self.start).total_seconds(),
-        ]
-
-    def __str__(self):
-        return ",".join(
-            map(
-                str,
-                [
-                    self.start,
-                    self.end,
-                ],
-            )
-        )
+
+# "run created" and "run finished" in the run log
+PHASES = PhaseSchema(
+    ["start", "end"],
+    [
+        ("start", "start", "start"),
+        ("total", "start", "end"),
+    ],
+)
 
 
 def get_folders(path: Path):
-    return [folder for folder in path.iterdir() if folder.is_dir()]
+    return list_folders(path)
+
+
+def get_db_path(result_path: Path):
+    return result_path / "result" / "data.db"
+
+
+def get_db_uri(db_path: Path):
+    # read only, and immutable so sqlite does not take any locks or look for
+    # a journal. only safe because the runs have finished writing their db
+    return db_path.resolve().as_uri() + "?mode=ro&immutable=1"
+
+
+def get_run_log_columns(conn: sqlite3.Connection, schema: str = "main"):
+    # the time is the second column of run_log and the message the last
+    columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(run_log)")]
+    if not columns:
+        raise sqlite3.OperationalError(f"no run_log table in {schema}")
+    return columns[1], columns[-1]
+
+
+def get_timings_query(conn: sqlite3.Connection, schema: str = "main"):
+    # earliest "run created" and latest "run finished" time. GLOB is case
+    # sensitive like startswith, and only the marker rows leave sqlite
+    time, message = get_run_log_columns(conn, schema)
+    return (
+        f'SELECT MIN(CASE WHEN "{message}" GLOB \'run created*\' THEN "{time}" END), '
+        f'MAX(CASE WHEN "{message}" GLOB \'run finished*\' THEN "{time}" END) '
+        f'FROM {schema}.run_log '
+        f'WHERE "{message}" GLOB \'run created*\' OR "{message}" GLOB \'run finished*\''
+    )
+
+
+def to_phase_row(start: str | None, end: str | None):
+    # a row of PHASES
+    instrumentation.count("timestamps_parsed", (start is not None) + (end is not None))
+    return [
+        None if start is None else to_ns(datetime.fromisoformat(start)),
+        None if end is None else to_ns(datetime.fromisoformat(end)),
+    ]
 
 
 def get_execution_time(result_path: Path):
-    execution_time = ExecutionTime()
+    conn = sqlite3.connect(get_db_uri(get_db_path(result_path)), uri=True)
+    instrumentation.count("db_queries")
+    try:
+        with instrumentation.stage("sqlite_query"):
+            start, end = conn.execute(get_timings_query(conn)).fetchone()
+    finally:
+        conn.close()
+
+    return to_phase_row(start, end)
+
+
+def get_batch_size():
+    # the number of databases that can be attached to one connection
+    conn = sqlite3.connect(":memory:")
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    finally:
+        conn.close()
+
+
+def get_batch_times(folders: tuple[Path, ...]):
+    # attaches the databases of a batch of folders to one connection and gets
+    # all their timings with a single query. returns (folder, ok, result)
+    # tuples, where result is a list of PHASES rows or an error
+    outcomes = {}
+    attached = []
+
+    conn = sqlite3.connect("file::memory:", uri=True)
+    try:
+        for index, folder in enumerate(folders):
+            # named after the position in the batch, so a folder that fails
+            # never leaves its name taken for the next one
+            schema = f"run{index}"
+            try:
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (get_db_uri(get_db_path(folder)),))
+            except sqlite3.Error as error:
+                outcomes[folder] = (False, repr(error))
+                continue
+            try:
+                query = get_timings_query(conn, schema)
+            except sqlite3.Error as error:
+                outcomes[folder] = (False, repr(error))
+                conn.execute(f"DETACH DATABASE {schema}")
+                continue
+            attached.append((folder, f"SELECT {len(attached)}, * FROM ({query})"))
+
+        if attached:
+            instrumentation.count("db_queries")
+            try:
+                with instrumentation.stage("sqlite_query"):
+                    rows = conn.execute(" UNION ALL ".join(query for _folder, query in attached)).fetchall()
+            except sqlite3.Error:
+                # one bad database fails the whole query, ask every folder
+                # on its own so only that one is reported
+                rows = None
+                for folder, _query in attached:
+                    try:
+                        outcomes[folder] = (True, [get_execution_time(folder)])
+                    except sqlite3.Error as error:
+                        outcomes[folder] = (False, repr(error))
+            if rows is not None:
+                for index, start, end in rows:
+                    outcomes[attached[index][0]] = (True, [to_phase_row(start, end)])
+    finally:
+        conn.close()
+
+    return [(folder, *outcomes[folder]) for folder in folders]
 
-    with sqlite3.connect(result_path / "result" / "data.db") as conn:
-        cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM run_log")
-        rows = cursor.fetchall()
+def map_folders_batched(folders: list[Path], jobs: int = 1, threads: int = 1):
+    # same results as map_folders(get_folder_times, ...), but with one query
+    # per batch of databases. batches are spread over the process or thread
+    # pool
+    batch_size = get_batch_size()
+    batches = [tuple(folders[i : i + batch_size]) for i in range(0, len(folders), batch_size)]
 
-        for row in rows:
-            if row[-1].startswith("run created"):
-                execution_time.start = datetime.fromisoformat(row[1])
-            if row[-1].startswith("run finished"):
-                execution_time.end = datetime.fromisoformat(row[1])
+    for _batch, outcomes in map_folders(get_batch_times, batches, jobs, threads):
+        for folder, ok, result in outcomes:
+            if ok:
+                yield folder, result
+            else:
+                report_error(folder, result)
 
-    return execution_time
+
+def get_size_sample(folder: Path):
+    # folder is samplesize_"replicate"_sample
+    size, _replicate, sample = folder.name.split("_")
+    return int(size), int(sample)
+
+
+def get_db_fingerprint(folder: Path):
+    return file_fingerprint(folder, [get_db_path(folder)])
+
+
+def get_folder_times(folder: Path):
+    return [get_execution_time(folder)]
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("path", type=Path)
 
+    # number of processes used to parse run folders
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+
+    # number of folders whose file system calls are in flight at once
+    add_io_argument(parser)
+
+    # sqlite file to keep parsed folders in between runs
+    parser.add_argument("-c", "--cache", type=Path, default=None)
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    add_shard_argument(parser)
+
+    add_aggregate_arguments(parser, None)
+
+    # attach many run databases to one connection and query them together
+    parser.add_argument("-b", "--batch", action="store_true")
+
+    instrumentation.add_profile_argument(parser)
+
     args = parser.parse_args()
 
-    def collate_results(path):
+    if args.jobs > 1 and args.io_threads > 1:
+        parser.error("use either --jobs or --io_threads")
+    if args.shard is not None and args.output is None:
+        parser.error("--shard needs --output for the partial result")
 
-        for folder in get_folders(path):
-            # folder is samplesize_"replicate"_sample
-            parts = folder.name.split("_")
+    if args.aggregate is not None and args.tool_version is None:
+        parser.error("--aggregate needs --tool_version, e.g. v1.1 or v2.0")
 
-            size, _replicate, sample = parts
-            size = int(size)
-            sample = int(sample)
+    instrumentation.start_profile(args.profile)
 
-            if len(parts) != 3:
-                parts = ["unknown", "unknown", "unknown"]
-            try:
-                execution_time = get_execution_time(folder)
-                # print(execution_time)
+    # the run folders this shard is responsible for
+    shard_folders = []
+    # and all run folders of the sweep, so the merge can tell if one is missing
+    sweep_folders = []
 
-                results = [size, sample, *execution_time.to_seconds()]
+    # running statistics of the runs, filled in while they are parsed
+    aggregate = Aggregate() if args.aggregate is not None else None
 
-                yield results
-            except:
-                print("Error in folder:" + str(folder))
-                continue
+    def collate_results(path):
+        with instrumentation.stage("list_folders"):
+            folders = sorted(get_folders(path))
+        if args.shard is not None:
+            sweep_folders.extend(folders)
+            folders = select_shard(folders, args.shard)
+        shard_folders.extend(folders)
+        cache = ParseCache(args.cache, "bigslice") if args.cache else None
+
+        table = PhaseTable(PHASES)
+        for folder, runs in map_folders_cached(
+            get_folder_times,
+            get_db_fingerprint,
+            None,
+            folders,
+            args.jobs,
+            cache,
+            mapper=partial(map_folders_batched, threads=args.io_threads) if args.batch else None,
+            threads=args.io_threads,
+        ):
+            size, sample = get_size_sample(folder)
+            for timestamps in runs:
+                if all(timestamp is None for timestamp in timestamps):
+                    report_error(folder, "no run created or run finished in the run log")
+                    continue
+                table.append([size, sample], timestamps)
+                if aggregate is not None:
+                    aggregate.add_run(
+                        "BiG-SLICE", args.tool_version, PHASES.header(), size, sample, PHASES.durations_of(timestamps)
+                    )
+                missing = table.missing(len(table) - 1)
+                if missing:
+                    # the durations that need these are left empty
+                    report_error(folder, "missing from the run log: " + ", ".join(missing))
+
+        if cache is not None:
+            cache.close()
+
+        return table.to_rows()
 
     def sort_key(result):
-        return result[0]
+        return result[0], result[1]
+
+    with instrumentation.stage("collate"):
+        results = sorted(collate_results(args.path), key=sort_key)
+
+    columns = ["size", "sample", *PHASES.header()]
+
+    if aggregate is not None:
+        with instrumentation.stage("aggregate"):
+            aggregate.save(args.aggregate)
+
+    with instrumentation.stage("output"):
+        if args.shard is not None:
+            write_partial("bigslice", args.shard, shard_folders, sweep_folders, columns, results, args.output)
+            exit(0)
 
-    results = list(collate_results(args.path))
+        if args.output:
+            write_matrix(columns, results, args.output)
+            exit(0)
 
-    print("size,sample," + ExecutionTime.print_header())
+        print(",".join(columns))
 
-    for result in sorted(results, key=sort_key):
-        str_list = map(str, result)
-        print(",".join(str_list))
+        for result in results:
+            str_list = ["" if value is None else str(value) for value in result]
+            print(",".join(str_list))
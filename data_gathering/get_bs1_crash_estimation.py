@@ -25,91 +25,109 @@
 
 from pathlib import Path
 from argparse import ArgumentParser
-from datetime import datetime
 
-
-def get_js_file(path: Path):
-    html_networks_folder = path / "html_content" / "networks"
-    if not html_networks_folder.exists():
-        return None
-
-    # should contain only one subfolder
-    html_nw_cutoff_folder = next(html_networks_folder.iterdir(), None)
-
-    if not html_nw_cutoff_folder or not html_nw_cutoff_folder.is_dir():
+from bs1_tree import V1RunTree, scan_v1_run
+from folder_pool import add_io_argument, list_folders, map_folders
+from matrix_io import write_matrix
+import instrumentation
+
+COLUMNS = [
+    "size",
+    "sample",
+    "run_start",
+    "distance_calc_end",
+    "pre_crash_time",
+    "run_end",
+    "missing_runtime",
+]
+
+
+def get_subfolder_stats_from_tree(tree: V1RunTree):
+    # runtimes.txt is needed for the run end
+    if tree.cc_gen is None:
         return None
 
-    html_nw_mix_folder = html_nw_cutoff_folder / "mix"
-
-    if not html_nw_mix_folder.exists():
-        return None
-
-    js_file = html_nw_mix_folder / "bs_networks.js"
-
-    if not js_file.exists():
-        return None
-
-    return js_file
-
-
-def get_v1_hmmalign_times(folder: Path):
-    # mtime for pfd or pfs folder. pfd is fine. last file is end of hmmalign
-    pfd_folder = folder / "cache" / "pfd"
-
-    return datetime.fromtimestamp(pfd_folder.stat().st_mtime)
-
-
-def get_v1_start(folder: Path):
-    # one of the first things written is parameters.txt under /logs
-    return datetime.fromtimestamp((folder / "logs" / "parameters.txt").stat().st_mtime)
+    return [
+        tree.start,
+        tree.hmm_align,
+        tree.distance_calc,
+        # creation time of the js file
+        tree.pre_crash,
+        # last modified time of runtimes.txt
+        tree.cc_gen,
+    ]
 
 
-def get_v1_distance_calc(folder: Path):
-    # get the mtime of the network file
-    network_files_folder = folder / "network_files"
-    if not network_files_folder.exists():
-        return None
+def get_subfolder_stats(path: Path):
+    return get_subfolder_stats_from_tree(scan_v1_run(path))
 
-    network_cutoff_folder = next(network_files_folder.iterdir(), None)
 
-    if not network_cutoff_folder or not network_cutoff_folder.is_dir():
-        return None
+def get_crash_rows(stats: list):
+    # stats are [size, sample, *subfolder stats] lists. returns the rows of the
+    # crash timings table in seconds, sorted by size and sample
 
-    mix_folder = network_cutoff_folder / "mix"
-    network_file = mix_folder / "mix_c0.30.network"
-    if not network_file.exists():
-        return None
-    return datetime.fromtimestamp(network_file.stat().st_mtime)
+    # sort first by samples, then by replicate
+    # this is just for printing things in order
+    stats = sorted(stats, key=lambda x: (int(x[0]), x[1]))
 
+    rows = []
 
-def get_subfolder_stats(path: Path):
-    start_time = get_v1_start(path)
+    # go through all the stats and convert them to seconds
+    for stat in stats:
+        if stat[2] is None or stat[3] is None:
+            continue
 
-    post_hmmalign_time = get_v1_hmmalign_times(path)
+        run_start = stat[2]
+        distance_calc_end = stat[4]
+        pre_crash_time = stat[5]
+        end_time = stat[6]
+        missing_runtime = None
 
-    post_distance_calculation = get_v1_distance_calc(path)
+        # here we have to calculate the post crash time for everything under 50k samples
+        if int(stat[0]) < 50000:
+            missing_runtime = end_time - pre_crash_time
+        # for 50k samples, there is no end time. the missing time is estimated
+        # from the smaller runs in crash_estimation.ipynb
+        else:
+            end_time = None
 
-    # get the creation time of the js file
-    js_file = get_js_file(path)
+        # convert everything to seconds
+        rows.append(
+            [
+                int(stat[0]),
+                int(stat[1]),
+                0,
+                (distance_calc_end - run_start).total_seconds(),
+                (pre_crash_time - run_start).total_seconds(),
+                (end_time - run_start).total_seconds() if end_time is not None else None,
+                missing_runtime.total_seconds() if missing_runtime is not None else None,
+            ]
+        )
 
-    pre_crash_time = (
-        datetime.fromtimestamp(js_file.stat().st_ctime) if js_file else None
-    )
+    return rows
 
-    # get the last modified time of the runtimes.txt file
-    runtimes_file = path / "logs" / "runtimes.txt"
-    if not runtimes_file.exists():
-        return None
 
-    last_modified_time = datetime.fromtimestamp(runtimes_file.stat().st_mtime)
+def print_crash_rows(rows: list):
+    print(",".join(COLUMNS))
+    for row in rows:
+        (
+            size,
+            sample,
+            run_start_seconds,
+            distance_calc_end_seconds,
+            pre_crash_time_seconds,
+            end_time_seconds,
+            missing_runtime_seconds,
+        ) = ["" if value is None else value for value in row]
 
-    return [
-        start_time,
-        post_hmmalign_time,
-        post_distance_calculation,
-        pre_crash_time,
-        last_modified_time,
-    ]
+        print(
+            f"{size},{sample},"
+            f"{run_start_seconds},"
+            f"{distance_calc_end_seconds},"
+            f"{pre_crash_time_seconds},"
+            f"{end_time_seconds},",
+            f"{missing_runtime_seconds}",
+        )
 
 
 if __name__ == "__main__":
@@ -118,8 +136,18 @@ if __name__ == "__main__":
         "path", type=Path, help="Path to the folder containing the results"
     )
 
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    # number of folders whose file system calls are in flight at once
+    add_io_argument(parser)
+
+    instrumentation.add_profile_argument(parser)
+
     args = parser.parse_args()
 
+    instrumentation.start_profile(args.profile)
+
     path = args.path
 
     if not path.exists() or not path.is_dir():
@@ -128,68 +156,24 @@ if __name__ == "__main__":
 
     stats = []
 
-    print(
-        "size,sample,run_start,distance_calc_end,pre_crash_time,run_end,missing_runtime"
-    )
-    for subfolder in path.iterdir():
-        if not subfolder.is_dir():
-            continue
-
-        subfolder_samples = subfolder.name.split("_")[0]
-        subfolder_replicate = subfolder.name.split("_")[2]
-
-        stats.append(
-            [subfolder_samples, subfolder_replicate] + get_subfolder_stats(subfolder)
-        )
+    with instrumentation.stage("collate"):
+        subfolders = list_folders(path)
+        instrumentation.count("folders_visited", len(subfolders))
 
-    # sort first by samples, then by replicate
-    # this is just for printing things in order
-    stats.sort(key=lambda x: (int(x[0]), x[1]))
-
-    # data for the estimate later
-    post_crash_estimate_data = []
-    start_50k = None
-    pre_crash_50k = None
+        for subfolder, subfolder_stats in map_folders(get_subfolder_stats, subfolders, threads=args.io_threads):
+            subfolder_samples = subfolder.name.split("_")[0]
+            subfolder_replicate = subfolder.name.split("_")[2]
 
-    # go through all the stats and print them
-    for stat in stats:
-        if stat[2] is None or stat[3] is None:
-            continue
+            if subfolder_stats is None:
+                continue
 
-        run_start = stat[2]
-        distance_calc_end = stat[4]
-        pre_crash_time = stat[5]
-        end_time = stat[6]
-        missing_runtime = None
+            stats.append([subfolder_samples, subfolder_replicate] + subfolder_stats)
 
-        # here we have to calculate the post crash time for everything under 50k samples
-        if int(stat[0]) < 50000:
-            missing_runtime = end_time - pre_crash_time
-            post_crash_estimate_data.append(
-                [float(stat[0]), float(missing_runtime.total_seconds())]
-            )
-        # for 50k samples, we need to store the start time and pre crash time
-        else:
-            start_50k = run_start
-            pre_crash_50k = pre_crash_time
-            end_time = None
+        rows = get_crash_rows(stats)
 
-        # convert everything to seconds
-        run_start_seconds = 0
-        distance_calc_end_seconds = (distance_calc_end - run_start).total_seconds()
-        pre_crash_time_seconds = (pre_crash_time - run_start).total_seconds()
-        end_time_seconds = (
-            (end_time - run_start).total_seconds() if end_time is not None else ""
-        )
-        missing_runtime_seconds = (
-            missing_runtime.total_seconds() if missing_runtime is not None else ""
-        )
+    with instrumentation.stage("output"):
+        if args.output:
+            write_matrix(COLUMNS, rows, args.output)
+            exit(0)
 
-        print(
-            f"{stat[0]},{stat[1]},"
-            f"{run_start_seconds},"
-            f"{distance_calc_end_seconds},"
-            f"{pre_crash_time_seconds},"
-            f"{end_time_seconds},",
-            f"{missing_runtime_seconds}",
-        )
+        print_crash_rows(rows)
@@ -6,213 +6,189 @@
 
 from pathlib import Path
 from argparse import ArgumentParser
-from datetime import datetime, timedelta
-from dataclasses import dataclass
-
-
-@dataclass
-class ExecutionTime:
-    start: datetime | float
-    read_files: datetime | float
-    hmm_scan: datetime | float
-    hmm_align: datetime | float
-    distance_calc: datetime | float
-    cc_gen: datetime | float
-    end: datetime | float
-
-    def __init__(self):
-        self.start = None
-        self.read_files = None
-        self.hmm_scan = None
-        self.hmm_align = None
-        self.distance_calc = None
-        self.cc_gen = None
-        self.end = None
-
-    @classmethod
-    def print_header(cls):
-        return ",".join(
-            [
-                "start",
-                "read_files",
-                "hmm_scan",
-                "hmm_align",
-                "distance_calc",
-                "cc_gen",
-                "total",
-            ]
-        )
-
-    def to_list(self):
-        return [
-            self.start,
-            self.read_files,
-            self.hmm_scan,
-            self.hmm_align,
-            self.distance_calc,
-            self.cc_gen,
-            self.end,
-        ]
-
-    def to_seconds(self):
-        result = []
-
-        if self.start is not None and self.start is not None:
-            result.append((self.start - self.start).total_seconds())
-        else:
-            result.append(None)
-
-        if self.read_files is not None and self.start is not None:
-            result.append((self.read_files - self.start).total_seconds())
-        else:
-            result.append(None)
-
-        if self.hmm_scan is not None and self.read_files is not None:
-            result.append((self.hmm_scan - self.read_files).total_seconds())
-        else:
-            result.append(None)
-
-        if self.hmm_align is not None and self.hmm_scan is not None:
-            result.append((self.hmm_align - self.hmm_scan).total_seconds())
-        else:
-            result.append(None)
-
-        if self.distance_calc is not None and self.hmm_align is not None:
-            result.append((self.distance_calc - self.hmm_align).total_seconds())
-        else:
-            result.append(None)
-
-        if self.cc_gen is not None and self.distance_calc is not None:
-            result.append((self.cc_gen - self.distance_calc).total_seconds())
-        else:
-            result.append(None)
-
-        if self.end is not None and self.start is not None:
-            result.append((self.end - self.start).total_seconds())
-        else:
-            result.append(None)
-
-        return result
-
-    def __str__(self):
-        return ",".join(
-            map(
-                str,
-                [
-                    self.start,
-                    self.read_files,
-                    self.hmm_scan,
-                    self.hmm_align,
-                    self.distance_calc,
-                    self.cc_gen,
-                    self.end,
-                ],
-            )
-        )
+
+from bs1_tree import V1RunTree, scan_v1_run
+from folder_pool import add_io_argument, list_folders, report_error
+from get_bs1_crash_estimation import COLUMNS as CRASH_COLUMNS, get_crash_rows, get_subfolder_stats_from_tree
+import instrumentation
+from matrix_io import write_matrix
+from online_aggregate import Aggregate, add_aggregate_arguments
+from parse_cache import ParseCache, file_fingerprint, map_folders_cached
+from phase_table import PhaseSchema, PhaseTable
+from shards import add_shard_argument, select_shard, write_partial
+
+
+# timestamps of a run, taken from the result files by bs1_tree, and the
+# durations in the matrix
+PHASES = PhaseSchema(
+    ["start", "read_files", "hmm_scan", "hmm_align", "distance_calc", "cc_gen", "end"],
+    [
+        ("start", "start", "start"),
+        ("read_files", "start", "read_files"),
+        ("hmm_scan", "read_files", "hmm_scan"),
+        ("hmm_align", "hmm_scan", "hmm_align"),
+        ("distance_calc", "hmm_align", "distance_calc"),
+        # cc_gen is just the mtime of the runtimes.txt under logs
+        ("cc_gen", "distance_calc", "cc_gen"),
+        ("total", "start", "end"),
+    ],
+)
 
 
 def get_folders(path: Path):
-    return [folder for folder in path.iterdir() if folder.is_dir()]
+    return list_folders(path)
 
 
 def get_v1_logfile(folder: Path):
     return folder / "logs" / "runtimes.txt"
 
 
-def get_v1_start(folder: Path):
-    # one of the first things written is parameters.txt under /logs
-    return datetime.fromtimestamp((folder / "logs" / "parameters.txt").stat().st_mtime)
+def get_execution_time(result_path: Path):
+    # a row of PHASES
+    return PHASES.row_from(scan_v1_run(result_path))
 
 
-def get_v1_read_files(folder: Path):
-    # fasta folder mtime should be equal to when the last file was written there.
-    # this is done after the data is read in as one of the last steps relevant to input parsing
-    return datetime.fromtimestamp((folder / "cache" / "fasta").stat().st_mtime)
+def get_size_sample(folder: Path):
+    # folder is samplesize_"replicate"_sample
+    size, _replicate, sample = folder.name.split("_")
+    return int(size), int(sample)
 
 
-def get_v1_hmmscan_times(folder: Path):
-    # mtime for domtable folder. last file in this is the end of this step
-    domtable_folder = folder / "cache" / "domtable"
+def get_runtimes_fingerprint(folder: Path):
+    # runtimes.txt is the last file written by a v1 run, so if it did not
+    # change, none of the other timestamps did either
+    return file_fingerprint(folder, [get_v1_logfile(folder)])
 
-    return datetime.fromtimestamp(domtable_folder.stat().st_mtime)
 
+def get_folder_times(folder: Path):
+    # the whole tree is kept, so the crash estimation can use it as well
+    return [scan_v1_run(folder)]
 
-def get_v1_hmmalign_times(folder: Path):
-    # mtime for pfd or pfs folder. pfd is fine. last file is end of hmmalign
-    pfd_folder = folder / "cache" / "pfd"
 
-    return datetime.fromtimestamp(pfd_folder.stat().st_mtime)
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("path", type=Path)
 
+    # number of processes used to parse run folders
+    parser.add_argument("-j", "--jobs", type=int, default=1)
 
-def get_v1_distance_calc(folder: Path):
-    # after much thought, in mix mode the modify time of the results/network_files/[timestamp]/mix/mix_c0.30.network file
-    # is the better way of measuring this one. the runtime log only reports the execution of the generate_networks function,
-    # but there is more to only that function that is relevant to the distance calculation step
+    # number of folders whose file system calls are in flight at once
+    add_io_argument(parser)
 
-    network_files_subfolder = folder / "network_files"
-    # just get the first subfolder
-    network_files_result_folder = list(network_files_subfolder.iterdir())[0]
-    # network file will be under that folder / mix / mix_c0.30.network
-    network_file = network_files_result_folder / "mix" / "mix_c0.30.network"
-    # mtime of that
-    return datetime.fromtimestamp(network_file.stat().st_mtime)
+    # sqlite file to keep parsed folders in between runs
+    parser.add_argument("-c", "--cache", type=Path, default=None)
 
-def get_v1_cc_gen(folder: Path):
-    # just get the mtime of the runtimes.txt under logs
-    return datetime.fromtimestamp(get_v1_logfile(folder).stat().st_mtime)
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
 
-def get_execution_time(result_path: Path):
-    execution_time = ExecutionTime()
+    add_shard_argument(parser)
 
-    execution_time.start = get_v1_start(result_path)
-    execution_time.read_files = get_v1_read_files(result_path)
-    execution_time.hmm_scan = get_v1_hmmscan_times(result_path)
-    execution_time.hmm_align = get_v1_hmmalign_times(result_path)
-    execution_time.distance_calc = get_v1_distance_calc(result_path)
-    execution_time.cc_gen = get_v1_cc_gen(result_path)
+    add_aggregate_arguments(parser, "v1.1")
 
-    with open(get_v1_logfile(result_path)) as f:
-        for line in f:
-            if line.strip().startswith("Main function took"):
-                execution_time.end = execution_time.start + timedelta(
-                    seconds=float(line.split()[-2])
-                )
+    # also write the crash timings table of get_bs1_crash_estimation from the
+    # same traversal, as .parquet/.arrow/.feather/.csv
+    parser.add_argument("--crash_output", type=Path, default=None)
 
-    return execution_time
+    instrumentation.add_profile_argument(parser)
 
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    parser = ArgumentParser()
-    parser.add_argument("path", type=Path)
+    if args.jobs > 1 and args.io_threads > 1:
+        parser.error("use either --jobs or --io_threads")
+    if args.shard is not None and args.output is None:
+        parser.error("--shard needs --output for the partial result")
+    if args.shard is not None and args.crash_output is not None:
+        parser.error("--crash_output can not be sharded, run it without --shard")
 
-    args = parser.parse_args()
+    instrumentation.start_profile(args.profile)
 
-    print("size,sample," + ExecutionTime.print_header())
+    crash_stats = []
+    # the run folders this shard is responsible for
+    shard_folders = []
+    # and all run folders of the sweep, so the merge can tell if one is missing
+    sweep_folders = []
+
+    # running statistics of the runs, filled in while they are parsed
+    aggregate = Aggregate() if args.aggregate is not None else None
 
     def collate_results(path):
+        with instrumentation.stage("list_folders"):
+            folders = sorted(get_folders(path))
+        if args.crash_output is None:
+            # skip 50k. the crash estimation does need it
+            folders = [folder for folder in folders if get_size_sample(folder)[0] != 50000]
+        if args.shard is not None:
+            sweep_folders.extend(folders)
+            folders = select_shard(folders, args.shard)
+        shard_folders.extend(folders)
+
+        cache = ParseCache(args.cache, "bs1") if args.cache else None
+
+        table = PhaseTable(PHASES)
+        for folder, trees in map_folders_cached(
+            get_folder_times,
+            get_runtimes_fingerprint,
+            V1RunTree,
+            folders,
+            args.jobs,
+            cache,
+            threads=args.io_threads,
+        ):
+            size, sample = get_size_sample(folder)
+            for tree in trees:
+                subfolder_stats = get_subfolder_stats_from_tree(tree)
+                if subfolder_stats is not None:
+                    crash_stats.append([size, sample] + subfolder_stats)
+
+                # skip 50k
+                if size == 50000:
+                    continue
+
+                timestamps = PHASES.row_from(tree)
+                if all(timestamp is None for timestamp in timestamps):
+                    report_error(folder, "no v1 result files")
+                    continue
+                table.append([size, sample], timestamps)
+                if aggregate is not None:
+                    aggregate.add_run(
+                        "BiG-SCAPE", args.tool_version, PHASES.header(), size, sample, PHASES.durations_of(timestamps)
+                    )
+                missing = table.missing(len(table) - 1)
+                if missing:
+                    # the durations that need these are left empty
+                    report_error(folder, "missing v1 result files for " + ", ".join(missing))
+
+        if cache is not None:
+            cache.close()
+
+        return table.to_rows()
+
+    def sort_key(result):
+        return result[0], result[1]
 
-        for folder in get_folders(path):
-            # folder is samplesize_"replicate"_sample
-            parts = folder.name.split("_")
+    with instrumentation.stage("collate"):
+        results = sorted(collate_results(args.path), key=sort_key)
 
-            size, _replicate, sample = parts
-            size = int(size)
-            sample = int(sample)
+    columns = ["size", "sample", *PHASES.header()]
 
-            # skip 50k
-            if size == 50000:
-                continue
+    if aggregate is not None:
+        with instrumentation.stage("aggregate"):
+            aggregate.save(args.aggregate)
 
-            if len(parts) != 3:
-                parts = ["unknown", "unknown", "unknown"]
-            execution_time = get_execution_time(folder)
-            # print(execution_time)
-            results = [size, sample, *execution_time.to_seconds()]
-            yield results
+    with instrumentation.stage("output"):
+        if args.crash_output:
+            write_matrix(CRASH_COLUMNS, get_crash_rows(crash_stats), args.crash_output)
 
-    def sort_key(result):
-        return result[0]
+        if args.shard is not None:
+            write_partial("bs1", args.shard, shard_folders, sweep_folders, columns, results, args.output)
+            exit(0)
+
+        if args.output:
+            write_matrix(columns, results, args.output)
+            exit(0)
+
+        print(",".join(columns))
 
-    for result in sorted(collate_results(args.path), key=sort_key):
-        str_list = map(str, result)
-        print(",".join(str_list))
+        for result in results:
+            str_list = ["" if value is None else str(value) for value in result]
+            print(",".join(str_list))
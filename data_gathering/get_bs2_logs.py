@@ -4,10 +4,36 @@
 # for each folder:
 # - get files withing folder with .profile*
 # - get files ending in .log but not .config.log
+#
+# with --copy, files are copied by a pool of threads. a file that is already
+# in the output with the same size and mtime is skipped, so an interrupted
+# harvest can simply be run again. copies go through copy_file_range, which
+# lets the kernel (or the filesystem, as a reflink) do the copy, and fall
+# back to a normal copy across filesystems. with --link, files are hardlinked
+# instead when the output is on the same filesystem
+#
+# with --compress, logs and profiles are compressed while they are copied
+#
+# a file that fails to copy is reported and left out, the rest of the harvest
+# carries on. the exit code is 1 if any file failed
 
 from pathlib import Path
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import lzma
+import os
 import shutil
+import sys
+import time
+
+from compressed_files import strip_compression
+import instrumentation
+
+# files that are already compressed are copied as they are
+COMPRESSIBLE_SUFFIXES = [".log", ".profile"]
+
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
 
 
 def get_folders(path: Path):
@@ -15,15 +41,157 @@ def get_folders(path: Path):
 
 
 def get_files(folder: Path):
+    # one listing per folder, images and profiles first, then the logs
+    files = list(folder.iterdir())
+    instrumentation.count("dir_listings")
+
+    # already compressed logs and profiles are harvested as they are
     yield from filter(
-        lambda file: file.suffix == ".png" or file.suffix == ".profile",
-        folder.iterdir(),
+        lambda file: file.suffix == ".png" or strip_compression(file).suffix == ".profile",
+        files,
     )
     # log but no .config.log
     yield from filter(
-        lambda file: file.suffix == ".log" and not file.stem.endswith(".config"),
-        folder.iterdir(),
+        lambda file: strip_compression(file).suffix == ".log"
+        and not strip_compression(file).stem.endswith(".config"),
+        files,
+    )
+
+
+def open_compressed(path: Path, compression: str):
+    if compression == "gz":
+        return gzip.open(path, "wb")
+    if compression == "xz":
+        return lzma.open(path, "wb")
+
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError("--compress zst needs zstandard (pip install zstandard)") from error
+    return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+
+
+def get_target(file: Path, output_folder: Path, compression: str | None):
+    if compression is not None and file.suffix in COMPRESSIBLE_SUFFIXES:
+        return output_folder / f"{file.name}.{compression}"
+    return output_folder / file.name
+
+
+def is_up_to_date(source_stat: os.stat_result, target: Path, compressed: bool):
+    # copies get the mtime of their source. the size of a compressed file
+    # can not be compared, so only the mtime is checked for those
+    try:
+        target_stat = target.stat()
+    except FileNotFoundError:
+        return False
+
+    if target_stat.st_mtime_ns != source_stat.st_mtime_ns:
+        return False
+    return compressed or target_stat.st_size == source_stat.st_size
+
+
+def copy_file_range_all(source: Path, target: Path, size: int):
+    # raises OSError when the kernel or the filesystem can not do it, e.g.
+    # across filesystems on older kernels
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        copied = 0
+        while copied < size:
+            count = os.copy_file_range(
+                source_file.fileno(), target_file.fileno(), min(COPY_CHUNK_SIZE, size - copied)
+            )
+            if count == 0:
+                break
+            copied += count
+
+
+def copy_file(source: Path, target: Path, size: int):
+    if hasattr(os, "copy_file_range"):
+        try:
+            copy_file_range_all(source, target, size)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, target)
+
+
+def compress_file(source: Path, target: Path, compression: str):
+    with open(source, "rb") as source_file, open_compressed(target, compression) as target_file:
+        shutil.copyfileobj(source_file, target_file, COPY_CHUNK_SIZE)
+
+
+def harvest_file(file: Path, output_folder: Path, link: bool, compression: str | None):
+    # returns (target, action, bytes read from the source)
+    source_stat = file.stat()
+    target = get_target(file, output_folder, compression)
+    compressed = target.name != file.name
+    instrumentation.count("stat_calls", 2)
+
+    if is_up_to_date(source_stat, target, compressed):
+        return target, "skipped", 0
+
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    if link and not compressed and source_stat.st_dev == output_folder.stat().st_dev:
+        target.unlink(missing_ok=True)
+        os.link(file, target)
+        return target, "linked", 0
+
+    # write next to the target and rename, so that an interrupted copy is
+    # never mistaken for a finished one
+    partial = target.with_name(f".{target.name}.partial")
+    try:
+        if compressed:
+            compress_file(file, partial, compression)
+        else:
+            copy_file(file, partial, source_stat.st_size)
+        os.utime(partial, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        os.replace(partial, target)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+
+    return target, "compressed" if compressed else "copied", source_stat.st_size
+
+
+def try_harvest_file(file: Path, output_folder: Path, link: bool, compression: str | None):
+    # harvest_file, with an error returned in place of the target
+    try:
+        return harvest_file(file, output_folder, link, compression)
+    except OSError as error:
+        return error, "failed", 0
+
+
+def harvest(path: Path, output: Path, jobs: int, link: bool, compression: str | None):
+    # returns the number of files that failed
+    files = []
+    for folder in get_folders(path):
+        instrumentation.count("folders_visited")
+        files.extend((file, output / folder.name) for file in get_files(folder))
+
+    totals = {"copied": 0, "compressed": 0, "linked": 0, "skipped": 0, "failed": 0}
+    bytes_copied = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        outcomes = executor.map(lambda item: try_harvest_file(*item, link, compression), files)
+        for (file, _output_folder), (target, action, size) in zip(files, outcomes):
+            if action == "failed":
+                print(f"Error: {file}: {target}", file=sys.stderr)
+            else:
+                print(f"{file} -> {target} ({action})")
+            totals[action] += 1
+            bytes_copied += size
+
+    elapsed = time.perf_counter() - start
+    instrumentation.count("bytes_read", bytes_copied)
+
+    megabytes = bytes_copied / 1024 / 1024
+    summary = ", ".join(f"{count} {action}" for action, count in totals.items())
+    print(
+        f"{summary}. {megabytes:.1f} MB in {elapsed:.1f} s, {megabytes / max(elapsed, 1e-9):.1f} MB/s",
+        file=sys.stderr,
     )
+    return totals["failed"]
 
 
 if __name__ == "__main__":
@@ -32,13 +200,28 @@ if __name__ == "__main__":
     # output
     parser.add_argument("output", type=Path)
     parser.add_argument("-c", "--copy", action="store_true")
+
+    # number of files copied at the same time
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+
+    # hardlink instead of copying when the output is on the same filesystem
+    parser.add_argument("--link", action="store_true")
+
+    # compress .log and .profile files while copying them
+    parser.add_argument("--compress", choices=["gz", "xz", "zst"], default=None)
+
+    instrumentation.add_profile_argument(parser)
     args = parser.parse_args()
 
+    instrumentation.start_profile(args.profile)
+
+    if args.copy:
+        with instrumentation.stage("copy"):
+            failed = harvest(args.path, args.output, args.jobs, args.link, args.compress)
+        exit(1 if failed else 0)
+
     for folder in get_folders(args.path):
+        instrumentation.count("folders_visited")
         folder_name = folder.name
         for file in get_files(folder):
             print(f"{file} -> {args.output / folder_name / file.name}")
-            if args.copy:
-                (args.output / folder_name).mkdir(parents=True, exist_ok=True)
-                # copy file
-                shutil.copy(file, args.output / folder_name / file.name)
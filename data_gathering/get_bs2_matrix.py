@@ -7,97 +7,45 @@
 from pathlib import Path
 from argparse import ArgumentParser
 from datetime import datetime
-from dataclasses import dataclass
-
-
-@dataclass
-class ExecutionTime:
-    start: datetime | float
-    read_files: datetime | float
-    hmm_scan: datetime | float
-    hmm_scan_save: datetime | float
-    hmm_align: datetime | float
-    hmm_align_save: datetime | float
-    distance_calc: datetime | float
-    cc_gen: datetime | float
-    cc_gen_save: datetime | float
-    end: datetime | float
 
-    def __init__(self):
-        self.start = None
-        self.read_files = None
-        self.hmm_scan = None
-        self.hmm_scan_save = None
-        self.hmm_align = None
-        self.hmm_align_save = None
-        self.distance_calc = None
-        self.cc_gen = None
-        self.cc_gen_save = None
-        self.end = None
-
-    @classmethod
-    def print_header(cls):
-        return ",".join(
-            [
-                "start",
-                "read_files",
-                "hmm_scan",
-                "hmm_scan_save",
-                "hmm_align",
-                "hmm_align_save",
-                "distance_calc",
-                "cc_gen",
-                "cc_gen_save",
-                "total",
-            ]
-        )
-
-    def to_list(self):
-        return [
-            self.start,
-            self.read_files,
-            self.hmm_scan,
-            self.hmm_scan_save,
-            self.hmm_align,
-            self.hmm_align_save,
-            self.distance_calc,
-            self.cc_gen,
-            self.cc_gen_save,
-            self.end,
-        ]
-
-    def to_seconds(self):
-        return [
-            (self.start - self.start).total_seconds(),
-            (self.read_files - self.start).total_seconds(),
-            (self.hmm_scan - self.read_files).total_seconds(),
-            (self.hmm_scan_save - self.hmm_scan).total_seconds(),
-            (self.hmm_align - self.hmm_scan_save).total_seconds(),
-            (self.hmm_align_save - self.hmm_align).total_seconds(),
-            (self.distance_calc - self.hmm_align_save).total_seconds(),
-            (self.cc_gen - self.distance_calc).total_seconds(),
-            (self.end - self.cc_gen).total_seconds(),
-            (self.end - self.start).total_seconds(),
-        ]
-
-    def __str__(self):
-        return ",".join(
-            map(
-                str,
-                [
-                    self.start,
-                    self.read_files,
-                    self.hmm_scan,
-                    self.hmm_scan_save,
-                    self.hmm_align,
-                    self.hmm_align_save,
-                    self.distance_calc,
-                    self.cc_gen,
-                    self.cc_gen_save,
-                    self.end,
-                ],
-            )
-        )
+from compressed_files import read_blocks, strip_compression
+from folder_pool import report_error
+import instrumentation
+from matrix_io import write_matrix
+from online_aggregate import Aggregate, add_aggregate_arguments
+from parse_cache import ParseCache, file_fingerprint, map_folders_cached
+from phase_table import PhaseSchema, PhaseTable, to_ns
+from shards import add_shard_argument, select_shard, write_partial
+
+
+# timestamps of a run, one per phase marker, and the durations in the matrix.
+# cc_gen_save runs up to the end of the run, not to its own marker
+PHASES = PhaseSchema(
+    [
+        "start",
+        "read_files",
+        "hmm_scan",
+        "hmm_scan_save",
+        "hmm_align",
+        "hmm_align_save",
+        "distance_calc",
+        "cc_gen",
+        "cc_gen_save",
+        "end",
+    ],
+    [
+        ("start", "start", "start"),
+        ("read_files", "start", "read_files"),
+        ("hmm_scan", "read_files", "hmm_scan"),
+        ("hmm_scan_save", "hmm_scan", "hmm_scan_save"),
+        ("hmm_align", "hmm_scan_save", "hmm_align"),
+        ("hmm_align_save", "hmm_align", "hmm_align_save"),
+        ("distance_calc", "hmm_align_save", "distance_calc"),
+        ("cc_gen", "distance_calc", "cc_gen"),
+        ("cc_gen_save", "cc_gen", "end"),
+        ("total", "start", "end"),
+    ],
+)
 
 
 def get_folders(path: Path):
@@ -105,54 +53,162 @@ def get_folders(path: Path):
 
 
 def get_files(folder: Path):
+    instrumentation.count("dir_listings")
+    # .log, or a compressed .log.gz/.log.xz/.log.zst
     yield from filter(
-        lambda file: file.suffix == ".log" and "config" not in str(file),
+        lambda file: strip_compression(file).suffix == ".log" and "config" not in str(file),
         folder.iterdir(),
     )
 
 
-def get_execution_time(log_file: Path):
-    execution_time = ExecutionTime()
-    with open(log_file, "r") as file:
-        for line in file:
-            parts = line.split(maxsplit=3)
-            if len(parts) != 4:
-                continue
-            date, time, _loglevel, log = parts
+# phase markers, in the order they appear in a log. each is matched against
+# the message part of a log line, after the date, time and log level
+MARKERS = [
+    ("start", "startswith", "Starting BiG-SCAPE"),
+    ("read_files", "endswith", "First task: TASK.HMM_SCAN\n"),
+    ("hmm_scan", "startswith", "scan done at "),
+    ("hmm_scan_save", "startswith", "DB: HSP save done at"),
+    ("hmm_align", "startswith", "align done at "),
+    ("hmm_align_save", "startswith", "DB: HSP alignment save done at"),
+    ("distance_calc", "startswith", "Generating families"),
+    ("cc_gen", "endswith", "connected components\n"),
+    ("cc_gen_save", "startswith", "Generating GCF alignments"),
+    ("end", "startswith", "All tasks done at"),
+]
+
+# the phrases are searched for as raw bytes, so only lines that contain a
+# phrase are decoded and get their timestamp parsed. every phrase is its own
+# search over a block, so a block is read about once per phrase, not once in
+# total. bytes.rfind is a memchr based search, and ten of them are still
+# several times faster than one pass of a compiled alternation of the phrases
+# with re.finditer (about 430 MB/s against 70 MB/s on a synthetic log)
+MARKER_NEEDLES = [
+    (PHASES.index(name), kind, phrase, phrase.rstrip("\n").encode()) for name, kind, phrase in MARKERS
+]
+
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def parse_log_timestamp(date: str, time: str):
+    # hand-rolled version of strptime(f"{date} {time}", "%Y-%m-%d %H:%M:%S,%f")
+    # e.g. 2024-01-01 12:34:56,789
+    if len(date) != 10 or time[8:9] != ",":
+        raise ValueError(f"unexpected log timestamp: {date} {time}")
+
+    return datetime(
+        int(date[0:4]),
+        int(date[5:7]),
+        int(date[8:10]),
+        int(time[0:2]),
+        int(time[3:5]),
+        int(time[6:8]),
+        int(time[9:].ljust(6, "0")),
+    )
 
-            parsed_time = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M:%S,%f")
 
-            if log.startswith("Starting BiG-SCAPE"):
-                execution_time.start = parsed_time
+class MarkerScanner:
+    # scans raw log bytes for phase markers. data can be fed in blocks of any
+    # size, lines that are split over two blocks are put back together
 
-            if log.endswith("First task: TASK.HMM_SCAN\n"):
-                execution_time.read_files = parsed_time
+    def __init__(self):
+        # a row of PHASES, in nanoseconds
+        self.timestamps = PHASES.new_row()
+        self.tail = b""
+
+    def match_marker(self, line: str, kind: str, phrase: str):
+        parts = line.replace("\r\n", "\n").split(maxsplit=3)
+        if len(parts) != 4:
+            return None
+        date, time, _loglevel, log = parts
+
+        if kind == "startswith" and not log.startswith(phrase):
+            return None
+        if kind == "endswith" and not log.endswith(phrase):
+            return None
+
+        instrumentation.count("timestamps_parsed")
+        with instrumentation.stage("bs2_parse_timestamps"):
+            return parse_log_timestamp(date, time)
+
+    def scan(self, data: bytes, pos: int, endpos: int):
+        # data[pos:endpos] has to start at the beginning of a line. one search
+        # per phrase. a later marker line overwrites an earlier one, so every
+        # phrase is searched for from the end and the search stops at the
+        # last line that matches
+        for index, kind, phrase, needle in MARKER_NEEDLES:
+            end = endpos
+            while (found := data.rfind(needle, pos, end)) != -1:
+                line_start = max(pos, data.rfind(b"\n", pos, found) + 1)
+                line_end = data.find(b"\n", found, endpos)
+                line_end = endpos if line_end == -1 else line_end + 1
+
+                line = data[line_start:line_end].decode(errors="replace")
+                parsed_time = self.match_marker(line, kind, phrase)
+                if parsed_time is not None:
+                    instrumentation.count("marker_hits")
+                    self.timestamps[index] = to_ns(parsed_time)
+                    break
+
+                end = line_start
+
+    def feed(self, data: bytes):
+        first_newline = data.find(b"\n")
+        if first_newline == -1:
+            self.tail += data
+            return
+
+        # first line, together with what was left over from the previous block
+        line = self.tail + data[: first_newline + 1]
+        self.scan(line, 0, len(line))
+
+        last_newline = data.rfind(b"\n")
+        self.scan(data, first_newline + 1, last_newline + 1)
+        self.tail = data[last_newline + 1 :]
+
+    def finish(self):
+        # a last line without a newline at the end of the file
+        if self.tail:
+            self.scan(self.tail, 0, len(self.tail))
+            self.tail = b""
+        return self.timestamps
+
+
+def feed_blocks_profiled(blocks, scanner: MarkerScanner):
+    # the loop of get_execution_time, with reading and scanning timed apart
+    for block in instrumentation.timed(blocks, "bs2_read_logs"):
+        instrumentation.count("bytes_read", len(block))
+        instrumentation.count("lines_scanned", block.count(b"\n"))
+        with instrumentation.stage("bs2_scan_logs"):
+            scanner.feed(block)
 
-            if log.startswith("scan done at "):
-                execution_time.hmm_scan = parsed_time
 
-            if log.startswith("DB: HSP save done at"):
-                execution_time.hmm_scan_save = parsed_time
+def get_execution_time(log_file: Path):
+    # compressed logs are decompressed while they are scanned
+    scanner = MarkerScanner()
+    blocks = read_blocks(log_file, BLOCK_SIZE)
+    if instrumentation.ENABLED:
+        feed_blocks_profiled(blocks, scanner)
+    else:
+        for block in blocks:
+            scanner.feed(block)
+    return scanner.finish()
 
-            if log.startswith("align done at "):
-                execution_time.hmm_align = parsed_time
 
-            if log.startswith("DB: HSP alignment save done at"):
-                execution_time.hmm_align_save = parsed_time
+def get_size_sample(folder: Path, folder_name_as_sample: bool = False):
+    # folder is samplesize_"replicate"_sample
+    if folder_name_as_sample:
+        return -1, folder.name
 
-            if log.startswith("Generating families"):
-                execution_time.distance_calc = parsed_time
+    size, _replicate, sample = folder.name.rsplit("_", maxsplit=2)
+    return int(size), int(sample)
 
-            if log.endswith("connected components\n"):
-                execution_time.cc_gen = parsed_time
 
-            if log.startswith("Generating GCF alignments"):
-                execution_time.cc_gen_save = parsed_time
+def get_log_fingerprint(folder: Path):
+    return file_fingerprint(folder, sorted(get_files(folder)))
 
-            if log.startswith("All tasks done at"):
-                execution_time.end = parsed_time
 
-    return execution_time
+def get_folder_times(folder: Path):
+    return [get_execution_time(file) for file in sorted(get_files(folder))]
 
 
 if __name__ == "__main__":
@@ -162,35 +218,102 @@ if __name__ == "__main__":
     # flag to have folder name be the entire sample name
     parser.add_argument("-f", "--folder_name_as_sample", action="store_true")
 
+    # number of processes used to parse run folders
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+
+    # sqlite file to keep parsed logs in between runs
+    parser.add_argument("-c", "--cache", type=Path, default=None)
+
+    # keep watching the run folders and print phase progress as it happens
+    parser.add_argument("--follow", action="store_true")
+    parser.add_argument("--interval", type=float, default=5.0)
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    add_shard_argument(parser)
+
+    add_aggregate_arguments(parser, "v2.0")
+
+    instrumentation.add_profile_argument(parser)
+
     args = parser.parse_args()
 
-    print("size,sample," + ExecutionTime.print_header())
+    if args.shard is not None and args.output is None:
+        parser.error("--shard needs --output for the partial result")
 
-    def collate_results(path):
+    instrumentation.start_profile(args.profile)
 
-        for folder in get_folders(path):
-            # folder is samplesize_"replicate"_sample
+    if args.follow:
+        from bs2_follow import run_follow
 
-            if args.folder_name_as_sample:
-                parts = [-1, -1, folder.name]
-                size, _replicate, sample = parts
-            else:
-                parts = folder.name.rsplit("_", maxsplit=2)
-                size, _replicate, sample = parts
+        run_follow(args.path, args.interval)
+        exit(0)
 
-                size = int(size)
-                sample = int(sample)
+    # the run folders this shard is responsible for
+    shard_folders = []
+    # and all run folders of the sweep, so the merge can tell if one is missing
+    sweep_folders = []
 
-            if len(parts) != 3:
-                parts = ["unknown", "unknown", "unknown"]
-            for file in get_files(folder):
-                execution_time = get_execution_time(file)
-                results = [size, sample, *execution_time.to_seconds()]
-                yield results
+    # running statistics of the runs, filled in while they are parsed
+    aggregate = Aggregate() if args.aggregate is not None else None
+
+    def collate_results(path):
+        with instrumentation.stage("list_folders"):
+            folders = sorted(get_folders(path))
+        if args.shard is not None:
+            sweep_folders.extend(folders)
+            folders = select_shard(folders, args.shard)
+        shard_folders.extend(folders)
+        cache = ParseCache(args.cache, "bs2") if args.cache else None
+
+        table = PhaseTable(PHASES)
+        for folder, runs in map_folders_cached(
+            get_folder_times, get_log_fingerprint, None, folders, args.jobs, cache
+        ):
+            size, sample = get_size_sample(folder, args.folder_name_as_sample)
+            for timestamps in runs:
+                if all(timestamp is None for timestamp in timestamps):
+                    report_error(folder, "no phase markers in log")
+                    continue
+                table.append([size, sample], timestamps)
+                if aggregate is not None:
+                    aggregate.add_run(
+                        "BiG-SCAPE", args.tool_version, PHASES.header(), size, sample, PHASES.durations_of(timestamps)
+                    )
+                missing = table.missing(len(table) - 1)
+                if missing:
+                    # the durations that need these are left empty
+                    report_error(folder, "missing phase markers: " + ", ".join(missing))
+
+        if cache is not None:
+            cache.close()
+
+        return table.to_rows()
 
     def sort_key(result):
-        return result[0]
+        return result[0], result[1]
+
+    with instrumentation.stage("collate"):
+        results = sorted(collate_results(args.path), key=sort_key)
+
+    columns = ["size", "sample", *PHASES.header()]
+
+    if aggregate is not None:
+        with instrumentation.stage("aggregate"):
+            aggregate.save(args.aggregate)
+
+    with instrumentation.stage("output"):
+        if args.shard is not None:
+            write_partial("bs2", args.shard, shard_folders, sweep_folders, columns, results, args.output)
+            exit(0)
+
+        if args.output:
+            write_matrix(columns, results, args.output)
+            exit(0)
+
+        print(",".join(columns))
 
-    for result in sorted(collate_results(args.path), key=sort_key):
-        str_list = map(str, result)
-        print(",".join(str_list))
+        for result in results:
+            str_list = ["" if value is None else str(value) for value in result]
+            print(",".join(str_list))
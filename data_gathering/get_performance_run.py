@@ -1,41 +1,219 @@
 from argparse import ArgumentParser
-from datetime import datetime
 from pathlib import Path
+import sys
 
+import numpy as np
+import pandas as pd
 
-def print_profile_matrix_line_v1(version, parts, start):
+from compressed_files import open_binary, strip_compression
+from profile_rollup import downsample_rollup, iter_rollup
+from profile_sampler import SAMPLER_COLUMNS, SAMPLER_FORMAT, SAMPLER_HEADER
+import instrumentation
 
-    time = datetime.fromisoformat(parts[0])
-    seconds = (time - start).total_seconds()
+# columns of a .profile file, in order. the header line of the file itself is
+# skipped
+PROFILE_COLUMNS = ["time", "type", "cpu", "processes", "mem_used_mb", "memused_percent"]
 
-    # cpu = float(parts[2]) if parts[1] != "MULTI" else 0.0
-    # processes = int(parts[3]) if parts[1] == "MULTI" else 0
-    # mem_used_mb = float(parts[4]) if parts[1] == "MAIN" else 0.0
+MATRIX_COLUMNS = ["version", "seconds", "cpu", "processes", "mem_used_mb", "memused_percent"]
 
-    cpu = float(parts[2]) if parts[1] != "MULTI" else 0.0
-    processes = int(parts[3]) if parts[1] == "MULTI" else 0
-    mem_used_mb = float(parts[4]) if parts[1] == "MAIN" else 0.0
+# rows per chunk. a chunk of this size takes roughly 100 MB while converting
+CHUNK_SIZE = 1_000_000
 
-    memused_percent = float(parts[5])
 
-    print(f"{version},{seconds},{cpu},{processes},{mem_used_mb},{memused_percent}")
+def read_profile_chunks(
+    profile: Path,
+    chunksize: int = CHUNK_SIZE,
+    columns: list[str] = PROFILE_COLUMNS,
+    header_lines: int = 1,
+):
+    # compressed profiles are decompressed while they are read
+    with open_binary(profile) as file:
+        yield from pd.read_csv(
+            file,
+            header=None,
+            skiprows=header_lines,
+            names=columns,
+            usecols=range(len(columns)),
+            dtype={"type": str},
+            chunksize=chunksize,
+        )
 
 
-def print_profile_matrix_line_v2(version, parts, start):
-    time = datetime.fromisoformat(parts[0])
-    seconds = (time - start).total_seconds()
+def get_profile_format(profile: Path):
+    # the format version of a profile_sampler.py profile, None for the
+    # profiles of the external sampler
+    # not every decompressing reader has readline, the format line is short
+    with open_binary(profile) as file:
+        first_line = file.read(64).decode(errors="replace").split("\n")[0]
+    if not first_line.startswith(SAMPLER_HEADER):
+        return None
 
-    cpu = float(parts[2]) if parts[1] != "MULTI" else 0.0
-    processes = int(parts[3])
-    mem_used_mb = float(parts[4]) if parts[1] == "MULTI" else 0.0
+    version = int(first_line[len(SAMPLER_HEADER) :])
+    if version > SAMPLER_FORMAT:
+        raise ValueError(f"{profile} is in profile format {version}, this version reads up to {SAMPLER_FORMAT}")
+    return version
 
-    # cpu = float(parts[2]) if "CHILD" in parts[1] else 0.0
-    # processes = int(parts[3])
-    # mem_used_mb = float(parts[4]) if parts[1] == "MAIN" else 0.0
 
-    memused_percent = float(parts[5]) if parts[1] == "MAIN" else 0.0
+def find_profile(folder: Path):
+    # the .profile in folder, or a compressed .profile.gz/.profile.xz/.profile.zst
+    profiles = sorted(folder.glob("*.profile*"))
+    return next(profile for profile in profiles if strip_compression(profile).suffix == ".profile")
 
-    print(f"{version},{seconds},{cpu},{processes},{mem_used_mb},{memused_percent}")
+
+def as_numeric(column: pd.Series):
+    # columns that are not used for some row types may be empty or hold text
+    if not pd.api.types.is_numeric_dtype(column):
+        column = pd.to_numeric(column, errors="coerce")
+    return column.to_numpy(dtype=np.float64)
+
+
+def as_count(column: pd.Series, used: np.ndarray | bool = True):
+    # whole numbers on the rows where used, 0 elsewhere. a value there that is
+    # missing or not a whole number is an error, like int() on it would be
+    values = np.where(used, as_numeric(column), 0.0)
+    invalid = np.isnan(values) | (values != np.floor(values))
+    if invalid.any():
+        bad = column.to_numpy()[invalid][0]
+        raise ValueError(f"{column.name} should be a whole number, not {bad!r} ({invalid.sum()} rows)")
+    return values.astype(np.int64)
+
+
+def profile_matrix_v1(chunk: pd.DataFrame):
+    row_type = chunk["type"].to_numpy()
+    is_multi = row_type == "MULTI"
+    is_main = row_type == "MAIN"
+
+    return {
+        "cpu": np.where(is_multi, 0.0, as_numeric(chunk["cpu"])),
+        "processes": as_count(chunk["processes"], is_multi),
+        "mem_used_mb": np.where(is_main, as_numeric(chunk["mem_used_mb"]), 0.0),
+        "memused_percent": as_numeric(chunk["memused_percent"]),
+    }
+
+
+def profile_matrix_v2(chunk: pd.DataFrame):
+    row_type = chunk["type"].to_numpy()
+    is_multi = row_type == "MULTI"
+    is_main = row_type == "MAIN"
+
+    return {
+        "cpu": np.where(is_multi, 0.0, as_numeric(chunk["cpu"])),
+        "processes": as_count(chunk["processes"]),
+        "mem_used_mb": np.where(is_multi, as_numeric(chunk["mem_used_mb"]), 0.0),
+        "memused_percent": np.where(is_main, as_numeric(chunk["memused_percent"]), 0.0),
+    }
+
+
+def profile_matrix_sampler(chunk: pd.DataFrame):
+    # profiles from profile_sampler.py mean the same for both versions. the
+    # cpu of every process, and the size of the process tree from TREE rows.
+    # memused_percent is the used memory of the whole system, like the column
+    # of the same name in the profiles of the external sampler
+    is_tree = chunk["type"].to_numpy() == "TREE"
+    system_used_mb = as_numeric(chunk["mem_used_mb"])
+
+    return {
+        "cpu": np.where(is_tree, 0.0, as_numeric(chunk["cpu"])),
+        "processes": as_count(chunk["processes"], is_tree),
+        "mem_used_mb": np.where(is_tree, as_numeric(chunk["rss_mb"]), 0.0),
+        "memused_percent": np.where(is_tree, 100 * system_used_mb / as_numeric(chunk["mem_total_mb"]), 0.0),
+    }
+
+
+PROFILE_MATRIX_RULES = {
+    "v1": profile_matrix_v1,
+    "v2": profile_matrix_v2,
+}
+
+
+def open_profile_chunks(profile: Path, version: str, chunksize: int = CHUNK_SIZE):
+    # whether profile is from profile_sampler.py, the rules that convert its
+    # chunks and the chunks themselves
+    if get_profile_format(profile) is not None:
+        # the format line and the header
+        return True, profile_matrix_sampler, read_profile_chunks(profile, chunksize, SAMPLER_COLUMNS, 2)
+    return False, PROFILE_MATRIX_RULES[version], read_profile_chunks(profile, chunksize)
+
+
+def get_profile_start(profile: Path, version: str):
+    # the time iter_profile_matrix counts seconds from, as a pd.Timestamp that
+    # keeps the UTC offset of the profile if it has one
+    _sampled, _rules, chunks = open_profile_chunks(profile, version, 1)
+    first = next(chunks)
+    chunks.close()
+    return pd.to_datetime(first["time"], format="ISO8601").iloc[0]
+
+
+def iter_profile_matrix(profile: Path, version: str, chunksize: int = CHUNK_SIZE):
+    # converts a profile into matrix rows one chunk at a time, so memory use
+    # does not depend on the size of the profile
+    sampled, rules, chunks = open_profile_chunks(profile, version, chunksize)
+    start = None
+
+    instrumentation.count("stat_calls")
+    instrumentation.count("bytes_read", profile.stat().st_size)
+
+    for chunk in instrumentation.timed(chunks, "profile_read"):
+        instrumentation.count("lines_scanned", len(chunk))
+        instrumentation.count("timestamps_parsed", len(chunk))
+        with instrumentation.stage("profile_parse_timestamps"):
+            times = pd.to_datetime(chunk["time"], format="ISO8601").to_numpy()
+
+        if start is None:
+            # the first sample is the start of the run. like the original line
+            # by line parser, the sample itself is not part of the output. the
+            # first sample of profile_sampler.py is kept, it has all its rows
+            start = times[0]
+            if not sampled:
+                chunk = chunk.iloc[1:]
+                times = times[1:]
+
+        with instrumentation.stage("profile_convert"):
+            matrix = pd.DataFrame(
+                {
+                    "version": version,
+                    "seconds": (times - start) / np.timedelta64(1, "s"),
+                    **rules(chunk),
+                },
+                columns=MATRIX_COLUMNS,
+            )
+        yield matrix
+
+
+def load_profile_matrix(profile: Path, version: str):
+    return pd.concat(list(iter_profile_matrix(profile, version)), ignore_index=True)
+
+
+def write_profile_matrix(profiles: list[tuple[str, Path]], output):
+    # output is a path or an open text file such as stdout
+    header = True
+    for version, profile in profiles:
+        for matrix in iter_profile_matrix(profile, version):
+            with instrumentation.stage("output"):
+                matrix.to_csv(output, mode="w" if header else "a", header=header, index=False)
+            header = False
+
+
+def write_profile_rollup(
+    profiles: list[tuple[str, Path]], output, bucket_seconds: float, points: int | None = None
+):
+    matrix_chunks = (
+        matrix for version, profile in profiles for matrix in iter_profile_matrix(profile, version)
+    )
+    # the rollup stage includes reading the profiles, it pulls the chunks
+    rollups = instrumentation.timed(iter_rollup(matrix_chunks, bucket_seconds), "rollup")
+
+    if points is not None:
+        # downsampling needs the whole series, but that is only one row per bucket
+        rollup = pd.concat(list(rollups), ignore_index=True)
+        with instrumentation.stage("downsample"):
+            rollups = [downsample_rollup(rollup, points)]
+
+    header = True
+    for rollup in rollups:
+        with instrumentation.stage("output"):
+            rollup.to_csv(output, mode="w" if header else "a", header=header, index=False)
+        header = False
 
 
 if __name__ == "__main__":
@@ -43,36 +221,37 @@ if __name__ == "__main__":
     parser.add_argument("v1_folder", type=Path)
     parser.add_argument("v2_folder", type=Path)
 
-    args = parser.parse_args()
-
-    v1_folder: Path = args.v1_folder
-    v2_folder: Path = args.v2_folder
-
-    v1_profile = next(v1_folder.glob("*.profile"))
-    v2_profile = next(v2_folder.glob("*.profile"))
+    # write to this file instead of stdout
+    parser.add_argument("-o", "--output", type=Path, default=None)
 
-    print("version,seconds,cpu,processes,mem_used_mb,memused_percent")
+    # aggregate samples into buckets of this many seconds instead of writing
+    # every sample. 0 aggregates samples with the exact same time
+    parser.add_argument("-b", "--bucket", type=float, default=None)
 
-    v1_start: datetime
-    with open(v1_profile) as f:
-        # skip header
-        f.readline()
+    # reduce the rolled up series to this many points per version with LTTB
+    parser.add_argument("-d", "--downsample", type=int, default=None)
 
-        v1_start = datetime.fromisoformat(f.readline().split(",")[0])
+    instrumentation.add_profile_argument(parser)
 
-        for line in f:
-            parts = line.split(",")
+    args = parser.parse_args()
 
-            print_profile_matrix_line_v1("v1", parts, v1_start)
+    instrumentation.start_profile(args.profile)
 
-    v2_start: datetime
-    with open(v2_profile) as f:
-        # skip header
-        f.readline()
+    v1_folder: Path = args.v1_folder
+    v2_folder: Path = args.v2_folder
 
-        v2_start = datetime.fromisoformat(f.readline().split(",")[0])
+    v1_profile = find_profile(v1_folder)
+    v2_profile = find_profile(v2_folder)
 
-        for line in f:
-            parts = line.split(",")
+    profiles = [("v1", v1_profile), ("v2", v2_profile)]
+    output = args.output if args.output else sys.stdout
 
-            print_profile_matrix_line_v2("v2", parts, v2_start)
+    try:
+        if args.bucket is not None or args.downsample is not None:
+            bucket_seconds = args.bucket if args.bucket is not None else 0
+            write_profile_rollup(profiles, output, bucket_seconds, args.downsample)
+        else:
+            write_profile_matrix(profiles, output)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
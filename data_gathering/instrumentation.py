@@ -0,0 +1,133 @@
+# self-instrumentation for the data gathering scripts
+#
+# with --profile, every script records the wall time of its stages and a set
+# of counters (folders visited, stat calls, bytes read, lines scanned, marker
+# hits, timestamps parsed, ...), prints a summary to stderr when it exits and
+# optionally writes the same numbers to a json file.
+#
+# when profiling is off, the only cost is checking instrumentation.ENABLED,
+# which hot loops do once per block or per folder rather than per line.
+# always use it as instrumentation.ENABLED, a from-import would copy the
+# value at import time
+#
+# counters and stages can be updated from the threads of
+# folder_pool.map_folders, so updates take a lock while profiling is on
+
+from collections import Counter
+from contextlib import contextmanager
+import atexit
+import json
+import sys
+import threading
+import time
+
+ENABLED = False
+
+COUNTERS = Counter()
+
+# stage -> seconds. stages that run inside pool workers are summed over all
+# workers, so they can add up to more than the wall time
+STAGES = Counter()
+
+STARTED = time.perf_counter()
+
+LOCK = threading.Lock()
+
+
+def count(name: str, amount: int = 1):
+    if ENABLED:
+        with LOCK:
+            COUNTERS[name] += amount
+
+
+@contextmanager
+def stage(name: str):
+    if not ENABLED:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with LOCK:
+            STAGES[name] += time.perf_counter() - start
+
+
+def timed(iterable, name: str):
+    # adds the time spent waiting for every item of iterable to a stage, e.g.
+    # reading the next chunk of a file. iterable is returned as is when
+    # profiling is off
+    if not ENABLED:
+        return iterable
+    return _timed(iter(iterable), name)
+
+
+def _timed(iterator, name: str):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            with LOCK:
+                STAGES[name] += time.perf_counter() - start
+        yield item
+
+
+def snapshot():
+    return {"counters": dict(COUNTERS), "stages": dict(STAGES)}
+
+
+def difference(after: dict, before: dict):
+    return {
+        "counters": dict(Counter(after["counters"]) - Counter(before["counters"])),
+        "stages": {
+            name: seconds - before["stages"].get(name, 0.0)
+            for name, seconds in after["stages"].items()
+            if seconds != before["stages"].get(name, 0.0)
+        },
+    }
+
+
+def merge(stats: dict):
+    # adds the numbers recorded in a pool worker to the ones of this process
+    COUNTERS.update(stats["counters"])
+    STAGES.update(stats["stages"])
+
+
+def add_profile_argument(parser):
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="JSON",
+        help="print stage times and counters when done, and write them to JSON if given",
+    )
+
+
+def report(json_path: str | None = None):
+    total = time.perf_counter() - STARTED
+
+    print(f"profile: {total:.3f} s total", file=sys.stderr)
+    for name, seconds in sorted(STAGES.items(), key=lambda item: -item[1]):
+        print(f"  {name:<24} {seconds:10.3f} s", file=sys.stderr)
+    for name, value in sorted(COUNTERS.items()):
+        print(f"  {name:<24} {value:12d}", file=sys.stderr)
+
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump({"total_seconds": total, **snapshot()}, file, indent=2)
+
+
+def start_profile(json_path: str | None):
+    # call with args.profile. does nothing if --profile was not given
+    global ENABLED
+
+    if json_path is None:
+        return
+
+    ENABLED = True
+    atexit.register(report, json_path or None)
@@ -0,0 +1,219 @@
+# writes a fake sweep that the gatherers can be run against
+#
+# for every size and replicate this creates:
+# - bs1/[size]_replicate_[sample]: a BiG-SCAPE 1 result folder with the files
+#   and folders get_bs1_matrix looks at, with their mtimes set to the end of
+#   each phase. the ctime of bs_networks.js can not be set, it is the time
+#   the file was written
+# - bs2/[size]_replicate_[sample]: a BiG-SCAPE 2 .log with the exact marker
+#   lines get_bs2_matrix looks for, with filler lines in between that scale
+#   with the number of records, and a .config.log that should be ignored
+# - bigslice/[size]_replicate_[sample]/result/data.db with a run_log table
+# - profiles/v1 and profiles/v2: a .profile each, in the format
+#   get_performance_run expects
+#
+# phase durations grow with the number of records, so the output looks like
+# a real sweep. everything is seeded and runs fully offline
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from pathlib import Path
+import os
+import random
+import sqlite3
+
+SWEEP_START = datetime(2024, 1, 1, 8, 0, 0)
+
+# seconds per record for each phase, roughly in the proportions of a real run
+BS1_PHASES = [
+    ("read_files", 0.01),
+    ("hmm_scan", 0.05),
+    ("hmm_align", 0.05),
+    ("distance_calc", 0.2),
+    ("cc_gen", 0.02),
+]
+
+# marker line that ends each BiG-SCAPE 2 phase, and seconds per record
+BS2_PHASES = [
+    ("Loading {size} records. First task: TASK.HMM_SCAN", 0.005),
+    ("scan done at {time}", 0.03),
+    ("DB: HSP save done at {time}", 0.002),
+    ("align done at {time}", 0.03),
+    ("DB: HSP alignment save done at {time}", 0.002),
+    ("Generating families", 0.05),
+    ("Found {size} connected components", 0.005),
+    ("Generating GCF alignments", 0.005),
+    ("All tasks done at {time}", 0.01),
+]
+
+
+def run_name(size: int, sample: int):
+    return f"{size}_replicate_{sample}"
+
+
+def phase_durations(phases: list, size: int, rng: random.Random):
+    # some noise, and a minimum so that tiny runs still take a little time
+    return [max(0.05, per_record * size * rng.uniform(0.8, 1.2)) for _phase, per_record in phases]
+
+
+def set_mtime(path: Path, time: datetime):
+    timestamp = time.timestamp()
+    os.utime(path, (timestamp, timestamp))
+
+
+def write_bs1_run(folder: Path, size: int, start: datetime, rng: random.Random):
+    for subfolder in ["logs", "cache/fasta", "cache/domtable", "cache/pfd"]:
+        (folder / subfolder).mkdir(parents=True, exist_ok=True)
+
+    network_folder = folder / "network_files" / "2024-01-01_08-00-00_hybrids_auto" / "mix"
+    html_folder = folder / "html_content" / "networks" / "2024-01-01_08-00-00_hybrids_auto" / "mix"
+    network_folder.mkdir(parents=True, exist_ok=True)
+    html_folder.mkdir(parents=True, exist_ok=True)
+
+    durations = phase_durations(BS1_PHASES, size, rng)
+    times = {}
+    elapsed = 0.0
+    for (phase, _per_record), duration in zip(BS1_PHASES, durations):
+        elapsed += duration
+        times[phase] = start + timedelta(seconds=elapsed)
+
+    (folder / "logs" / "parameters.txt").write_text(f"records: {size}\n")
+    (network_folder / "mix_c0.30.network").write_text("Clustername 1\tClustername 2\tRaw distance\n")
+    (html_folder / "bs_networks.js").write_text("var bs_similarity=[];\n")
+    (folder / "logs" / "runtimes.txt").write_text(
+        f"generate_networks took {durations[3]:.3f} seconds\n"
+        f"Main function took {elapsed:.3f} seconds\n"
+    )
+
+    set_mtime(folder / "logs" / "parameters.txt", start)
+    set_mtime(folder / "cache" / "fasta", times["read_files"])
+    set_mtime(folder / "cache" / "domtable", times["hmm_scan"])
+    set_mtime(folder / "cache" / "pfd", times["hmm_align"])
+    set_mtime(network_folder / "mix_c0.30.network", times["distance_calc"])
+    set_mtime(folder / "logs" / "runtimes.txt", times["cc_gen"])
+
+
+def format_log_time(time: datetime):
+    return f"{time:%Y-%m-%d %H:%M:%S},{time.microsecond // 1000:03d}"
+
+
+def write_bs2_log(log_file: Path, size: int, start: datetime, rng: random.Random, lines_per_record: int = 10):
+    # filler lines are spread evenly over the phases. returns the number of
+    # lines written
+    durations = phase_durations(BS2_PHASES, size, rng)
+    filler_per_phase = size * lines_per_record // len(BS2_PHASES)
+    line_count = 0
+
+    with open(log_file, "w") as file:
+        file.write(f"{format_log_time(start)} INFO Starting BiG-SCAPE 2.0.0\n")
+        line_count += 1
+
+        time = start
+        for (marker, _per_record), duration in zip(BS2_PHASES, durations):
+            step = timedelta(seconds=duration / (filler_per_phase + 1))
+            for i in range(filler_per_phase):
+                time += step
+                file.write(
+                    f"{format_log_time(time)} DEBUG Processed record {i} of region BGC{i:07d}.region001\n"
+                )
+            time += step
+            message = marker.format(size=size, time=time.strftime("%Y-%m-%d %H:%M:%S"))
+            file.write(f"{format_log_time(time)} INFO {message}\n")
+            line_count += filler_per_phase + 1
+
+    return line_count
+
+
+def write_bs2_run(folder: Path, size: int, start: datetime, rng: random.Random, lines_per_record: int):
+    folder.mkdir(parents=True, exist_ok=True)
+    write_bs2_log(folder / f"{folder.name}.log", size, start, rng, lines_per_record)
+    (folder / f"{folder.name}.config.log").write_text(f"{format_log_time(start)} INFO config\n")
+
+
+def write_bigslice_run(folder: Path, size: int, start: datetime, rng: random.Random):
+    result_folder = folder / "result"
+    result_folder.mkdir(parents=True, exist_ok=True)
+
+    db_path = result_folder / "data.db"
+    if db_path.exists():
+        db_path.unlink()
+
+    duration = max(1.0, 0.3 * size * rng.uniform(0.8, 1.2))
+    end = start + timedelta(seconds=duration)
+
+    rows = [(1, start.isoformat(sep=" "), "run created")]
+    for i in range(min(size, 1000)):
+        time = start + timedelta(seconds=duration * (i + 1) / (min(size, 1000) + 2))
+        rows.append((1, time.isoformat(sep=" "), f"processed bgc {i}"))
+    rows.append((1, end.isoformat(sep=" "), "run finished"))
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE run_log (run_id INTEGER, time TEXT, message TEXT)")
+    conn.executemany("INSERT INTO run_log VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def write_profile(profile: Path, samples: int, processes: int, rng: random.Random):
+    # one MAIN, one MULTI and a number of CHILD rows per second
+    profile.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(profile, "w") as file:
+        file.write("time,type,cpu,processes,mem_used_mb,memused_percent\n")
+        for second in range(samples):
+            time = (SWEEP_START + timedelta(seconds=second)).isoformat(timespec="microseconds")
+            children = rng.randint(1, processes)
+            memory = rng.uniform(1000, 20000)
+            file.write(f"{time},MAIN,{rng.random():.3f},1,{memory:.2f},{rng.uniform(1, 90):.2f}\n")
+            file.write(f"{time},MULTI,,{children},{memory * children:.2f},{rng.uniform(1, 90):.2f}\n")
+            for _child in range(children):
+                file.write(
+                    f"{time},CHILD,{rng.random():.3f},1,{rng.uniform(10, 2000):.2f},{rng.uniform(0, 5):.2f}\n"
+                )
+
+
+def make_sweep(
+    root: Path,
+    sizes: list[int],
+    replicates: int,
+    lines_per_record: int = 10,
+    profile_samples: int = 3600,
+    profile_processes: int = 16,
+    seed: int = 0,
+):
+    rng = random.Random(seed)
+
+    for size in sizes:
+        for sample in range(1, replicates + 1):
+            name = run_name(size, sample)
+            start = SWEEP_START + timedelta(hours=len(sizes) * sample)
+
+            write_bs1_run(root / "bs1" / name, size, start, rng)
+            write_bs2_run(root / "bs2" / name, size, start, rng, lines_per_record)
+            write_bigslice_run(root / "bigslice" / name, size, start, rng)
+
+    write_profile(root / "profiles" / "v1" / "run.profile", profile_samples, profile_processes, rng)
+    write_profile(root / "profiles" / "v2" / "run.profile", profile_samples, profile_processes, rng)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("output", type=Path)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("-r", "--replicates", type=int, default=3)
+    parser.add_argument("-l", "--lines_per_record", type=int, default=10)
+    parser.add_argument("--profile_samples", type=int, default=3600)
+    parser.add_argument("--profile_processes", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    make_sweep(
+        args.output,
+        args.sizes,
+        args.replicates,
+        args.lines_per_record,
+        args.profile_samples,
+        args.profile_processes,
+        args.seed,
+    )
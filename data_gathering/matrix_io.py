@@ -0,0 +1,158 @@
+# typed columnar output for the matrix scripts, and the loader the notebooks
+# use to read it back
+#
+# the matrix scripts print csv to stdout. with --output they instead write
+# the same columns to a parquet (.parquet) or arrow ipc (.arrow, .feather)
+# file, with integer size/sample columns and real nulls for missing timings.
+# arrow ipc files are memory mapped when they are read back, so loading many
+# sweeps does not involve any text parsing
+#
+# pyarrow is only imported when one of these formats is actually used, and
+# pandas only when loading, so the gatherers do not pay for either at startup
+
+from pathlib import Path
+
+COLUMNAR_SUFFIXES = [".arrow", ".feather", ".parquet"]
+
+# the order in which load_matrix tries suffixes for a path without one
+LOAD_SUFFIXES = [".arrow", ".feather", ".parquet", ".csv"]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as error:
+        raise ImportError(
+            "writing or reading .arrow/.feather/.parquet files needs pyarrow (pip install pyarrow)"
+        ) from error
+    return pyarrow
+
+
+def infer_column_type(pa, values: list):
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return pa.int64()
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return pa.float64()
+    return pa.string()
+
+
+def matrix_to_table(columns: list[str], rows: list[list]):
+    pa = import_pyarrow()
+
+    arrays = []
+    fields = []
+    for index, column in enumerate(columns):
+        values = [row[index] for row in rows]
+        column_type = infer_column_type(pa, values)
+        if column_type == pa.string():
+            values = [None if value is None else str(value) for value in values]
+
+        arrays.append(pa.array(values, type=column_type))
+        fields.append(pa.field(column, column_type))
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def write_matrix(columns: list[str], rows: list[list], path: Path):
+    path = Path(path)
+
+    if path.suffix == ".csv":
+        # same text as the scripts print, but with empty fields for nulls
+        with open(path, "w") as file:
+            file.write(",".join(columns) + "\n")
+            for row in rows:
+                file.write(",".join("" if value is None else str(value) for value in row) + "\n")
+        return
+
+    if path.suffix not in COLUMNAR_SUFFIXES:
+        raise ValueError(f"unknown output format {path.suffix}, use one of .csv, {', '.join(COLUMNAR_SUFFIXES)}")
+
+    table = matrix_to_table(columns, rows)
+
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, path)
+    else:
+        import pyarrow.feather as feather
+
+        # uncompressed, so that the file can be memory mapped
+        feather.write_feather(table, path, compression="uncompressed")
+
+
+def resolve_matrix_path(path: Path):
+    # a path that does not exist picks the first existing file from
+    # LOAD_SUFFIXES. the suffix is appended, not replaced, so sweep names with
+    # a dot like bigscape_v2.1_matrix work too
+    path = Path(path)
+    if path.exists():
+        return path
+
+    for suffix in LOAD_SUFFIXES:
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists():
+            return candidate
+
+    raise FileNotFoundError(f"no matrix file for {path} with any of {', '.join(LOAD_SUFFIXES)}")
+
+
+def load_matrix(path: Path):
+    path = resolve_matrix_path(path)
+
+    if path.suffix == ".csv":
+        import pandas as pd
+
+        return pd.read_csv(path)
+
+    import_pyarrow()
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path, memory_map=True).to_pandas()
+
+    import pyarrow.feather as feather
+
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+def iter_matrix_batches(path: Path, rows: int = 65536):
+    # the matrix as dataframes of at most rows rows, without reading all of
+    # it into memory first
+    import pandas as pd
+
+    path = resolve_matrix_path(path)
+
+    if path.suffix == ".csv":
+        yield from pd.read_csv(path, chunksize=rows)
+        return
+
+    import_pyarrow()
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=rows):
+            yield batch.to_pandas()
+        return
+
+    import pyarrow as pa
+
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            for start in range(0, batch.num_rows, rows):
+                yield batch.slice(start, rows).to_pandas()
+
+
+def load_matrices(paths: list[Path], source_column: str = "source"):
+    # several sweeps in one dataframe, with the file they came from in an
+    # extra column
+    import pandas as pd
+
+    matrices = []
+    for path in paths:
+        matrix = load_matrix(path)
+        matrix.insert(0, source_column, resolve_matrix_path(path).stem)
+        matrices.append(matrix)
+    return pd.concat(matrices, ignore_index=True)
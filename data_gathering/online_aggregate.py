@@ -0,0 +1,482 @@
+# running statistics per tool, version, size and phase, and the
+# supplementary tables built from them
+#
+# Supplementary_table_3_average_total_runtimes.csv,
+# Supplementary_table_4_average_mode_runtimes.csv and Supplementary_File_3.csv
+# only need per size averages of the phase times. instead of loading every
+# matrix into pandas first, an Aggregate keeps for every (tool, version,
+# group, phase), where group is the size of a run or the mode of a mode sweep
+# run:
+#
+# - count, mean and variance, updated with welford's method. a batch of
+#   values is reduced with numpy and merged in with the pairwise formula of
+#   chan et al., so a batch costs the same as one value
+# - min and max
+# - a quantile sketch: counts of values in buckets whose bounds grow by a
+#   constant factor, like ddsketch. every quantile it gives is within
+#   --accuracy of the true value relative to that value, and it has at most a
+#   few hundred buckets for times from milliseconds to days
+#
+# all of these are merged by adding them up, so aggregates of separate
+# invocations, e.g. the shards of a sweep, merge into the same statistics as
+# one invocation over all runs. aggregates are saved as json
+#
+# the gatherers write one with --aggregate, and this script merges them,
+# streams matrix files into them in batches and writes the tables:
+#
+# python data_gathering/get_bs2_matrix.py sweep_v2 --aggregate v2.json
+# python data_gathering/get_bs1_matrix.py sweep_v1 --aggregate v1.json
+# python data_gathering/online_aggregate.py v1.json v2.json \
+#     --matrix BiG-SLICE v1.1 bigslice_v1_matrix.csv \
+#     --matrix BiG-SLICE v2.0 bigslice_v2_matrix.csv \
+#     --tables .
+
+from argparse import ArgumentParser
+from pathlib import Path
+import json
+import math
+import re
+import sys
+
+import numpy as np
+
+AGGREGATE_FORMAT = 1
+
+# relative accuracy of the quantiles
+DEFAULT_ACCURACY = 0.01
+
+# columns of a matrix that identify a run instead of timing a phase
+KEY_COLUMNS = ["size", "sample"]
+
+# the size the gatherers give runs of a mode sweep (-f)
+MODE_SIZE = -1
+
+# phases of v2 whose save step is added to them in the tables, as
+# figure_tables.combine_v2_saves does
+SAVE_PHASES = {
+    "hmm_scan": "hmm_scan_save",
+    "hmm_align": "hmm_align_save",
+    "cc_gen": "cc_gen_save",
+}
+
+DEFAULT_QUANTILES = [0.5, 0.9, 0.99]
+
+
+def group_of(size: int, sample):
+    # mode sweep samples are 10k_[mode]_[partition], the mode can have
+    # underscores. the same as figure_tables.average_mode_runs
+    if size == MODE_SIZE:
+        return re.sub("_[0-9]+", "", str(sample).replace("10k_", ""))
+    return int(size)
+
+
+class QuantileSketch:
+    def __init__(self, accuracy: float = DEFAULT_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # bucket index -> count. bucket i holds values in (gamma^(i-1), gamma^i]
+        self.buckets = {}
+        # values of 0 and below, durations are never negative
+        self.zeros = 0
+
+    def add_values(self, values: np.ndarray):
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        indices, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other: "QuantileSketch"):
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"can not merge quantile sketches of accuracy {self.accuracy} and {other.accuracy}")
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q: float):
+        # the value of the bucket that holds the value of rank q * (n - 1)
+        total = self.zeros + sum(self.buckets.values())
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # the middle of the bucket, relative to its bounds
+                return 2 * self.gamma**index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {"zeros": self.zeros, "buckets": {str(index): count for index, count in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict, accuracy: float):
+        sketch = cls(accuracy)
+        sketch.zeros = data["zeros"]
+        sketch.buckets = {int(index): count for index, count in data["buckets"].items()}
+        return sketch
+
+
+class RunningStats:
+    def __init__(self, accuracy: float = DEFAULT_ACCURACY):
+        self.count = 0
+        self.mean = 0.0
+        # sum of squared differences from the mean
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch(accuracy)
+
+    def combine(self, count: int, mean: float, m2: float, minimum: float, maximum: float):
+        # chan et al., welford's update is the case count == 1
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def add_values(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self.combine(len(values), float(mean), float(((values - mean) ** 2).sum()), float(values.min()), float(values.max()))
+        self.sketch.add_values(values)
+
+    def add(self, value: float):
+        self.add_values(np.array([value]))
+
+    def merge(self, other: "RunningStats"):
+        self.combine(other.count, other.mean, other.m2, other.min, other.max)
+        self.sketch.merge(other.sketch)
+
+    def quantile(self, q: float):
+        # min and max are exact, the sketch can be off by the accuracy
+        if self.count == 0:
+            return None
+        return min(max(self.sketch.quantile(q), self.min), self.max)
+
+    def variance(self):
+        # sample variance, like pandas
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            # json has no infinity
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            **self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, accuracy: float):
+        stats = cls(accuracy)
+        stats.count = data["count"]
+        stats.mean = data["mean"]
+        stats.m2 = data["m2"]
+        if stats.count:
+            stats.min = data["min"]
+            stats.max = data["max"]
+        stats.sketch = QuantileSketch.from_dict(data, accuracy)
+        return stats
+
+
+class Aggregate:
+    def __init__(self, accuracy: float = DEFAULT_ACCURACY):
+        self.accuracy = accuracy
+        # (tool, version, group, phase) -> RunningStats
+        self.stats = {}
+
+    def get(self, tool: str, version: str, group, phase: str):
+        key = (tool, version, group, phase)
+        if key not in self.stats:
+            self.stats[key] = RunningStats(self.accuracy)
+        return self.stats[key]
+
+    def add_values(self, tool: str, version: str, phases: list[str], groups: list, values: np.ndarray):
+        # values is (runs, phases) with NaN for nulls, groups the group of
+        # every run
+        rows_of = {}
+        for index, group in enumerate(groups):
+            rows_of.setdefault(group, []).append(index)
+
+        for group, rows in rows_of.items():
+            for index, phase in enumerate(phases):
+                self.get(tool, version, group, phase).add_values(values[rows, index])
+
+    def add_run(self, tool: str, version: str, phases: list[str], size, sample, durations: list):
+        # one run as a gatherer parses it, None for nulls. the gatherers add
+        # their runs as they come in, without keeping a matrix for this
+        group = group_of(size, sample)
+        for phase, seconds in zip(phases, durations):
+            if seconds is not None:
+                self.get(tool, version, group, phase).add(seconds)
+
+    def add_matrix(self, tool: str, version: str, batches):
+        # batches of a matrix as dataframes, see matrix_io.iter_matrix_batches
+        for batch in batches:
+            phases = [column for column in batch.columns if column not in KEY_COLUMNS]
+            groups = [group_of(size, sample) for size, sample in zip(batch["size"], batch["sample"])]
+            values = batch[phases].to_numpy(dtype=np.float64, na_value=np.nan)
+            self.add_values(tool, version, phases, groups, values)
+
+    def merge(self, other: "Aggregate"):
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"can not merge aggregates of accuracy {self.accuracy} and {other.accuracy}")
+        for key, stats in other.stats.items():
+            self.get(*key).merge(stats)
+
+    def save(self, path: Path):
+        data = {
+            "format": AGGREGATE_FORMAT,
+            "accuracy": self.accuracy,
+            "stats": [
+                {"tool": tool, "version": version, "group": group, "phase": phase, **stats.to_dict()}
+                for (tool, version, group, phase), stats in self.sorted_items()
+            ],
+        }
+        Path(path).write_text(json.dumps(data))
+
+    @classmethod
+    def load(cls, path: Path):
+        data = json.loads(Path(path).read_text())
+        if data.get("format") != AGGREGATE_FORMAT:
+            raise ValueError(f"{path} is not an aggregate of format {AGGREGATE_FORMAT}")
+        aggregate = cls(data["accuracy"])
+        for entry in data["stats"]:
+            key = (entry["tool"], entry["version"], entry["group"], entry["phase"])
+            aggregate.stats[key] = RunningStats.from_dict(entry, aggregate.accuracy)
+        return aggregate
+
+    def sorted_items(self):
+        # sizes in order, followed by the modes
+        def sort_key(item):
+            tool, version, group, phase = item[0]
+            return tool, version, isinstance(group, str), group, phase
+
+        return sorted(self.stats.items(), key=sort_key)
+
+    def means(self, tool: str, version: str):
+        # group -> phase -> mean, for the groups and phases that have values
+        means = {}
+        for (key_tool, key_version, group, phase), stats in self.stats.items():
+            if key_tool == tool and key_version == version and stats.count > 0:
+                means.setdefault(group, {})[phase] = stats.mean
+        return means
+
+    def rows(self, quantiles: list[float]):
+        rows = []
+        for (tool, version, group, phase), stats in self.sorted_items():
+            empty = stats.count == 0
+            variance = stats.variance()
+            rows.append(
+                [
+                    tool,
+                    version,
+                    group,
+                    phase,
+                    stats.count,
+                    None if empty else stats.mean,
+                    None if variance is None else math.sqrt(variance),
+                    None if empty else stats.min,
+                    None if empty else stats.max,
+                    *[stats.quantile(q) for q in quantiles],
+                ]
+            )
+        return rows
+
+
+def stats_columns(quantiles: list[float]):
+    return [
+        "tool",
+        "version",
+        "group",
+        "phase",
+        "count",
+        "mean",
+        "std",
+        "min",
+        "max",
+        *[f"p{100 * q:g}" for q in quantiles],
+    ]
+
+
+def add_aggregate_arguments(parser, version: str | None):
+    # for the gatherers. version is the default --tool_version
+    parser.add_argument(
+        "--aggregate",
+        type=Path,
+        default=None,
+        help="also write running statistics per size and phase of this invocation to a json file",
+    )
+    parser.add_argument(
+        "--tool_version",
+        default=version,
+        help=f"version the --aggregate statistics are filed under{'' if version is None else f', {version} by default'}",
+    )
+
+
+def total_runtimes_table(aggregate: Aggregate):
+    # Supplementary_table_3_average_total_runtimes before rounding, the same
+    # as figure_tables.average_totals: the sizes of the BiG-SCAPE v2.0 runs
+    import pandas as pd
+
+    from figure_tables import BIGSCAPE_V1_50K_TOTAL
+
+    labels = [
+        ("BiG-SLICE", "v1.1"),
+        ("BiG-SLICE", "v2.0"),
+        ("BiG-SCAPE", "v1.1"),
+        ("BiG-SCAPE", "v2.0"),
+    ]
+    means = {label: aggregate.means(*label) for label in labels}
+    sizes = sorted(
+        group
+        for group, phases in means[("BiG-SCAPE", "v2.0")].items()
+        if not isinstance(group, str) and "total" in phases
+    )
+
+    totals = pd.DataFrame(index=pd.Index(sizes, name="size"))
+    for tool, version in labels:
+        column = [means[(tool, version)].get(size, {}).get("total", np.nan) for size in sizes]
+        totals[f"{tool} {version}"] = np.array(column, dtype=np.float64)
+
+    totals["Relative performance (2.0.0 v 1.1)"] = totals["BiG-SCAPE v1.1"] / totals["BiG-SCAPE v2.0"]
+
+    totals.loc[50000, "BiG-SCAPE v1.1"] = BIGSCAPE_V1_50K_TOTAL
+
+    return totals
+
+
+def mode_runtimes_table(aggregate: Aggregate, version: str = "v2.0"):
+    # Supplementary_table_4_average_mode_runtimes before rounding
+    import pandas as pd
+
+    means = aggregate.means("BiG-SCAPE", version)
+    modes = sorted(group for group, phases in means.items() if isinstance(group, str) and "total" in phases)
+    return pd.DataFrame({"total": [means[mode]["total"] for mode in modes]}, index=pd.Index(modes, name="sample"))
+
+
+def phase_proportions_table(aggregate: Aggregate, version: str):
+    # one version of Supplementary_File_3 before rounding, the same as
+    # figure_tables.average_proportions. the save steps of v2 are added to
+    # their phase as the sum of the means
+    import pandas as pd
+
+    from figure_tables import STEPS
+
+    means = aggregate.means("BiG-SCAPE", version)
+    sizes = sorted(group for group in means if not isinstance(group, str))
+
+    averages = pd.DataFrame(index=pd.Index(sizes, name="size"))
+    for step in [*STEPS, "total"]:
+        column = []
+        for size in sizes:
+            value = means[size].get(step, np.nan)
+            if step in SAVE_PHASES and SAVE_PHASES[step] in means[size]:
+                value += means[size][SAVE_PHASES[step]]
+            column.append(value)
+        averages[step] = np.array(column, dtype=np.float64)
+
+    prop_abs = averages[STEPS].div(averages["total"], axis=0)
+    prop_abs.columns = [column + "_prop" for column in prop_abs.columns]
+    prop_abs[STEPS] = averages[STEPS]
+    prop_abs.insert(0, "version", version)
+    prop_abs["total_logged"] = averages["total"]
+    return prop_abs
+
+
+def write_tables(aggregate: Aggregate, folder: Path):
+    # the three tables, rounded and written like build_figures.py does
+    import pandas as pd
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    total_runtimes_table(aggregate).round(3).to_csv(folder / "Supplementary_table_3_average_total_runtimes.csv")
+    mode_runtimes_table(aggregate).round(3).to_csv(folder / "Supplementary_table_4_average_mode_runtimes.csv")
+    proportions = pd.concat(
+        [phase_proportions_table(aggregate, "v1.1"), phase_proportions_table(aggregate, "v2.0")], axis=0
+    )
+    proportions.round(3).to_csv(folder / "Supplementary_File_3.csv")
+
+
+if __name__ == "__main__":
+    from matrix_io import iter_matrix_batches, write_matrix
+
+    parser = ArgumentParser(description="Merge running statistics of the gatherers and write the supplementary tables")
+
+    # aggregates written with --aggregate or --save
+    parser.add_argument("aggregates", type=Path, nargs="*")
+
+    # stream a matrix into the statistics: tool, version and the matrix file
+    parser.add_argument("--matrix", nargs=3, action="append", default=[], metavar=("TOOL", "VERSION", "PATH"))
+
+    # rows of a matrix read at a time
+    parser.add_argument("--batch_rows", type=int, default=65536)
+
+    # relative accuracy of the quantiles, for --matrix. merged aggregates
+    # need to have the same
+    parser.add_argument("--accuracy", type=float, default=DEFAULT_ACCURACY)
+
+    # save the merged statistics as an aggregate again
+    parser.add_argument("--save", type=Path, default=None)
+
+    # write the supplementary tables to this folder
+    parser.add_argument("--tables", type=Path, default=None)
+
+    # quantiles of the printed statistics
+    parser.add_argument("-q", "--quantiles", type=float, nargs="+", default=DEFAULT_QUANTILES)
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    args = parser.parse_args()
+
+    if not args.aggregates and not args.matrix:
+        parser.error("give aggregates to merge or a --matrix to read")
+
+    try:
+        aggregate = Aggregate(args.accuracy)
+        for path in args.aggregates:
+            aggregate.merge(Aggregate.load(path))
+        for tool, version, path in args.matrix:
+            aggregate.add_matrix(tool, version, iter_matrix_batches(Path(path), args.batch_rows))
+    except (OSError, ValueError, KeyError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    try:
+        if args.save:
+            aggregate.save(args.save)
+
+        if args.tables:
+            write_tables(aggregate, args.tables)
+    except (OSError, ValueError, KeyError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    if args.save or args.tables:
+        exit(0)
+
+    columns = stats_columns(args.quantiles)
+    rows = aggregate.rows(args.quantiles)
+
+    if args.output:
+        write_matrix(columns, rows, args.output)
+        exit(0)
+
+    print(",".join(columns))
+    for row in rows:
+        print(",".join("" if value is None else str(value) for value in row))
@@ -0,0 +1,172 @@
+# on-disk cache of parsed run folders
+#
+# every folder gets a fingerprint made from the path, size and mtime of the
+# files its timings are read from. if the fingerprint stored in the cache
+# matches the current one, the parsed timestamps are taken from the cache and
+# the folder is not parsed again. only misses are handed to the parser
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+import json
+import sqlite3
+import sys
+
+from folder_pool import map_folders
+import instrumentation
+
+# bump this whenever the parsers change what they extract, so that stale
+# entries from an older version are never used
+CACHE_VERSION = 3
+
+
+def file_fingerprint(folder: Path, files: list[Path]):
+    # path relative to the folder, size and mtime of every input file
+    fingerprint = []
+    instrumentation.count("stat_calls", len(files))
+    for file in files:
+        stat = file.stat()
+        fingerprint.append([str(file.relative_to(folder)), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def encode_times(results):
+    # phase_table rows are stored as they are, in nanoseconds. anything else
+    # has to_list/from_list and datetimes that are stored as iso strings
+    return json.dumps(
+        [
+            result
+            if isinstance(result, list)
+            else [None if time is None else time.isoformat() for time in result.to_list()]
+            for result in results
+        ]
+    )
+
+
+def decode_times(cls, value: str):
+    if cls is None:
+        return json.loads(value)
+    return [
+        cls.from_list([None if time is None else datetime.fromisoformat(time) for time in times])
+        for times in json.loads(value)
+    ]
+
+
+class ParseCache:
+    def __init__(self, db_path: Path, tool: str):
+        self.tool = tool
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS parse_cache ("
+            "tool TEXT NOT NULL, "
+            "version INTEGER NOT NULL, "
+            "folder TEXT NOT NULL, "
+            "fingerprint TEXT NOT NULL, "
+            "times TEXT NOT NULL, "
+            "PRIMARY KEY (tool, folder))"
+        )
+
+    def get(self, folder: Path, fingerprint: str):
+        row = self.conn.execute(
+            "SELECT version, fingerprint, times FROM parse_cache WHERE tool = ? AND folder = ?",
+            (self.tool, str(folder.resolve())),
+        ).fetchone()
+
+        if row is None or row[0] != CACHE_VERSION or row[1] != fingerprint:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row[2]
+
+    def put(self, folder: Path, fingerprint: str, times: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO parse_cache VALUES (?, ?, ?, ?, ?)",
+            (self.tool, CACHE_VERSION, str(folder.resolve()), fingerprint, times),
+        )
+
+    def print_stats(self):
+        print(f"cache: {self.hits} hits, {self.misses} misses", file=sys.stderr)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def map_folders_cached(
+    func,
+    fingerprint_func,
+    cls,
+    folders: list[Path],
+    jobs: int,
+    cache: ParseCache | None,
+    mapper=None,
+    threads: int = 1,
+):
+    # same as map_folders, but answers unchanged folders from the cache.
+    # func returns a list of cls instances for a folder, or of phase_table
+    # rows if cls is None. fingerprint_func returns the fingerprint of the
+    # files func reads. mapper(folders, jobs) can replace map_folders for
+    # parsing the folders that were not cached. with threads > 1 the
+    # fingerprints are taken and the folders parsed in that many threads
+    if mapper is None:
+        mapper = partial(map_folders, func, threads=threads)
+
+    instrumentation.count("folders_visited", len(folders))
+
+    if cache is None:
+        yield from mapper(folders, jobs)
+        return
+
+    cached = {}
+    to_parse = []
+    fingerprints = {}
+
+    def get_fingerprint(folder: Path):
+        try:
+            return json.dumps(fingerprint_func(folder))
+        except OSError:
+            return None
+
+    with instrumentation.stage("cache_lookup"):
+        if threads > 1:
+            # the stat calls are what is slow on a network filesystem
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                folder_fingerprints = list(executor.map(get_fingerprint, folders))
+        else:
+            folder_fingerprints = map(get_fingerprint, folders)
+
+        for folder, fingerprint in zip(folders, folder_fingerprints):
+            if fingerprint is None:
+                # missing inputs, let the parser report on this folder
+                cache.misses += 1
+                to_parse.append(folder)
+                continue
+
+            times = cache.get(folder, fingerprint)
+            if times is None:
+                fingerprints[folder] = fingerprint
+                to_parse.append(folder)
+            else:
+                cached[folder] = decode_times(cls, times)
+
+    parsed = {}
+    for folder, execution_times in mapper(to_parse, jobs):
+        parsed[folder] = execution_times
+        if folder in fingerprints:
+            cache.put(folder, fingerprints[folder], encode_times(execution_times))
+
+    cache.print_stats()
+    instrumentation.count("cache_hits", cache.hits)
+    instrumentation.count("cache_misses", cache.misses)
+
+    # hand everything back in the original folder order
+    for folder in folders:
+        if folder in cached:
+            yield folder, cached[folder]
+        elif folder in parsed:
+            yield folder, parsed[folder]
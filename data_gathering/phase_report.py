@@ -0,0 +1,227 @@
+# cpu and memory use per phase of a run
+#
+# joins the samples of a run's .profile with the phase boundaries of the same
+# run: the log timestamps for BiG-SCAPE 2 (get_bs2_matrix), the result file
+# timestamps for BiG-SCAPE 1 (get_bs1_matrix). both are naive wall clock
+# times of the machine the run was on, like the profile times, so they line
+# up. a profile with a UTC offset in its times is refused, it would shift
+# every phase by that offset
+#
+# the samples are first summed per sample time over the processes, with the
+# same rules get_performance_run uses. each sample stands for the time since
+# the previous sample, which is what profile_sampler.py measures cpu over.
+# the phase of every sample is found with one np.searchsorted over the phase
+# starts, and everything per phase is summed with np.bincount. a sample that
+# straddles a phase boundary is counted for the phase it was taken in
+#
+# per phase:
+# - cpu_seconds, the cpu time used by all processes together
+# - mean_cores, cpu_seconds per second of the phase
+# - efficiency, mean_cores out of --cores
+# - mean and peak memory, and which phase holds the peak of the run
+# - mean and peak number of processes
+#
+# python data_gathering/phase_report.py --cores 64 \
+#     --run v1 runs/v1/25000_1_1 runs/v1/25000_1_1/run.profile \
+#     --run v2 runs/v2/25000_1_1 runs/v2/25000_1_1/run.profile
+
+from argparse import ArgumentParser
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+
+from bs1_tree import scan_v1_run
+from get_bs1_matrix import PHASES as BS1_PHASES
+from get_bs2_matrix import PHASES as BS2_PHASES, get_execution_time, get_files
+from get_performance_run import get_profile_start, iter_profile_matrix
+from matrix_io import write_matrix
+from profile_rollup import iter_rollup
+
+# durations of the matrix that are not a phase of their own
+NOT_PHASES = ["start", "total"]
+
+REPORT_COLUMNS = [
+    "version",
+    "run",
+    "phase",
+    "seconds",
+    "samples",
+    "cpu_seconds",
+    "mean_cores",
+    "efficiency",
+    "mean_memory_mb",
+    "peak_memory_mb",
+    "run_peak",
+    "mean_processes",
+    "peak_processes",
+]
+
+
+def phase_intervals(schema, timestamps: list[int | None]):
+    # (phase, begin, end) in nanoseconds, in the order of the run. phases
+    # with a missing timestamp are left out
+    intervals = []
+    for column, begin, end in schema.durations:
+        if column in NOT_PHASES:
+            continue
+        begin_time = timestamps[schema.index(begin)]
+        end_time = timestamps[schema.index(end)]
+        if begin_time is not None and end_time is not None:
+            intervals.append((column, begin_time, end_time))
+    return intervals
+
+
+def get_run_phases(version: str, folder: Path):
+    # run name -> phase intervals. a v2 folder can have more than one log
+    if version == "v1":
+        return {folder.name: phase_intervals(BS1_PHASES, BS1_PHASES.row_from(scan_v1_run(folder)))}
+
+    return {
+        log_file.name: phase_intervals(BS2_PHASES, get_execution_time(log_file))
+        for log_file in sorted(get_files(folder))
+    }
+
+
+def get_samples(profile: Path, version: str):
+    # one row per sample time, with the time in nanoseconds, the cpu of all
+    # processes together and the memory and process count of the run
+    start = get_profile_start(profile, version)
+    if start.tzinfo is not None:
+        raise ValueError(
+            f"{profile} has times with a UTC offset ({start.isoformat()}), "
+            "the phase times of the run have none, so they can not be lined up"
+        )
+    # nanoseconds since the epoch, like phase_table.to_ns gives for naive times
+    start = start.value
+    rollup = pd.concat(list(iter_rollup(iter_profile_matrix(profile, version), 0)), ignore_index=True)
+
+    times = start + np.round(rollup["seconds"].to_numpy() * 1e9).astype(np.int64)
+    return pd.DataFrame(
+        {
+            "time": times,
+            # a bucket of 0 seconds is one sample, the mean times the number
+            # of rows is the sum over the processes
+            "cpu": rollup["cpu_mean"].to_numpy() * rollup["samples"].to_numpy(),
+            # only one row per sample carries these, depending on the format
+            "memory_mb": rollup["mem_used_mb_max"].to_numpy(),
+            "processes": rollup["processes_max"].to_numpy(),
+        }
+    )
+
+
+def join_phases(times: np.ndarray, intervals: list[tuple[str, int, int]]):
+    # index into intervals for every sample time, -1 outside all phases
+    begins = np.array([begin for _phase, begin, _end in intervals], dtype=np.int64)
+    ends = np.array([end for _phase, _begin, end in intervals], dtype=np.int64)
+    # phases follow each other, but searchsorted needs that to be certain
+    order = np.argsort(begins, kind="stable")
+
+    index = np.searchsorted(begins[order], times, side="right") - 1
+    inside = index >= 0
+    index[inside] = order[index[inside]]
+    inside[inside] = times[inside] < ends[index[inside]]
+    return np.where(inside, index, -1)
+
+
+def phase_utilization(samples: pd.DataFrame, intervals: list[tuple[str, int, int]], cores: int | None):
+    # report rows without version and run, in the order of intervals
+    times = samples["time"].to_numpy()
+    # every sample covers the time since the previous one
+    covered = np.diff(times, prepend=times[0]) / 1e9
+
+    index = join_phases(times, intervals)
+    inside = index >= 0
+    index = index[inside]
+    covered = covered[inside]
+    cpu = samples["cpu"].to_numpy()[inside]
+    memory = samples["memory_mb"].to_numpy()[inside]
+    processes = samples["processes"].to_numpy()[inside]
+
+    phases = len(intervals)
+    counts = np.bincount(index, minlength=phases)
+    covered_seconds = np.bincount(index, covered, minlength=phases)
+    cpu_seconds = np.bincount(index, cpu * covered, minlength=phases)
+    memory_seconds = np.bincount(index, memory * covered, minlength=phases)
+    process_seconds = np.bincount(index, processes * covered, minlength=phases)
+
+    peak_memory = np.full(phases, np.nan)
+    np.fmax.at(peak_memory, index, memory)
+    peak_processes = np.full(phases, np.nan)
+    np.fmax.at(peak_processes, index, processes)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_cores = cpu_seconds / covered_seconds
+        mean_memory = memory_seconds / covered_seconds
+        mean_processes = process_seconds / covered_seconds
+
+    run_peak = peak_memory == np.nanmax(peak_memory) if counts.any() else np.zeros(phases, dtype=bool)
+
+    rows = []
+    for phase, (name, begin, end) in enumerate(intervals):
+        if counts[phase] == 0:
+            rows.append([name, (end - begin) / 1e9, 0, *[None] * 9])
+            continue
+        rows.append(
+            [
+                name,
+                (end - begin) / 1e9,
+                int(counts[phase]),
+                float(cpu_seconds[phase]),
+                float(mean_cores[phase]),
+                None if cores is None else float(mean_cores[phase] / cores),
+                float(mean_memory[phase]),
+                float(peak_memory[phase]),
+                bool(run_peak[phase]),
+                float(mean_processes[phase]),
+                float(peak_processes[phase]),
+            ]
+        )
+    return rows
+
+
+def phase_report(runs: list[tuple[str, Path, Path]], cores: int | None = None):
+    # runs are (version, run folder, profile)
+    rows = []
+    for version, folder, profile in runs:
+        samples = get_samples(profile, version)
+        for run, intervals in get_run_phases(version, folder).items():
+            for row in phase_utilization(samples, intervals, cores):
+                rows.append([version, run, *row])
+    return rows
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Report cpu and memory use per phase of a run")
+
+    # a run to report on: v1 or v2, its run folder and its .profile
+    parser.add_argument("--run", nargs=3, action="append", required=True, metavar=("VERSION", "FOLDER", "PROFILE"))
+
+    # cores available to the runs, for the parallel efficiency
+    parser.add_argument("-c", "--cores", type=int, default=None)
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    args = parser.parse_args()
+
+    runs = []
+    for version, folder, profile in args.run:
+        if version not in ("v1", "v2"):
+            parser.error(f"version should be v1 or v2, not {version}")
+        runs.append((version, Path(folder), Path(profile)))
+
+    try:
+        rows = phase_report(runs, args.cores)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    if args.output:
+        write_matrix(REPORT_COLUMNS, rows, args.output)
+        exit(0)
+
+    print(",".join(REPORT_COLUMNS))
+    for row in rows:
+        print(",".join("" if value is None else str(value) for value in row))
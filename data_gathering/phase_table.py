@@ -0,0 +1,114 @@
+# phase timestamps of many runs as one table
+#
+# every gatherer used to keep an ExecutionTime dataclass per run and turn it
+# into seconds one subtraction at a time, each with its own idea of what a
+# missing phase means. instead, a PhaseSchema lists the timestamps a tool
+# records for a run and the durations the matrix reports, as pairs of those
+# timestamps. the parsers produce one row of timestamps per run, as int64
+# nanoseconds or None, and a PhaseTable collects the rows of all runs into a
+# single int64 array, so all durations of all runs are one vectorized
+# subtraction
+#
+# a duration is null when either of its timestamps is missing, the other
+# durations of that run are still reported
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import math
+
+import numpy as np
+
+# stands in for a missing timestamp in the int64 array. the same value numpy
+# uses for NaT
+NULL = np.iinfo(np.int64).min
+
+NS_PER_SECOND = 1_000_000_000
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_ns(time: datetime | None):
+    # nanoseconds since the epoch. log times have no time zone, they are
+    # only ever subtracted from times of the same run
+    if time is None:
+        return None
+    epoch = EPOCH if time.tzinfo is None else EPOCH_UTC
+    return (time - epoch) // timedelta(microseconds=1) * 1000
+
+
+@dataclass
+class PhaseSchema:
+    # timestamps of a run, in the order they are written
+    timestamps: list[str]
+    # matrix column, then the timestamps it is measured from and to
+    durations: list[tuple[str, str, str]]
+
+    def header(self):
+        return [column for column, _begin, _end in self.durations]
+
+    def index(self, timestamp: str):
+        return self.timestamps.index(timestamp)
+
+    def new_row(self):
+        return [None] * len(self.timestamps)
+
+    def durations_of(self, row: list[int | None]):
+        # the durations of one row in seconds, None where a timestamp is
+        # missing. the same values as PhaseTable.durations
+        seconds = []
+        for _column, begin, end in self.durations:
+            begin, end = row[self.index(begin)], row[self.index(end)]
+            seconds.append(None if begin is None or end is None else (end - begin) / NS_PER_SECOND)
+        return seconds
+
+    def row_from(self, record):
+        # a row from anything with the timestamps as datetime attributes
+        return [to_ns(getattr(record, timestamp)) for timestamp in self.timestamps]
+
+
+class PhaseTable:
+    def __init__(self, schema: PhaseSchema):
+        self.schema = schema
+        # what identifies each run in the matrix, e.g. [size, sample]
+        self.keys = []
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, key: list, row: list[int | None]):
+        self.keys.append(key)
+        self.rows.append(row)
+
+    def missing(self, index: int):
+        # names of the timestamps a run does not have
+        return [
+            timestamp for timestamp, value in zip(self.schema.timestamps, self.rows[index]) if value is None
+        ]
+
+    def timestamps(self):
+        stamps = np.full((len(self.rows), len(self.schema.timestamps)), NULL, dtype=np.int64)
+        for index, row in enumerate(self.rows):
+            stamps[index] = [NULL if value is None else value for value in row]
+        return stamps
+
+    def durations(self):
+        # (runs, durations) in seconds, NaN where a timestamp is missing
+        stamps = self.timestamps()
+        begin = stamps[:, [self.schema.index(begin) for _column, begin, _end in self.schema.durations]]
+        end = stamps[:, [self.schema.index(end) for _column, _begin, end in self.schema.durations]]
+
+        missing = (begin == NULL) | (end == NULL)
+        # the differences of missing timestamps overflow, they are masked
+        with np.errstate(over="ignore"):
+            seconds = (end - begin) / NS_PER_SECOND
+        seconds[missing] = np.nan
+        return seconds
+
+    def to_rows(self):
+        # key followed by the durations, with None for nulls
+        return [
+            [*key, *[None if math.isnan(value) else value for value in durations]]
+            for key, durations in zip(self.keys, self.durations().tolist())
+        ]
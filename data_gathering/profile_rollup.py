@@ -0,0 +1,143 @@
+# time bucket rollups of profile matrices
+#
+# the matrix from get_performance_run has one row per process per sample. for
+# plotting, only a few numbers per time bucket are needed, so the rows are
+# aggregated into buckets of a fixed width while the chunks stream past.
+# a bucket is written out as soon as a later bucket of the same version, or a
+# chunk of the next version, has been seen, so only the one open bucket is kept
+# in memory and the output is ordered by version and time.
+#
+# optionally, the rolled up series can be downsampled further to a fixed
+# number of points with largest triangle three buckets (LTTB), which keeps
+# peaks and dips that plain averaging would flatten
+
+import numpy as np
+import pandas as pd
+
+# rows of a matrix csv read at a time by read_rollup
+READ_CHUNK_SIZE = 1_000_000
+
+ROLLUP_VALUES = ["cpu", "processes", "mem_used_mb", "memused_percent"]
+
+ROLLUP_COLUMNS = ["version", "seconds", "samples"] + [
+    f"{value}_{stat}" for value in ROLLUP_VALUES for stat in ["mean", "max"]
+]
+
+
+def bucket_partials(matrix: pd.DataFrame, bucket_seconds: float):
+    # sum, count and max per version and bucket for one chunk
+    if bucket_seconds > 0:
+        buckets = np.floor(matrix["seconds"].to_numpy() / bucket_seconds) * bucket_seconds
+    else:
+        # no bucketing, group on the exact sample times
+        buckets = matrix["seconds"].to_numpy()
+
+    grouped = matrix.assign(seconds=buckets).groupby(["version", "seconds"], sort=True)[ROLLUP_VALUES]
+
+    partials = grouped.sum().add_suffix("_sum")
+    partials = partials.join(grouped.max().add_suffix("_max"))
+    partials["samples"] = grouped.size()
+    return partials
+
+
+def merge_partials(left: pd.DataFrame, right: pd.DataFrame):
+    combined = pd.concat([left, right])
+    grouped = combined.groupby(level=["version", "seconds"], sort=True)
+
+    merged = grouped[[f"{value}_sum" for value in ROLLUP_VALUES] + ["samples"]].sum()
+    return merged.join(grouped[[f"{value}_max" for value in ROLLUP_VALUES]].max())
+
+
+def finalize_partials(partials: pd.DataFrame):
+    rollup = pd.DataFrame(index=partials.index)
+    rollup["samples"] = partials["samples"]
+    for value in ROLLUP_VALUES:
+        rollup[f"{value}_mean"] = partials[f"{value}_sum"] / partials["samples"]
+        rollup[f"{value}_max"] = partials[f"{value}_max"]
+    return rollup.reset_index()[ROLLUP_COLUMNS]
+
+
+def iter_rollup(matrix_chunks, bucket_seconds: float):
+    # matrix_chunks are matrix dataframes, sorted by time within each version,
+    # with all chunks of a version before the chunks of the next one
+    open_partials = None
+
+    for matrix in matrix_chunks:
+        if len(matrix) == 0:
+            continue
+        partials = bucket_partials(matrix, bucket_seconds)
+        if open_partials is not None:
+            partials = merge_partials(open_partials, partials)
+
+        # only the last bucket of the version this chunk ends in may still get
+        # more samples from the next chunk. earlier versions are done, so their
+        # last bucket is written out before the buckets of the next version
+        versions = partials.index.get_level_values("version")
+        seconds = partials.index.get_level_values("seconds")
+        is_current = versions == matrix["version"].iloc[-1]
+        is_open = is_current & (seconds == seconds[is_current].max())
+
+        if (~is_open).any():
+            yield finalize_partials(partials[~is_open])
+        open_partials = partials[is_open]
+
+    if open_partials is not None and len(open_partials) > 0:
+        yield finalize_partials(open_partials)
+
+
+def read_rollup(path, bucket_seconds: float = 0, chunksize: int = READ_CHUNK_SIZE):
+    # rollup of a matrix csv written by get_performance_run, read in chunks so
+    # only one chunk of the matrix is in memory at a time
+    chunks = pd.read_csv(path, chunksize=chunksize)
+    return pd.concat(list(iter_rollup(chunks, bucket_seconds)), ignore_index=True)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int):
+    # returns the indices of the points to keep
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = length - 1
+
+    # every bucket except the first and the last point
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        # average of the next bucket, or the last point for the final bucket
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            average_x = x[next_start:next_end].mean()
+            average_y = y[next_start:next_end].mean()
+        else:
+            average_x, average_y = x[-1], y[-1]
+
+        # the point that forms the largest triangle with the previously
+        # selected point and the average of the next bucket
+        areas = np.abs(
+            (x[selected] - average_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (average_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+
+    return indices
+
+
+def downsample_rollup(rollup: pd.DataFrame, points: int, value: str = "cpu_mean"):
+    # lttb per version on one value column, whole rows are kept
+    downsampled = []
+    for _version, series in rollup.groupby("version", sort=False):
+        series = series.sort_values("seconds")
+        keep = lttb(
+            series["seconds"].to_numpy(dtype=np.float64),
+            series[value].to_numpy(dtype=np.float64),
+            points,
+        )
+        downsampled.append(series.iloc[keep])
+    return pd.concat(downsampled, ignore_index=True)
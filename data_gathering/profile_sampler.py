@@ -0,0 +1,261 @@
+# resource sampler that writes .profile files for get_performance_run
+#
+# the .profile files of the paper come from an external sampler whose MAIN,
+# MULTI and CHILD rows mean different things for v1 and v2. this one reads
+# /proc directly and writes its own, versioned format:
+#
+# # profile format 1
+# time,type,pid,ppid,cpu,rss_mb,threads,processes,mem_used_mb,mem_total_mb
+#
+# every sample is one TREE row with the totals of the process tree (rss_mb,
+# threads, processes) and the memory use of the whole system, followed by a
+# PROC row per process in the tree with its cpu use since the previous
+# sample (1.0 is one core), rss and thread count
+#
+# the sampler only keeps the cpu ticks of the processes that are alive and
+# writes every sample out as soon as it is taken, so its memory use does not
+# grow with the length of the run. a sample reads a few small files per
+# process, at 1 sample per second that is well under 1% of a core
+#
+# python data_gathering/profile_sampler.py -o run.profile -- bigscape cluster ...
+# python data_gathering/profile_sampler.py -o run.profile --pid 12345
+
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+import os
+import resource
+import subprocess
+import sys
+import time
+
+SAMPLER_FORMAT = 1
+
+SAMPLER_HEADER = "# profile format "
+
+SAMPLER_COLUMNS = [
+    "time",
+    "type",
+    "pid",
+    "ppid",
+    "cpu",
+    "rss_mb",
+    "threads",
+    "processes",
+    "mem_used_mb",
+    "mem_total_mb",
+]
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def read_proc_file(path: str):
+    # None if the process exited in the meantime
+    try:
+        with open(path, "rb") as file:
+            return file.read().decode()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+
+
+def read_stat(pid: int):
+    # ppid, cpu ticks, threads, rss pages and start time of a process
+    text = read_proc_file(f"/proc/{pid}/stat")
+    if text is None:
+        return None
+
+    # the command name is in parentheses and can contain spaces, fields are
+    # counted from the state after it, which is field 3 in man proc
+    fields = text[text.rindex(")") + 2 :].split()
+    ppid = int(fields[1])
+    ticks = int(fields[11]) + int(fields[12])
+    threads = int(fields[17])
+    start = int(fields[19])
+    rss = int(fields[21])
+    return ppid, ticks, threads, rss, start
+
+
+def read_children(pid: int):
+    # child pids from /proc/[pid]/task/*/children, or None if the kernel does
+    # not have them
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except FileNotFoundError:
+        return []
+
+    children = []
+    for task in tasks:
+        text = read_proc_file(f"/proc/{pid}/task/{task}/children")
+        if text is None:
+            if not os.path.exists(f"/proc/{pid}/task/{task}"):
+                # thread ended while listing
+                continue
+            return None
+        children.extend(int(child) for child in text.split())
+    return children
+
+
+def scan_children():
+    # parent -> children for every process, from a full scan of /proc
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        stat = read_stat(int(entry))
+        if stat is not None:
+            children.setdefault(stat[0], []).append(int(entry))
+    return children
+
+
+def process_tree(root: int):
+    # root and all its descendants
+    tree = []
+    pending = [root]
+    scanned = None
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        children = read_children(pid) if scanned is None else None
+        if children is None:
+            if scanned is None:
+                scanned = scan_children()
+            children = scanned.get(pid, [])
+        pending.extend(children)
+    return tree
+
+
+def read_meminfo():
+    # used and total system memory in MB
+    values = {}
+    for line in read_proc_file("/proc/meminfo").splitlines():
+        name, _sep, value = line.partition(":")
+        if name in ("MemTotal", "MemAvailable"):
+            values[name] = int(value.split()[0]) / 1024
+    return values["MemTotal"] - values["MemAvailable"], values["MemTotal"]
+
+
+class Sampler:
+    def __init__(self, root: int, file):
+        self.root = root
+        self.file = file
+        # (pid, start time) -> cpu ticks at the previous sample, for the
+        # processes that were alive then. the start time tells a reused pid
+        # apart from the process that had it before
+        self.previous = {}
+        self.previous_time = None
+        self.samples = 0
+
+    def write_header(self):
+        self.file.write(f"{SAMPLER_HEADER}{SAMPLER_FORMAT}\n")
+        self.file.write(",".join(SAMPLER_COLUMNS) + "\n")
+
+    def sample(self):
+        # writes one sample, returns False once the process tree is gone
+        now = time.monotonic()
+        timestamp = datetime.now().isoformat(timespec="microseconds")
+        elapsed = None if self.previous_time is None else now - self.previous_time
+
+        current = {}
+        rows = []
+        total_rss = 0.0
+        total_threads = 0
+        for pid in process_tree(self.root):
+            stat = read_stat(pid)
+            if stat is None:
+                continue
+            ppid, ticks, threads, rss, start = stat
+
+            before = self.previous.get((pid, start))
+            cpu = 0.0
+            if before is not None and elapsed:
+                cpu = (ticks - before) / CLOCK_TICKS / elapsed
+            current[(pid, start)] = ticks
+
+            rss_mb = rss * PAGE_MB
+            total_rss += rss_mb
+            total_threads += threads
+            rows.append(f"{timestamp},PROC,{pid},{ppid},{cpu:.3f},{rss_mb:.2f},{threads},,,\n")
+
+        if not rows:
+            return False
+
+        mem_used, mem_total = read_meminfo()
+        self.file.write(
+            f"{timestamp},TREE,,,,{total_rss:.2f},{total_threads},{len(rows)},{mem_used:.2f},{mem_total:.2f}\n"
+        )
+        self.file.writelines(rows)
+        self.file.flush()
+
+        self.previous = current
+        self.previous_time = now
+        self.samples += 1
+        return True
+
+
+def run_sampler(root: int, output: Path, interval: float, is_running):
+    # samples every interval seconds, on a fixed schedule so that slow
+    # samples do not make the series drift, until the tree is gone or
+    # is_running() returns False
+    with open(output, "w") as file:
+        sampler = Sampler(root, file)
+        sampler.write_header()
+
+        next_time = time.monotonic()
+        while sampler.sample() and is_running():
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # fell behind, skip the samples that were missed
+                next_time = time.monotonic()
+
+    return sampler.samples
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Sample the cpu and memory use of a process tree into a .profile")
+    parser.add_argument("-o", "--output", type=Path, required=True)
+
+    # seconds between samples
+    parser.add_argument("-i", "--interval", type=float, default=1.0)
+
+    # sample a running process instead of starting a command
+    parser.add_argument("-p", "--pid", type=int, default=None)
+
+    # command to start and sample, after --
+    parser.add_argument("command", nargs="*")
+
+    args = parser.parse_args()
+
+    if (args.pid is None) == (not args.command):
+        parser.error("give either --pid or a command to run")
+
+    if args.pid is not None:
+        root = args.pid
+        process = None
+
+        def is_running():
+            return os.path.exists(f"/proc/{root}")
+
+    else:
+        process = subprocess.Popen(args.command)
+        root = process.pid
+
+        def is_running():
+            return process.poll() is None
+
+    # cpu time of the sampler itself, without starting python
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    samples = run_sampler(root, args.output, args.interval, is_running)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu_seconds = after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+    print(
+        f"{samples} samples, {1000 * cpu_seconds / max(samples, 1):.2f} ms cpu per sample",
+        file=sys.stderr,
+    )
+
+    exit(process.wait() if process is not None else 0)
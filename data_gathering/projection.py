@@ -0,0 +1,167 @@
+# runtime projection with bootstrap confidence intervals
+#
+# crash_estimation.ipynb extrapolates the runtime of the crashed 50k v1 run
+# from a polynomial fit on the smaller runs. to get bounds on that estimate,
+# the runs are resampled with replacement many times and the polynomial is
+# refit on every resample. instead of calling np.polyfit in a loop, all
+# resamples of a batch are solved together: one stacked design matrix, one
+# np.linalg.pinv call. a resample that happens to contain no more distinct
+# sizes than the order has no unique fit, pinv would quietly return one of
+# many and polyfit would only warn, so such resamples are drawn again
+#
+# the interval is the percentile interval of the projected values
+
+from dataclasses import dataclass
+
+import numpy as np
+
+# resamples solved in one call. bounds memory to batch * runs * (order + 1)
+BATCH_SIZE = 4096
+
+
+@dataclass
+class Projection:
+    column: str
+    target: float
+    # projection of the fit on all runs, the same as np.polyfit gives
+    estimate: float
+    lower: float
+    upper: float
+    confidence: float
+    resamples: int
+
+    def to_list(self):
+        return [
+            self.column,
+            self.target,
+            self.estimate,
+            self.lower,
+            self.upper,
+            self.confidence,
+            self.resamples,
+        ]
+
+
+PROJECTION_COLUMNS = ["column", "target", "estimate", "lower", "upper", "confidence", "resamples"]
+
+
+def batched_polyfit(x: np.ndarray, y: np.ndarray, order: int):
+    # x and y are (resamples, runs). returns (resamples, order + 1)
+    # coefficients, highest power first like np.polyfit
+    design = x[..., np.newaxis] ** np.arange(order, -1, -1)
+    return np.einsum("bkn,bn->bk", np.linalg.pinv(design), y)
+
+
+def batched_polyval(coefficients: np.ndarray, x: float):
+    return coefficients @ (x ** np.arange(coefficients.shape[-1] - 1, -1, -1))
+
+
+def distinct_counts(x: np.ndarray):
+    # number of distinct values in every row of x
+    ordered = np.sort(x, axis=1)
+    return (np.diff(ordered, axis=1) != 0).sum(axis=1) + 1
+
+
+def bootstrap_projections(
+    x: np.ndarray,
+    y: np.ndarray,
+    target: float,
+    order: int = 2,
+    resamples: int = 10000,
+    seed: int = 0,
+):
+    # the projected value at target for every resample of the runs
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    if len(np.unique(x)) <= order:
+        raise ValueError(f"need more than {order} distinct sizes to fit an order {order} polynomial")
+
+    # sizes go up to 50000, so powers are taken of scaled sizes to keep the
+    # least squares well conditioned
+    scale = np.abs(x).max()
+    x = x / scale
+
+    rng = np.random.default_rng(seed)
+    projections = []
+    projected = 0
+    while projected < resamples:
+        batch = min(BATCH_SIZE, resamples - projected)
+        indices = rng.integers(0, len(x), size=(batch, len(x)))
+        # leave out the resamples that can not be fit, the next batch
+        # draws their replacements
+        indices = indices[distinct_counts(x[indices]) > order]
+        coefficients = batched_polyfit(x[indices], y[indices], order)
+        projections.append(batched_polyval(coefficients, target / scale))
+        projected += len(indices)
+
+    return np.concatenate(projections)
+
+
+def project(
+    x: np.ndarray,
+    y: np.ndarray,
+    target: float,
+    order: int = 2,
+    resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    column: str = "",
+):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    if len(np.unique(x)) <= order:
+        raise ValueError(f"need more than {order} distinct sizes to fit an order {order} polynomial")
+
+    estimate = np.polyval(np.polyfit(x, y, order), target)
+    projections = bootstrap_projections(x, y, target, order, resamples, seed)
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(projections, [alpha, 1 - alpha])
+
+    return Projection(column, target, float(estimate), float(lower), float(upper), confidence, resamples)
+
+
+def project_column(
+    matrix,
+    column: str,
+    target: float = 50000,
+    size_column: str = "size",
+    order: int = 2,
+    resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = 0,
+):
+    # fits a runtime column of a matrix from the gatherers against the size.
+    # rows at the target size and rows without a value are left out
+    rows = matrix[(matrix[size_column] != target) & matrix[column].notna()]
+    return project(
+        rows[size_column].to_numpy(),
+        rows[column].to_numpy(),
+        target,
+        order,
+        resamples,
+        confidence,
+        seed,
+        column,
+    )
+
+
+def project_columns(
+    matrix,
+    columns: list[str],
+    target: float = 50000,
+    size_column: str = "size",
+    order: int = 2,
+    resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = 0,
+):
+    # project_column for every column, as a dataframe with one row each
+    import pandas as pd
+
+    projections = [
+        project_column(matrix, column, target, size_column, order, resamples, confidence, seed).to_list()
+        for column in columns
+    ]
+    return pd.DataFrame(projections, columns=PROJECTION_COLUMNS)
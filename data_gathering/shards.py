@@ -0,0 +1,199 @@
+# sharded gathering over several nodes, and the merge of the shards
+#
+# with --shard I/N, a matrix script only parses the run folders whose name
+# hashes to shard I out of N, and writes its rows to the --output file as a
+# partial result. next to it goes a manifest, [output].shard.json, with the
+# tool, the shard, the names of the run folders the shard was given and the
+# number and a hash of all run folders of the sweep. the hash is over the
+# folder name only, so nodes that mount the sweep under different paths still
+# agree on which shard a run belongs to
+#
+# merging reads all partials of a sweep and writes the same sorted matrix an
+# unsharded run would have printed. it refuses to merge when a shard is
+# missing or given twice, when partials are from different tools or shard
+# counts, or when a run folder or a size,sample row shows up in more than one
+# shard. it also refuses when the shards saw different sweeps, e.g. because a
+# run folder appeared between two shard invocations, or when a run folder of
+# the sweep is in none of the shards
+#
+# locally, processes can stand in for the nodes:
+# for i in 0 1 2 3; do
+#     python data_gathering/get_bs2_matrix.py sweep --shard $i/4 -o part_$i.parquet &
+# done; wait
+# python data_gathering/shards.py part_*.parquet -o bigscape_v2_matrix.parquet
+
+from argparse import ArgumentParser, ArgumentTypeError
+from pathlib import Path
+import hashlib
+import json
+import math
+import sys
+
+from matrix_io import load_matrix, write_matrix
+
+
+def parse_shard(value: str):
+    # I/N, with 0 <= I < N
+    index, _sep, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ArgumentTypeError(f"shard should look like 0/4, not {value}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ArgumentTypeError(f"shard {value} is not one of 0/{count} to {count - 1}/{count}")
+    return index, count
+
+
+def add_shard_argument(parser):
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        metavar="I/N",
+        help="only parse shard I of N of the run folders, and write a partial result to --output",
+    )
+
+
+def shard_of(folder: Path, count: int):
+    # python's own hash of a string changes between processes
+    digest = hashlib.sha256(Path(folder).name.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def select_shard(folders: list[Path], shard: tuple[int, int]):
+    index, count = shard
+    return [folder for folder in folders if shard_of(folder, count) == index]
+
+
+def get_manifest_path(path: Path):
+    return Path(f"{path}.shard.json")
+
+
+def hash_folders(names: list[str]):
+    # hash of the sorted run folder names of a sweep
+    return hashlib.sha256("\n".join(sorted(names)).encode()).hexdigest()
+
+
+def write_partial(
+    tool: str,
+    shard: tuple[int, int],
+    folders: list[Path],
+    sweep_folders: list[Path],
+    columns: list[str],
+    rows: list[list],
+    path: Path,
+):
+    write_matrix(columns, rows, path)
+    manifest = {
+        "tool": tool,
+        "shard": shard[0],
+        "shards": shard[1],
+        "columns": columns,
+        "folders": sorted(folder.name for folder in folders),
+        "sweep_folders": len(sweep_folders),
+        "sweep_hash": hash_folders([folder.name for folder in sweep_folders]),
+    }
+    get_manifest_path(path).write_text(json.dumps(manifest, indent=1))
+
+
+def matrix_rows(path: Path):
+    # rows with plain python values and None for nulls, like the scripts
+    # produce them
+    matrix = load_matrix(path)
+    return [
+        [None if value is None or (isinstance(value, float) and math.isnan(value)) else value for value in row]
+        for row in matrix.astype(object).itertuples(index=False)
+    ]
+
+
+def merge_partials(paths: list[Path]):
+    # columns and sorted rows of the full matrix. raises ValueError when the
+    # partials do not add up to exactly one copy of every shard
+    manifests = {}
+    for path in paths:
+        manifest_path = get_manifest_path(path)
+        if not manifest_path.exists():
+            raise ValueError(f"{path} has no {manifest_path.name}, it is not a partial result")
+        manifests[path] = json.loads(manifest_path.read_text())
+        if "sweep_hash" not in manifests[path]:
+            raise ValueError(f"{manifest_path.name} has no sweep_hash, gather shard {path} again")
+
+    first = next(iter(manifests.values()))
+    for path, manifest in manifests.items():
+        for key in ["tool", "shards", "columns"]:
+            if manifest[key] != first[key]:
+                raise ValueError(f"{path} has {key} {manifest[key]}, other partials have {first[key]}")
+        if manifest["sweep_folders"] != first["sweep_folders"] or manifest["sweep_hash"] != first["sweep_hash"]:
+            raise ValueError(
+                f"{path} was gathered from {manifest['sweep_folders']} run folders, other partials from "
+                f"{first['sweep_folders']}. the run folders of the sweep changed between shards"
+            )
+
+    count = first["shards"]
+    shard_paths = {}
+    for path, manifest in manifests.items():
+        index = manifest["shard"]
+        if index in shard_paths:
+            raise ValueError(f"shard {index}/{count} is in both {shard_paths[index]} and {path}")
+        shard_paths[index] = path
+
+    missing = [str(index) for index in range(count) if index not in shard_paths]
+    if missing:
+        raise ValueError(f"missing shards {', '.join(missing)} of {count}")
+
+    folder_paths = {}
+    for path, manifest in manifests.items():
+        for folder in manifest["folders"]:
+            if folder in folder_paths:
+                raise ValueError(f"run folder {folder} is in both {folder_paths[folder]} and {path}")
+            if shard_of(folder, count) != manifest["shard"]:
+                raise ValueError(f"run folder {folder} in {path} does not belong to shard {manifest['shard']}")
+            folder_paths[folder] = path
+
+    if len(folder_paths) != first["sweep_folders"] or hash_folders(list(folder_paths)) != first["sweep_hash"]:
+        raise ValueError(
+            f"the shards cover {len(folder_paths)} of the {first['sweep_folders']} run folders of the sweep"
+        )
+
+    rows = []
+    key_paths = {}
+    for path in paths:
+        partial = matrix_rows(path)
+        # a bs2 run folder can have more than one log, so keys may repeat
+        # within one partial, but never between partials
+        for key in {(row[0], row[1]) for row in partial}:
+            if key in key_paths:
+                raise ValueError(f"size,sample {key[0]},{key[1]} is in both {key_paths[key]} and {path}")
+            key_paths[key] = path
+        rows.extend(partial)
+
+    def sort_key(result):
+        return result[0], result[1]
+
+    return first["columns"], sorted(rows, key=sort_key)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Merge the partial results of a sharded matrix script")
+    parser.add_argument("partials", type=Path, nargs="+")
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    args = parser.parse_args()
+
+    try:
+        columns, rows = merge_partials(args.partials)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    if args.output:
+        write_matrix(columns, rows, args.output)
+        exit(0)
+
+    print(",".join(columns))
+
+    for result in rows:
+        str_list = ["" if value is None else str(value) for value in result]
+        print(",".join(str_list))
@@ -0,0 +1,554 @@
+# one sqlite file with the results of every sweep and tool
+#
+# the gatherer matrices, the crash timings and the ganglia memory exports are
+# appended to a single database, one sweep at a time:
+#
+# - sweeps: one row per ingested file, with its kind (matrix, crash_timings
+#   or ganglia), tool, version, where it came from and a hash of its contents
+# - sweep_metadata: free key/value pairs per sweep, e.g. host or commit
+# - runs: one row per run of a sweep, with mode, size and replicate parsed
+#   from the size and sample columns for filtering, and the size and sample
+#   as the gatherer wrote them, e.g. -1 and 10k_legacy_1 for a mode sweep
+# - phases: the phase names, and sweep_columns the order of the phase
+#   columns in the ingested file and whether they only held integers
+# - timings: seconds per run and phase, null when the gatherer had none
+# - memory: the samples of a ganglia export, in bytes, for its run
+#
+# the run_timings view joins these back into one row per run and phase.
+# runs are indexed on sweep, mode and size and timings on phase, so the
+# usual questions (one tool and version, a range of sizes, one phase) do not
+# scan the whole database
+#
+# ingesting a file under a sweep name that already exists is skipped when
+# the contents are the same and refused when they are not, unless --replace
+# is given. nothing else in the database is touched, so adding a new sweep is
+# an append and not a rebuild
+#
+# python data_gathering/warehouse.py results.db --source_data source_data
+# python data_gathering/warehouse.py results.db --matrix BiG-SCAPE v2.1 new/bigscape_v2_matrix.parquet \
+#     --name bigscape_v2.1_matrix --meta host=node12
+# python data_gathering/warehouse.py results.db --tool BiG-SCAPE --phase total --size 1000
+#
+# from a notebook:
+# with Warehouse("results.db") as warehouse:
+#     matrix = warehouse.matrix(sweep="bigscape_v2_matrix")
+
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import math
+import re
+import sqlite3
+import sys
+
+from matrix_io import iter_matrix_batches, resolve_matrix_path, write_matrix
+
+# bump this when the schema changes, older databases are refused
+WAREHOUSE_VERSION = 2
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS sweeps ("
+    "id INTEGER PRIMARY KEY, "
+    "name TEXT NOT NULL UNIQUE, "
+    "kind TEXT NOT NULL, "
+    "tool TEXT NOT NULL, "
+    "version TEXT NOT NULL, "
+    "source TEXT NOT NULL, "
+    "fingerprint TEXT NOT NULL, "
+    "ingested TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS sweep_metadata ("
+    "sweep_id INTEGER NOT NULL REFERENCES sweeps(id) ON DELETE CASCADE, "
+    "key TEXT NOT NULL, "
+    "value TEXT, "
+    "PRIMARY KEY (sweep_id, key))",
+    "CREATE TABLE IF NOT EXISTS runs ("
+    "id INTEGER PRIMARY KEY, "
+    "sweep_id INTEGER NOT NULL REFERENCES sweeps(id) ON DELETE CASCADE, "
+    "mode TEXT, "
+    "size INTEGER, "
+    "replicate INTEGER, "
+    # size and sample as the gatherer wrote them. sample has no type, so an
+    # integer sample stays an integer
+    "matrix_size INTEGER, "
+    "sample NOT NULL, "
+    # row of the run in the ingested file
+    "position INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS phases (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS sweep_columns ("
+    "sweep_id INTEGER NOT NULL REFERENCES sweeps(id) ON DELETE CASCADE, "
+    "phase_id INTEGER NOT NULL REFERENCES phases(id), "
+    "position INTEGER NOT NULL, "
+    "integer INTEGER NOT NULL, "
+    "PRIMARY KEY (sweep_id, phase_id))",
+    "CREATE TABLE IF NOT EXISTS timings ("
+    "run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE, "
+    "phase_id INTEGER NOT NULL REFERENCES phases(id), "
+    "seconds REAL, "
+    "PRIMARY KEY (run_id, phase_id)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS memory ("
+    "run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE, "
+    "sample INTEGER NOT NULL, "
+    "seconds REAL, "
+    "use REAL, share REAL, cache REAL, buffer REAL, swap REAL, total REAL, "
+    "PRIMARY KEY (run_id, sample)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS sweeps_tool ON sweeps (tool, version, kind)",
+    "CREATE INDEX IF NOT EXISTS runs_sweep ON runs (sweep_id, mode, size)",
+    "CREATE INDEX IF NOT EXISTS runs_size ON runs (size)",
+    "CREATE INDEX IF NOT EXISTS timings_phase ON timings (phase_id, run_id)",
+    "CREATE VIEW IF NOT EXISTS run_timings AS "
+    "SELECT sweeps.name AS sweep, sweeps.kind, sweeps.tool, sweeps.version, "
+    "runs.mode, runs.size, runs.replicate, runs.matrix_size, runs.sample, runs.position, "
+    "phases.name AS phase, timings.seconds "
+    "FROM timings "
+    "JOIN runs ON runs.id = timings.run_id "
+    "JOIN sweeps ON sweeps.id = runs.sweep_id "
+    "JOIN phases ON phases.id = timings.phase_id",
+]
+
+# memory columns in the order of the memory table
+MEMORY_METRICS = ["use", "share", "cache", "buffer", "swap", "total"]
+
+# what the files of the source data tarball are: kind, tool, version and for
+# the ganglia exports the size of the run they were taken during
+SOURCE_FILES = {
+    "bigscape_v1_matrix": ("matrix", "BiG-SCAPE", "v1.1", None),
+    "bigscape_v2_matrix": ("matrix", "BiG-SCAPE", "v2.0", None),
+    "bigslice_v1_matrix": ("matrix", "BiG-SLICE", "v1.1", None),
+    "bigslice_v2_matrix": ("matrix", "BiG-SLICE", "v2.0", None),
+    "bigscape_v2_mode_10k_matrix": ("matrix", "BiG-SCAPE", "v2.0", None),
+    "bigscape_v1_crash_timings": ("crash_timings", "BiG-SCAPE", "v1.1", None),
+    "ganglia_memory_v1_25000": ("ganglia", "BiG-SCAPE", "v1.1", 25000),
+    "ganglia_memory_v2_25000": ("ganglia", "BiG-SCAPE", "v2.0", 25000),
+    "ganglia_memory_v2_as_db": ("ganglia", "BiG-SCAPE", "v2.0", None),
+}
+
+# columns of the run_timings view that queries can filter on
+FILTERS = ["sweep", "kind", "tool", "version", "mode", "size", "replicate", "phase"]
+
+# samples of a mode sweep (get_bs2_matrix -f) are [size]k_[mode]_[replicate]
+MODE_SAMPLE = re.compile(r"^(\d+)k_(.+)_(\d+)$")
+
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def hash_file(path: Path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_run(size, sample):
+    # mode, size and replicate of a matrix row
+    match = MODE_SAMPLE.match(str(sample))
+    if match is not None:
+        return match.group(2), int(match.group(1)) * 1000, int(match.group(3))
+
+    size = None if size is None or int(size) < 0 else int(size)
+    replicate = int(sample) if str(sample).isdigit() else None
+    return None, size, replicate
+
+
+def to_sql(value):
+    # numpy scalars and NaN from pandas, as sqlite values
+    if value is None:
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class Warehouse:
+    def __init__(self, db_path: Path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        empty = self.conn.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0
+        if not empty and version != WAREHOUSE_VERSION:
+            self.conn.close()
+            raise ValueError(f"{db_path} is a version {version} warehouse, this is version {WAREHOUSE_VERSION}")
+
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+            self.conn.execute(f"PRAGMA user_version = {WAREHOUSE_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def phase_id(self, name: str):
+        self.conn.execute("INSERT OR IGNORE INTO phases (name) VALUES (?)", (name,))
+        return self.conn.execute("SELECT id FROM phases WHERE name = ?", (name,)).fetchone()[0]
+
+    def next_id(self, table: str):
+        return self.conn.execute(f"SELECT coalesce(max(id), 0) + 1 FROM {table}").fetchone()[0]
+
+    def start_sweep(
+        self,
+        name: str,
+        kind: str,
+        tool: str,
+        version: str,
+        path: Path,
+        metadata: dict,
+        replace: bool,
+    ):
+        # id of the new sweep, or None if the same file is already in under
+        # this name. must be called inside a transaction
+        fingerprint = hash_file(path)
+        existing = self.conn.execute("SELECT id, fingerprint FROM sweeps WHERE name = ?", (name,)).fetchone()
+        if existing is not None:
+            if existing[1] == fingerprint and not replace:
+                return None
+            if not replace:
+                raise ValueError(f"sweep {name} is already in the warehouse from a different file, use --replace")
+            # runs, timings, memory and metadata go with it
+            self.conn.execute("DELETE FROM sweeps WHERE id = ?", (existing[0],))
+
+        cursor = self.conn.execute(
+            "INSERT INTO sweeps (name, kind, tool, version, source, fingerprint, ingested) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, kind, tool, version, str(Path(path).resolve()), fingerprint, datetime.now().isoformat()),
+        )
+        sweep_id = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT INTO sweep_metadata VALUES (?, ?, ?)",
+            [(sweep_id, key, value) for key, value in metadata.items()],
+        )
+        return sweep_id
+
+    def ingest_matrix(
+        self,
+        path: Path,
+        tool: str,
+        version: str,
+        name: str | None = None,
+        kind: str = "matrix",
+        metadata: dict | None = None,
+        replace: bool = False,
+        batch_rows: int = 65536,
+    ):
+        # a gatherer matrix or crash timings table: size and sample columns
+        # followed by columns of seconds. returns the number of runs added,
+        # or None if the sweep was already in
+        path = resolve_matrix_path(path)
+        name = name or path.stem
+
+        with self.conn:
+            sweep_id = self.start_sweep(name, kind, tool, version, path, metadata or {}, replace)
+            if sweep_id is None:
+                return None
+
+            position = 0
+            # phase columns that were integers in every batch, matrix() casts
+            # them back
+            integer_phases = None
+            for batch in iter_matrix_batches(path, batch_rows):
+                columns = list(batch.columns)
+                phases = [column for column in columns if column not in ("size", "sample")]
+                phase_ids = [self.phase_id(phase) for phase in phases]
+                phase_indices = [columns.index(phase) for phase in phases]
+                integers = {phase for phase in phases if batch[phase].dtype.kind in "iu"}
+                integer_phases = integers if integer_phases is None else integer_phases & integers
+
+                run_id = self.next_id("runs")
+                runs = []
+                timings = []
+                for row in batch.itertuples(index=False):
+                    row = [to_sql(value) for value in row]
+                    matrix_size = row[columns.index("size")]
+                    sample = row[columns.index("sample")]
+                    mode, size, replicate = parse_run(matrix_size, sample)
+                    runs.append((run_id, sweep_id, mode, size, replicate, matrix_size, sample, position))
+                    for phase_id, index in zip(phase_ids, phase_indices):
+                        timings.append((run_id, phase_id, row[index]))
+                    run_id += 1
+                    position += 1
+
+                self.conn.executemany("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", runs)
+                self.conn.executemany("INSERT INTO timings VALUES (?, ?, ?)", timings)
+
+            if integer_phases is not None:
+                self.conn.executemany(
+                    "INSERT INTO sweep_columns VALUES (?, ?, ?, ?)",
+                    [
+                        (sweep_id, phase_id, index, int(phase in integer_phases))
+                        for index, (phase, phase_id) in enumerate(zip(phases, phase_ids))
+                    ],
+                )
+
+        return position
+
+    def ingest_ganglia(
+        self,
+        path: Path,
+        tool: str,
+        version: str,
+        size: int | None = None,
+        replicate: int | None = None,
+        name: str | None = None,
+        metadata: dict | None = None,
+        replace: bool = False,
+    ):
+        # a ganglia memory export, as one run with its memory samples.
+        # returns the number of samples added, or None if it was already in
+        from ganglia_align import load_ganglia
+
+        path = Path(path)
+        name = name or path.stem
+        ganglia = load_ganglia(path, tuple(MEMORY_METRICS), unit="B")
+
+        with self.conn:
+            sweep_id = self.start_sweep(name, "ganglia", tool, version, path, metadata or {}, replace)
+            if sweep_id is None:
+                return None
+
+            run_id = self.next_id("runs")
+            sample = path.stem if replicate is None else str(replicate)
+            self.conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, sweep_id, None, size, replicate, size, sample, 0),
+            )
+            columns = ["sample", "seconds", *MEMORY_METRICS]
+            self.conn.executemany(
+                f"INSERT INTO memory VALUES (?, {', '.join('?' * len(columns))})",
+                ((run_id, *[to_sql(value) for value in row]) for row in ganglia[columns].itertuples(index=False)),
+            )
+
+        return len(ganglia)
+
+    def ingest_source_data(self, folder: Path, metadata: dict | None = None, replace: bool = False):
+        # every known file of the source data tarball that is in folder.
+        # returns (name, added) pairs, added is None for files already in
+        results = []
+        for name, (kind, tool, version, size) in SOURCE_FILES.items():
+            try:
+                path = resolve_matrix_path(Path(folder) / name)
+            except FileNotFoundError:
+                continue
+            if kind == "ganglia":
+                added = self.ingest_ganglia(path, tool, version, size, None, name, metadata, replace)
+            else:
+                added = self.ingest_matrix(path, tool, version, name, kind, metadata, replace)
+            results.append((name, added))
+        return results
+
+    def query(self, sql: str, params: tuple = ()):
+        # any query, as a dataframe
+        import pandas as pd
+
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def where(self, filters: dict):
+        # WHERE clause and parameters for the run_timings columns. a filter
+        # value can be a single value or a list of values
+        clauses = []
+        params = []
+        for column, value in filters.items():
+            if column not in FILTERS:
+                raise ValueError(f"can not filter on {column}, only on {', '.join(FILTERS)}")
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple)) else [value]
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), tuple(params)
+
+    def sweeps(self):
+        return self.query(
+            "SELECT sweeps.name, kind, tool, version, source, ingested, count(runs.id) AS runs "
+            "FROM sweeps LEFT JOIN runs ON runs.sweep_id = sweeps.id "
+            "GROUP BY sweeps.id ORDER BY sweeps.id"
+        )
+
+    def metadata(self, sweep: str):
+        rows = self.conn.execute(
+            "SELECT key, value FROM sweep_metadata JOIN sweeps ON sweeps.id = sweep_id WHERE sweeps.name = ?",
+            (sweep,),
+        ).fetchall()
+        return dict(rows)
+
+    def timings(self, **filters):
+        # one row per run and phase, e.g. timings(tool="BiG-SCAPE",
+        # version=["v1.1", "v2.0"], phase="total")
+        where, params = self.where(filters)
+        return self.query(
+            "SELECT sweep, kind, tool, version, mode, size, replicate, sample, phase, seconds "
+            f"FROM run_timings{where} ORDER BY sweep, position, phase",
+            params,
+        )
+
+    def matrix(self, **filters):
+        # the same filters as timings, one row per run with a column per
+        # phase like the gatherers write, in the order of the ingested files.
+        # size and sample are the ones from the files, not the parsed ones
+        where, params = self.where(filters)
+        long = self.query(
+            "SELECT sweep, position, matrix_size AS size, sample, phase, seconds "
+            f"FROM run_timings{where} ORDER BY sweep, position",
+            params,
+        )
+        columns = self.conn.execute(
+            "SELECT sweeps.name, phases.name, integer FROM sweep_columns "
+            "JOIN sweeps ON sweeps.id = sweep_id JOIN phases ON phases.id = phase_id "
+            "ORDER BY sweeps.id, sweep_columns.position"
+        ).fetchall()
+        present = set(long["phase"])
+        sweeps = set(long["sweep"])
+        columns = [(phase, integer) for sweep, phase, integer in columns if sweep in sweeps and phase in present]
+        phases = list(dict.fromkeys(phase for phase, _integer in columns))
+        floats = {phase for phase, integer in columns if not integer}
+
+        # pivot on the run only, samples of different sweeps can be a mix of
+        # integers and text that can not be sorted together
+        runs = long.drop_duplicates(["sweep", "position"])[["sweep", "position", "size", "sample"]]
+        matrix = long.pivot(index=["sweep", "position"], columns="phase", values="seconds")[phases]
+        matrix = runs.merge(matrix.reset_index(), on=["sweep", "position"]).drop(columns="position")
+        for phase in phases:
+            if phase not in floats and not matrix[phase].isna().any():
+                matrix[phase] = matrix[phase].astype("int64")
+        return matrix.rename_axis(columns=None)
+
+    def memory(self, sweep: str):
+        # the samples of an ingested ganglia export, in bytes
+        return self.query(
+            "SELECT memory.sample, memory.seconds, "
+            + ", ".join(f"memory.{metric}" for metric in MEMORY_METRICS)
+            + " FROM memory JOIN runs ON runs.id = memory.run_id JOIN sweeps ON sweeps.id = runs.sweep_id "
+            "WHERE sweeps.name = ? ORDER BY memory.sample",
+            (sweep,),
+        )
+
+
+def parse_metadata(values: list[str]):
+    metadata = {}
+    for value in values:
+        key, sep, text = value.partition("=")
+        if not sep or not key:
+            raise ValueError(f"metadata should look like key=value, not {value}")
+        metadata[key] = text
+    return metadata
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Ingest gatherer results into one sqlite file, or query it")
+    parser.add_argument("database", type=Path)
+
+    # ingest every known file of the source data tarball in this folder
+    parser.add_argument("--source_data", type=Path, default=None)
+
+    # ingest a matrix of a gatherer
+    parser.add_argument("--matrix", nargs=3, action="append", default=[], metavar=("TOOL", "VERSION", "PATH"))
+
+    # ingest a crash timings table of get_bs1_crash_estimation
+    parser.add_argument(
+        "--crash_timings", nargs=3, action="append", default=[], metavar=("TOOL", "VERSION", "PATH")
+    )
+
+    # ingest a ganglia memory export taken during a run of this size
+    parser.add_argument("--ganglia", nargs=4, action="append", default=[], metavar=("TOOL", "VERSION", "SIZE", "PATH"))
+
+    # sweep name of a single --matrix, --crash_timings or --ganglia, the
+    # file name without suffix by default
+    parser.add_argument("--name", default=None)
+
+    # key=value pairs stored with every sweep ingested by this call
+    parser.add_argument("--meta", action="append", default=[])
+
+    # replace sweeps that are already in under the same name
+    parser.add_argument("--replace", action="store_true")
+
+    # print the ingested sweeps
+    parser.add_argument("--list", action="store_true")
+
+    # filters of the printed timings, when nothing is ingested
+    parser.add_argument("--sweep", action="append", default=None)
+    parser.add_argument("--kind", action="append", default=None)
+    parser.add_argument("--tool", action="append", default=None)
+    parser.add_argument("--version", action="append", default=None)
+    parser.add_argument("--mode", action="append", default=None)
+    parser.add_argument("--size", type=int, action="append", default=None)
+    parser.add_argument("--phase", action="append", default=None)
+
+    # print one row per run instead of one per run and phase
+    parser.add_argument("--wide", action="store_true")
+
+    # write a .parquet/.arrow/.feather/.csv file instead of printing csv
+    parser.add_argument("-o", "--output", type=Path, default=None)
+
+    args = parser.parse_args()
+
+    files = len(args.matrix) + len(args.crash_timings) + len(args.ganglia)
+    if args.name is not None and (files != 1 or args.source_data is not None):
+        parser.error("--name needs exactly one --matrix, --crash_timings or --ganglia")
+
+    try:
+        metadata = parse_metadata(args.meta)
+        warehouse = Warehouse(args.database)
+    except (ValueError, sqlite3.Error) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    ingested = []
+    try:
+        if args.source_data is not None:
+            ingested.extend(warehouse.ingest_source_data(args.source_data, metadata, args.replace))
+        for kind, entries in [("matrix", args.matrix), ("crash_timings", args.crash_timings)]:
+            for tool, version, path in entries:
+                added = warehouse.ingest_matrix(Path(path), tool, version, args.name, kind, metadata, args.replace)
+                ingested.append((args.name or resolve_matrix_path(Path(path)).stem, added))
+        for tool, version, size, path in args.ganglia:
+            added = warehouse.ingest_ganglia(
+                Path(path), tool, version, int(size), None, args.name, metadata, args.replace
+            )
+            ingested.append((args.name or Path(path).stem, added))
+    except (OSError, ValueError, KeyError, sqlite3.Error) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        warehouse.close()
+        exit(1)
+
+    for name, added in ingested:
+        if added is None:
+            print(f"{name}: already in the warehouse", file=sys.stderr)
+        else:
+            print(f"{name}: added {added} rows", file=sys.stderr)
+
+    if files or args.source_data is not None:
+        warehouse.close()
+        exit(0)
+
+    if args.list:
+        table = warehouse.sweeps()
+    else:
+        filters = {
+            "sweep": args.sweep,
+            "kind": args.kind,
+            "tool": args.tool,
+            "version": args.version,
+            "mode": args.mode,
+            "size": args.size,
+            "phase": args.phase,
+        }
+        table = warehouse.matrix(**filters) if args.wide else warehouse.timings(**filters)
+    warehouse.close()
+
+    columns = list(table.columns)
+    rows = [[to_sql(value) for value in row] for row in table.itertuples(index=False)]
+
+    if args.output:
+        write_matrix(columns, rows, args.output)
+        exit(0)
+
+    print(",".join(columns))
+    for row in rows:
+        print(",".join("" if value is None else str(value) for value in row))